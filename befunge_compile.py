@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# befungeshell - an interactive shell to help writing befunge programs
+# Copyright (C) 2011 Simon Liedtke
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+'''Compile a befunge program ahead of time into a Python module which runs
+on its own. Every block of the control flow graph of the program becomes a
+function which returns the number of the block to continue with, and a loop
+calls them one after the other. The commands are compiled exactly like the
+interpreter compiles straight-line segments.
+
+The module does not import befunge_shell. If the program changes one of its
+own commands with p, the module continues with the small interpreter which
+it contains.'''
+from __future__ import with_statement
+
+import os
+import sys
+from inspect import getsource
+from optparse import OptionParser
+
+from befunge_shell import (ControlFlowGraph, Playfield, InputSource,
+                           _StackOperations, _fixed_width_operators,
+                           _fixed_width_wrap,
+                           _segment_statements, OPERATORS, CELL_MODES,
+                           STRAIGHT_LINE_COMMANDS, UNBOUNDED)
+
+_HEADER = '''\
+#!/usr/bin/env python
+# compiled from %(name)s by befunge-compile, do not edit
+"""%(name)s as a Python module. Run it as a script, or call run() with a
+Machine."""
+import re
+import sys
+from functools import partial
+from operator import add, sub, mul, floordiv, mod, gt as greater
+from random import choice
+
+WIDTH = %(width)d
+HEIGHT = %(height)d
+DIRECTIONS = {'>': (1, 0), '<': (-1, 0), '^': (0, -1), 'v': (0, 1)}
+'''
+
+_MACHINE = '''\
+class Machine(object):
+    """The stack and the playfield of the program, and where its input comes
+    from and its output goes to"""
+    def __init__(self, stdin=None, stdout=None):
+        self.stack = Stack()
+        self.rows = [bytearray(b' ') * WIDTH for _ in range(HEIGHT)]
+        for y, line in enumerate(SOURCE.splitlines()[:HEIGHT]):
+            for x, char in enumerate(line[:WIDTH]):
+                code = ord(char)
+                self.rows[y][x] = code if code < 256 else 32
+        self.overflow = {}
+        self.stdout = sys.stdout if stdout is None else stdout
+        self.input_source = InputSource(
+            sys.stdin if stdin is None else stdin,
+            before_read=self.stdout.flush)
+
+    def calculate(self, operator):
+        if len(self.stack) >= 2:
+            first = self.stack.pop()
+            second = self.stack.pop()
+            self.stack.append(int(operator(second, first)))
+
+    def not_(self):
+        self.stack.append(int(not self.stack.pop_exceptionless()))
+
+    def output_int(self):
+        self.stdout.write('%d ' % self.stack.pop_exceptionless())
+
+    def output_char(self):
+        self.stdout.write(chr(self.stack.pop_exceptionless()))
+
+    def input_int(self):
+        self.stack.append(wrap(self.input_source.read_int()))
+
+    def input_char(self):
+        char = self.input_source.read_char()
+        self.stack.append(ord(char) if char else -1)
+
+    def get(self):
+        y = self.stack.pop_exceptionless()
+        x = self.stack.pop_exceptionless()
+        value = self.overflow.get((x, y))
+        if value is None:
+            value = self.rows[y][x] if 0 <= x < WIDTH and 0 <= y < HEIGHT \\
+                else 32
+        self.stack.append(value)
+
+    def put(self):
+        """Store a value in the playfield and return its position if this
+        changed a command, None otherwise"""
+        y = self.stack.pop_exceptionless()
+        x = self.stack.pop_exceptionless()
+        value = self.stack.pop_exceptionless()
+        if not (0 <= x < WIDTH and 0 <= y < HEIGHT):
+            self.overflow[x, y] = value
+            return None
+        if 0 <= value < 256:
+            self.overflow.pop((x, y), None)
+        else:
+            self.overflow[x, y] = value
+        if self.rows[y][x] != value % 256:
+            self.rows[y][x] = value % 256
+            return x, y
+
+
+COMMANDS = {
+    '!': Machine.not_,
+    ':': lambda machine: machine.stack.duplicate_top(),
+    '\\\\': lambda machine: machine.stack.swap_topmost_values(),
+    '$': lambda machine: machine.stack.pop_exceptionless(),
+    '.': Machine.output_int,
+    ',': Machine.output_char,
+    '&': Machine.input_int,
+    '~': Machine.input_char,
+    'g': Machine.get,
+    'p': Machine.put,
+}
+for command, operator in operators.items():
+    COMMANDS[command] = partial(Machine.calculate, operator=operator)
+for digit in range(10):
+    COMMANDS[str(digit)] = partial(
+        lambda machine, digit: machine.stack.append(digit), digit=digit)
+
+
+def interpret(machine, x, y, dx, dy):
+    """Run the program from the cell x, y in the direction dx, dy one
+    command at a time. Used when the program has changed its commands."""
+    rows = machine.rows
+    stack = machine.stack
+    string_mode = False
+    while True:
+        char = chr(rows[y][x])
+        if string_mode:
+            if char == '"':
+                string_mode = False
+            else:
+                stack.append(ord(char))
+        elif char in COMMANDS:
+            COMMANDS[char](machine)
+        elif char in DIRECTIONS:
+            dx, dy = DIRECTIONS[char]
+        elif char == '_':
+            dx, dy = (-1, 0) if stack.pop_exceptionless() else (1, 0)
+        elif char == '|':
+            dx, dy = (0, -1) if stack.pop_exceptionless() else (0, 1)
+        elif char == '?':
+            dx, dy = choice([DIRECTIONS[pc] for pc in '><^v'])
+        elif char == '"':
+            string_mode = True
+        elif char == '#':
+            x = (x + dx) % WIDTH
+            y = (y + dy) % HEIGHT
+        elif char == '@':
+            return None
+        x = (x + dx) % WIDTH
+        y = (y + dy) % HEIGHT
+
+
+def run(machine):
+    """Run the compiled program on *machine* until it ends"""
+    blocks = BLOCKS
+    stack = machine.stack
+    block = 0
+    while block is not None:
+        block = blocks[block](stack, machine)
+    machine.stdout.flush()
+
+
+def main():
+    run(Machine())
+'''
+
+
+def _operator_source(cells):
+    if cells == UNBOUNDED:
+        # the names which the header imports from the module operator
+        names = {'+': 'add', '-': 'sub', '*': 'mul', '/': 'floordiv',
+                 '%': 'mod', '`': 'greater'}
+        lines = ['operators = {']
+        lines.extend('    %r: %s,' % (command, names[command])
+                     for command in sorted(OPERATORS))
+        lines.append('}')
+        # the values which & reads fit into the cells
+        lines.append('wrap = int')
+    else:
+        lines = [getsource(_fixed_width_operators),
+                 'operators = _fixed_width_operators(%s)' % cells[3:],
+                 getsource(_fixed_width_wrap),
+                 'wrap = _fixed_width_wrap(%s)' % cells[3:]]
+    lines.extend('operator_%d = operators[%r]' % (ord(command), command)
+                 for command in sorted(OPERATORS))
+    return '\n'.join(lines)
+
+
+class _BlockCompiler(object):
+    '''Write one function per block of a ControlFlowGraph'''
+    def __init__(self, graph, cells):
+        self.graph = graph
+        self.cells = cells
+        self.numbers = dict(
+            (state, number) for number, state in enumerate(graph.blocks))
+
+    def function(self, number, block):
+        rows = self.graph.playfield.rows
+        width, height = self.graph.playfield.width, self.graph.playfield.height
+        lines = ['def block_%d(stack, machine):' % number,
+                 '    # %d,%d %s' % (block.start[0], block.start[1],
+                                     ''.join(block.commands) or 'spaces')]
+        body = []
+        commands = []
+        string_values = []
+
+        def flush():
+            body.extend(_segment_statements(''.join(commands), self.cells))
+            del commands[:]
+            if string_values:
+                body.append('stack.extend(%r)' % (tuple(string_values),))
+                del string_values[:]
+        x, y, dx, dy = block.start
+        string_mode = False
+        if block.branch is None and not block.successors:
+            # an endless loop in string mode, which only the interpreter
+            # can run
+            body.append('return interpret(machine, %d, %d, %d, %d)' % (
+                x, y, dx, dy))
+        else:
+            for x, y in block.cells:
+                char = chr(rows[y][x])
+                if string_mode:
+                    if char == '"':
+                        string_mode = False
+                    else:
+                        if commands:
+                            flush()
+                        string_values.append(ord(char))
+                    continue
+                if string_values and char != ' ':
+                    flush()
+                if char in STRAIGHT_LINE_COMMANDS:
+                    commands.append(char)
+                elif char in '><^v':
+                    dx, dy = {'>': (1, 0), '<': (-1, 0),
+                              '^': (0, -1), 'v': (0, 1)}[char]
+                elif char == '"':
+                    string_mode = True
+                elif char == 'g':
+                    flush()
+                    body.append('machine.get()')
+                elif char == 'p':
+                    flush()
+                    # a changed command may invalidate the compiled blocks
+                    body.append('if machine.put() in REACHABLE:')
+                    body.append('    return interpret(machine, %d, %d, %d, '
+                                '%d)' % ((x + dx) % width, (y + dy) % height,
+                                         dx, dy))
+            flush()
+            exit, loops = self.branch(number, block)
+            body.extend(exit)
+            if loops:
+                # the block can continue with itself, so it loops in place
+                # instead of returning to the loop of run; an idle loop has
+                # no statements at all
+                body = ['while True:'] + [
+                    '    ' + line for line in body or ['pass']]
+        lines.extend('    ' + line for line in body)
+        return '\n'.join(lines)
+
+    def branch(self, number, block):
+        '''Return the statements which end the block number *number*, and
+        whether the block can start again afterwards'''
+        successors = [self.numbers[state] for state in block.successors]
+        if block.branch in ('_', '|'):
+            nonzero, zero = successors
+            if nonzero == zero == number:
+                return ['stack.pop_exceptionless()'], True
+            if nonzero == number:
+                return ['if not stack.pop_exceptionless():',
+                        '    return %d' % zero], True
+            if zero == number:
+                return ['if stack.pop_exceptionless():',
+                        '    return %d' % nonzero], True
+            return ['return %d if stack.pop_exceptionless() else %d' % (
+                nonzero, zero)], False
+        if block.branch == '?':
+            return ['return choice(%r)' % (tuple(successors),)], False
+        if block.branch == '@':
+            return ['return None'], False
+        if successors[0] == number:
+            return [], True
+        return ['return %d' % successors[0]], False
+
+
+def compile_program(source, cells=UNBOUNDED, name='<program>'):
+    '''Return the source of a Python module which runs the befunge program
+    *source* with cells of the mode *cells*'''
+    playfield = Playfield(source)
+    graph = ControlFlowGraph(playfield)
+    compiler = _BlockCompiler(graph, cells)
+    parts = [
+        _HEADER % dict(name=name, width=playfield.width,
+                       height=playfield.height),
+        getsource(InputSource),
+        "_INPUT_TOKEN = re.compile(r'\\s*(\\S*)')",
+        getsource(_StackOperations),
+        'class Stack(_StackOperations, list):\n    pass',
+        _operator_source(cells),
+        _MACHINE,
+        'SOURCE = %r' % source,
+        # the cells which the compiled blocks were compiled from
+        'REACHABLE = frozenset(%r)' % (sorted(graph.reachable),),
+    ]
+    parts.extend(compiler.function(number, block)
+                 for number, block in enumerate(graph.blocks.values()))
+    parts.append('BLOCKS = [%s]' % ', '.join(
+        'block_%d' % number for number in range(len(graph.blocks))))
+    parts.append("if __name__ == '__main__':\n    main()")
+    return '\n\n\n'.join(part.rstrip('\n') for part in parts) + '\n'
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog PROGRAM [-o FILE]')
+    parser.add_option(
+        '-o', '--output', metavar='FILE',
+        help='write the module to FILE (default: PROGRAM with the '
+             'extension .py)')
+    parser.add_option(
+        '--cells', choices=list(CELL_MODES), default=UNBOUNDED,
+        help='the values a cell can hold, see befunge-shell --help '
+             '(default: %default)')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('give exactly one program')
+    with open(args[0]) as f:
+        source = f.read()
+    output = options.output or os.path.splitext(args[0])[0] + '.py'
+    module = compile_program(source, options.cells, os.path.basename(args[0]))
+    with open(output, 'w') as f:
+        f.write(module)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# befungeshell - an interactive shell to help writing befunge programs
+# Copyright (C) 2011 Simon Liedtke
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+'''Run many befunge programs, or one program with many inputs, in parallel
+processes. Every job gets a fresh interpreter in its worker process.'''
+from __future__ import with_statement
+
+import sys
+import time
+from collections import namedtuple
+from functools import partial
+from optparse import OptionParser
+
+try:
+    from StringIO import StringIO
+except ImportError:  # python3
+    from io import StringIO
+
+from concurrent.futures import ProcessPoolExecutor
+
+from befunge_shell import BefungeInterpreter, Limits
+
+# limit is the name of the field of Limits which stopped the program, or None
+RunResult = namedtuple('RunResult', 'output steps wall_time error limit')
+
+
+def run_job(job, limits=None):
+    '''Run the program *source* of the job (source, stdin) with the string
+    *stdin* as its input and return a RunResult. If the program fails, the
+    error message is stored in the result instead of raising it. *limits*
+    (see befunge_shell.Limits) stop programs which run too long.
+
+    '''
+    source, stdin = job
+    output = StringIO()
+    interpreter = BefungeInterpreter(
+        source, stdin=StringIO(stdin), stdout=output, limits=limits)
+    start = time.time()
+    result = interpreter.execute()
+    return RunResult(output.getvalue(), result.steps, time.time() - start,
+                     result.error, result.limit)
+
+
+def run_many(jobs, max_workers=None, limits=None):
+    '''Run the (source, stdin) pairs of the iterable *jobs* in a pool of
+    *max_workers* processes (one per CPU by default) and yield a RunResult
+    for every job, in the order of *jobs*. With one worker, the jobs are run
+    in the current process. Every job gets the same *limits*.
+
+    '''
+    if max_workers == 1:
+        for job in jobs:
+            yield run_job(job, limits)
+        return
+    with ProcessPoolExecutor(max_workers) as executor:
+        for result in executor.map(partial(run_job, limits=limits), jobs):
+            yield result
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [-j N] [-i INPUT]... PROGRAM...')
+    parser.add_option(
+        '-j', '--jobs', type='int', metavar='N',
+        help='number of worker processes (default: number of CPUs)')
+    parser.add_option(
+        '-i', '--input', action='append', default=[], metavar='FILE',
+        help='run every program with the content of FILE as input; can be '
+             'given several times (default: run with an empty input)')
+    parser.add_option(
+        '--max-steps', type='int', metavar='N',
+        help='stop every program after N steps')
+    parser.add_option(
+        '--timeout', type='float', metavar='SECONDS',
+        help='stop every program after SECONDS seconds')
+    parser.add_option(
+        '--max-stack', type='int', metavar='N',
+        help='stop every program whose stack holds more than N values')
+    parser.add_option(
+        '--max-output', type='int', metavar='N',
+        help='stop every program which outputs more than N bytes '
+             '(in UTF-8)')
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.error('no program given')
+    limits = None
+    if (options.max_steps, options.timeout, options.max_stack,
+            options.max_output) != (None, None, None, None):
+        limits = Limits(options.max_steps, options.timeout, options.max_stack,
+                        options.max_output)
+    sources = []
+    for filename in args:
+        with open(filename) as f:
+            sources.append(f.read())
+    inputs = []
+    for filename in options.input:
+        with open(filename) as f:
+            inputs.append((filename, f.read()))
+    if not inputs:
+        inputs.append((None, ''))
+    names = [(program, input_name)
+             for program in args for input_name, _ in inputs]
+    jobs = ((source, stdin) for source in sources for _, stdin in inputs)
+    failed = False
+    for (program, input_name), result in zip(
+            names, run_many(jobs, options.jobs, limits)):
+        name = program if input_name is None else '%s < %s' % (
+            program, input_name)
+        sys.stdout.write('==> %s <== steps: %d, time: %.3fs\n' % (
+            name, result.steps, result.wall_time))
+        sys.stdout.write(result.output)
+        if result.error is not None:
+            failed = True
+            sys.stdout.write('\nError: %s\n' % result.error)
+        elif result.limit is not None:
+            failed = True
+            sys.stdout.write('\nStopped: the limit of %s was reached\n' % (
+                result.limit.replace('_', ' ')))
+        sys.stdout.flush()
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
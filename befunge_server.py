@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# befungeshell - an interactive shell to help writing befunge programs
+# Copyright (C) 2011 Simon Liedtke
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+'''Serve the befunge shell over TCP or a Unix socket. Every connection gets
+a shell of its own, and all sessions share one asyncio event loop, so that
+an idle session costs only its shell state. Needs python 3.7 or newer.'''
+import re
+import sys
+import asyncio
+from collections import deque
+from optparse import OptionParser
+
+from timeit import default_timer
+
+from befunge_shell import (BefungeShell, FULLY_BUFFERED, INT64, Limits,
+                           STRAIGHT_LINE_COMMANDS)
+
+DEFAULT_PORT = 8023
+# the undo log of a session is kept short, so that many sessions fit into
+# memory
+SESSION_UNDO_LIMIT = 1000
+# the cells of a session are 64 bit integers, so that no command can build
+# a huge number. As the length of a line is limited by the reader, too, every
+# line runs in bounded time. A line which makes the stack deeper than the
+# limit is undone.
+SESSION_CELLS = INT64
+SESSION_LIMITS = Limits(stack_depth=100000)
+# the helper commands which a client may use; the others can read files
+SESSION_HELPERS = frozenset([
+    'show_stack', 'show_pc', 'undo', 'snapshot', 'restore', 'help', 'quit',
+    'exit', 'EOF'])
+
+_INPUT_COMMANDS = re.compile('([&~])')
+
+
+class StreamOutput(object):
+    '''A file-like object which writes to an asyncio StreamWriter. Writing
+    never blocks; the session waits for the writer to drain after every
+    line.'''
+    def __init__(self, writer, encoding='utf-8'):
+        self.writer = writer
+        self.encoding = encoding
+
+    def write(self, s):
+        self.writer.write(s.encode(self.encoding, 'replace'))
+
+    def flush(self):
+        pass
+
+
+class SessionShell(BefungeShell):
+    '''A BefungeShell which does not read its input itself: the session
+    awaits the line for every & and ~ command and puts it into
+    *pending_input* before the command is executed.'''
+    def __init__(self, stdout, undo_limit=SESSION_UNDO_LIMIT,
+                 cells=SESSION_CELLS, limits=SESSION_LIMITS):
+        BefungeShell.__init__(self, stdout=stdout, buffering=FULLY_BUFFERED,
+                              undo_limit=undo_limit, cells=cells,
+                              limits=limits)
+        self.pending_input = deque()
+        self._line_position = 0
+
+    def input(self, prompt):
+        # the prompt was already sent by the session
+        if self.pending_input:
+            return self.pending_input.popleft().rstrip()
+        return ''
+
+    def onecmd(self, line):
+        command = self.parseline(line)[0]
+        if (command and hasattr(self, 'do_' + command)
+                and command not in SESSION_HELPERS):
+            self.print_('Error: the command %s is not available' % command)
+            return False
+        return BefungeShell.onecmd(self, line)
+
+    def start_line(self):
+        'remember where the undo log was before the next line'
+        self._line_position = self._undo_position
+
+    def undo_exceeding_line(self):
+        '''If the current line exceeded one of the limits, print an error,
+        undo the line and return True'''
+        limit = self.exceeded_limit(0, default_timer())
+        if limit is None:
+            return False
+        self.print_('Error: the limit of %s was reached, the line was undone'
+                    % limit.replace('_', ' '))
+        self.undo(self._undo_position - self._line_position)
+        return True
+
+
+class Session(object):
+    '''The shell of one connection'''
+    def __init__(self, reader, writer, encoding='utf-8'):
+        self.reader = reader
+        self.writer = writer
+        self.encoding = encoding
+        self.shell = SessionShell(StreamOutput(writer, encoding))
+
+    async def send(self, s):
+        self.shell.print_(s, False)
+        self.shell.output.flush()
+        await self.writer.drain()
+
+    async def readline(self):
+        '''Return the next line of the connection, or an empty string at its
+        end. A line which is longer than the limit of the reader is skipped
+        with an error, and an empty line is returned instead.'''
+        too_long = False
+        while True:
+            try:
+                line = await self.reader.readuntil(b'\n')
+            except asyncio.IncompleteReadError as e:
+                line = e.partial
+            except asyncio.LimitOverrunError as e:
+                too_long = True
+                await self.reader.readexactly(e.consumed)
+                continue
+            if too_long:
+                await self.send('Error: the line is too long\n')
+                return '\n'
+            return line.decode(self.encoding, 'replace')
+
+    async def run(self):
+        '''Execute the lines of the connection until it is closed or the
+        shell is quit'''
+        while True:
+            await self.send(self.shell.prompt)
+            line = await self.readline()
+            if not line or await self.execute(line):
+                break
+        await self.writer.drain()
+
+    async def execute(self, line):
+        '''Execute one line like the command loop of the shell does. Return
+        True if the shell was quit.'''
+        shell = self.shell
+        shell.start_line()
+        try:
+            for token in shell.tokenize([line], record_undo=True):
+                if shell.undo_exceeding_line():
+                    break
+                if (shell.string_mode or token[0] not in STRAIGHT_LINE_COMMANDS
+                        or not _INPUT_COMMANDS.search(token)):
+                    if shell.run_tokens([token]):
+                        return True
+                    continue
+                # wait for the input of & and ~ without blocking the others
+                for part in _INPUT_COMMANDS.split(token):
+                    if part == '&':
+                        await self.send(shell.number_prompt)
+                        shell.pending_input.append(await self.readline())
+                    elif part == '~':
+                        await self.send(shell.char_prompt)
+                        shell.pending_input.append(await self.readline())
+                    if part:
+                        shell.run_tokens([part])
+            else:
+                shell.undo_exceeding_line()
+        except Exception:
+            shell.print_('Error: %s: %s' % (
+                sys.exc_info()[0].__name__, sys.exc_info()[1]))
+        shell.output.flush()
+        return False
+
+
+async def handle_connection(reader, writer):
+    try:
+        await Session(reader, writer).run()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+def start_server(host='127.0.0.1', port=DEFAULT_PORT, path=None):
+    '''Return the coroutine which starts serving shell sessions on *host*
+    and *port*, or on the Unix socket *path* if it is given'''
+    if path is not None:
+        return asyncio.start_unix_server(handle_connection, path=path)
+    return asyncio.start_server(handle_connection, host, port)
+
+
+async def serve(host='127.0.0.1', port=DEFAULT_PORT, path=None):
+    server = await start_server(host, port, path)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = OptionParser(
+        usage='%prog [--host HOST] [--port PORT | --unix PATH]')
+    parser.add_option(
+        '--host', default='127.0.0.1',
+        help='the address to listen on (default: %default)')
+    parser.add_option(
+        '--port', type='int', default=DEFAULT_PORT,
+        help='the TCP port to listen on (default: %default)')
+    parser.add_option(
+        '--unix', metavar='PATH',
+        help='listen on the Unix socket PATH instead of TCP')
+    options, args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(options.host, options.port, options.unix))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
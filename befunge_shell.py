@@ -14,11 +14,20 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
-import random
+from __future__ import with_statement
+
+import re
+import sys
+from array import array
 from cmd import Cmd
+from collections import deque, namedtuple
+from binascii import unhexlify
+from functools import partial
+from itertools import chain, groupby, islice
+from timeit import default_timer
 from operator import add, sub, mul, floordiv, mod, not_, gt as greater
 try:
-    from itertools import izip as zip
+    from itertools import izip as zip, imap as map
 except ImportError:  # python3
     pass
 
@@ -33,7 +42,234 @@ except NameError:  # python3
     pass
 
 
-class Stack(list):
+OPERATORS = {
+    '+': add,
+    '-': sub,
+    '*': mul,
+    '/': floordiv,
+    '%': mod,
+    '`': greater
+}
+
+# the values a cell of the stack (or of the playfield) can hold: any
+# integer, or signed integers of 32 or 64 bits like in C
+UNBOUNDED = 'unbounded'
+INT32 = 'int32'
+INT64 = 'int64'
+CELL_MODES = (UNBOUNDED, INT32, INT64)
+
+
+def _fixed_width_operators(bits):
+    '''Return the arithmetic operators on signed integers of *bits* bits.
+    The results wrap around, and / and % truncate towards zero like the
+    reference implementation of befunge-93 does.'''
+    sign = 1 << (bits - 1)
+    mask = (1 << bits) - 1
+
+    def plus(a, b):
+        return ((a + b + sign) & mask) - sign
+
+    def minus(a, b):
+        return ((a - b + sign) & mask) - sign
+
+    def times(a, b):
+        return ((a * b + sign) & mask) - sign
+
+    def divide(a, b):
+        quotient = abs(a) // abs(b)
+        if (a < 0) != (b < 0):
+            quotient = -quotient
+        return ((quotient + sign) & mask) - sign
+
+    def modulo(a, b):
+        remainder = abs(a) % abs(b)
+        return -remainder if a < 0 else remainder
+
+    return {
+        '+': plus,
+        '-': minus,
+        '*': times,
+        '/': divide,
+        '%': modulo,
+        '`': greater
+    }
+
+
+def _fixed_width_wrap(bits):
+    '''Return a function which wraps an integer around to a signed integer
+    of *bits* bits.'''
+    sign = 1 << (bits - 1)
+    mask = (1 << bits) - 1
+
+    def wrap(value):
+        return ((value + sign) & mask) - sign
+    return wrap
+
+
+CELL_OPERATORS = {
+    UNBOUNDED: OPERATORS,
+    INT32: _fixed_width_operators(32),
+    INT64: _fixed_width_operators(64),
+}
+# how the values which & reads are wrapped into the cells, None if they fit
+CELL_WRAPS = {
+    UNBOUNDED: None,
+    INT32: _fixed_width_wrap(32),
+    INT64: _fixed_width_wrap(64),
+}
+
+DIRECTIONS = {
+    '>': (1, 0),
+    '<': (-1, 0),
+    '^': (0, -1),
+    'v': (0, 1)
+}
+
+UNBUFFERED = 'unbuffered'
+LINE_BUFFERED = 'line'
+FULLY_BUFFERED = 'full'
+
+# chr() of all byte values, so that printing a character is a list lookup
+_CHARS = [chr(i) for i in range(256)]
+
+
+def _utf8_length(s):
+    'return the number of bytes of the string *s* in UTF-8'
+    try:
+        return len(s.encode('utf-8'))
+    except UnicodeDecodeError:  # a byte string of python 2
+        return len(s)
+
+
+class OutputSink(object):
+    '''Pass the output of the shell or the interpreter on to *stream*. The
+    value of *buffering* decides when the output is really written:
+
+    UNBUFFERED: immediately, every piece of output is flushed on its own
+    LINE_BUFFERED: whenever a newline is written
+    FULLY_BUFFERED: when *buffer_size* characters were collected or when
+        flush is called
+
+    '''
+    def __init__(self, stream, buffering=UNBUFFERED, buffer_size=8192):
+        if buffering not in (UNBUFFERED, LINE_BUFFERED, FULLY_BUFFERED):
+            raise ValueError('unknown buffering mode %r' % buffering)
+        self.stream = stream
+        self.buffering = buffering
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._buffered = 0
+        # the number of bytes (in UTF-8) which were written to the stream
+        self.written = 0
+
+    def write(self, s, end=''):
+        buffer = self._buffer
+        buffer.append(s)
+        if end:
+            buffer.append(end)
+        buffering = self.buffering
+        if buffering != FULLY_BUFFERED and (
+                buffering == UNBUFFERED or '\n' in s or '\n' in end):
+            self.flush()
+        else:
+            self._buffered += len(s) + len(end)
+            if self._buffered >= self.buffer_size:
+                self.flush()
+
+    def write_int(self, value, end=''):
+        self.write(str(value), end)
+
+    def write_char(self, value, end=''):
+        self.write(_CHARS[value] if 0 <= value < 256 else chr(value), end)
+
+    def flush(self):
+        'write everything which was collected so far to the stream'
+        if self._buffer:
+            output = ''.join(self._buffer)
+            self.stream.write(output)
+            self.written += _utf8_length(output)
+            del self._buffer[:]
+            self._buffered = 0
+            self.stream.flush()
+
+    @property
+    def size(self):
+        'the number of bytes (in UTF-8) which were output so far'
+        return self.written + sum(map(_utf8_length, self._buffer))
+
+
+class InputSource(object):
+    '''Serve the input of the commands & and ~ from *stream*, which is read
+    in chunks of *chunk_size* characters instead of line by line. Only a
+    terminal is still read line by line, so that the user is never waited
+    for longer than needed. *before_read* is called before the stream is
+    read, to flush the output which the user needs to see.
+
+    '''
+    def __init__(self, stream, chunk_size=65536, before_read=None):
+        self.stream = stream
+        try:
+            interactive = stream.isatty()
+        except AttributeError:
+            interactive = False
+        self._read = (stream.readline if interactive
+                      else partial(stream.read, chunk_size))
+        self.before_read = before_read
+        self._buffer = ''
+        self._position = 0
+
+    def _fill(self):
+        '''Append the next chunk of the stream to what is left of the buffer.
+        Return False at the end of the stream.'''
+        if self.before_read is not None:
+            self.before_read()
+        data = self._read()
+        if not data:
+            return False
+        self._buffer = self._buffer[self._position:] + data
+        self._position = 0
+        return True
+
+    def read_char(self):
+        'return the next character, or "" at the end of the input'
+        position = self._position
+        if position >= len(self._buffer):
+            if not self._fill():
+                return ''
+            position = 0
+        self._position = position + 1
+        return self._buffer[position]
+
+    def read_token(self):
+        '''Return the next word of the input, or "" at the end of the input.
+        The newline after the word is read, too, so that a ~ which follows a
+        & gets the next line like with readline.'''
+        while True:
+            match = _INPUT_TOKEN.match(self._buffer, self._position)
+            if match.end() < len(self._buffer) or not self._fill():
+                break
+        self._position = end = match.end()
+        if self._buffer.startswith('\n', end):
+            self._position = end + 1
+        return match.group(1)
+
+    def read_int(self):
+        '''Return the integer of the next word, or -1 at the end of the input
+        or if the word is no integer.'''
+        try:
+            return int(self.read_token())
+        except ValueError:
+            return -1
+
+
+_INPUT_TOKEN = re.compile(r'\s*(\S*)')
+
+
+class _StackOperations(object):
+    '''The operations of the befunge stack. The class which mixes this in
+    must provide the list methods append, extend, pop and item deletion.
+
+    '''
     def pop_exceptionless(self):
         '''Pop the top value of the stack without returning the value. Print a
         warning if the stack was empty.
@@ -53,14 +289,1382 @@ class Stack(list):
         'swap the two topmost values in the stack'
         self.append(self.pop(-2))
 
+    def push_many(self, values):
+        'push all values of the iterable *values*, the last one ends on top'
+        self.extend(values)
+
+    def pop_many(self, n):
+        '''Pop the *n* topmost values and return them as a list, the former
+        top value first. Like pop_exceptionless, missing values are zeros.
+
+        '''
+        start = max(len(self) - n, 0)
+        values = list(self[start:])
+        del self[start:]
+        values.reverse()
+        values.extend([0] * (n - len(values)))
+        return values
+
+    def extend_from_bytes(self, data):
+        'push the value of every byte in *data*'
+        self.extend(bytearray(data))
+
+
+class Stack(_StackOperations, list):
+    pass
+
+
+try:
+    _ARRAY_TYPECODE = array('q').typecode
+except ValueError:  # no 64 bit integers before python 3.3
+    _ARRAY_TYPECODE = 'l'
+
+
+class ArrayStack(_StackOperations, array):
+    '''A stack which stores its values in a compact array of machine
+    integers instead of a list of Python objects. It needs a fraction of the
+    memory of a Stack, but values which do not fit into a 64 bit integer
+    raise OverflowError.
+
+    '''
+    def __new__(cls, values=()):
+        return array.__new__(cls, _ARRAY_TYPECODE, values)
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+    def extend_from_bytes(self, data):
+        'push the value of every byte in *data*'
+        # array.extend converts item by item, fromlist works in bulk
+        self.fromlist(list(bytearray(data)))
+
+
+_ITEM_SIZE = array(_ARRAY_TYPECODE).itemsize
+try:
+    _array_to_bytes = array.tobytes
+except AttributeError:  # python < 3.2
+    _array_to_bytes = array.tostring
+
+
+# the number of values which SpillStack writes to its file at once
+SPILL_CHUNK_SIZE = 1 << 16
+
+
+class SpillStack(_StackOperations):
+    '''A stack for programs which push millions of values. It keeps at most
+    *memory_limit* of the top values in a list and spills the older ones to
+    a memory-mapped temporary file, *chunk_size* values at a time, as 64 bit
+    integers. Values which do not fit are kept in a dict instead. When the
+    values in memory run out, the topmost chunk is read back.
+
+    '''
+    def __init__(self, values=(), memory_limit=1 << 20,
+                 chunk_size=SPILL_CHUNK_SIZE):
+        if chunk_size < 1 or memory_limit < 2 * chunk_size:
+            raise ValueError(
+                'memory_limit must be at least twice the chunk_size')
+        self.memory_limit = memory_limit
+        self.chunk_size = chunk_size
+        # the values in memory, which are above all spilled values
+        self._top = []
+        # the number of values in the file
+        self._spilled = 0
+        # the spilled values which are no 64 bit integers, by their index
+        self._others = {}
+        self._file = self._map = None
+        self.extend(values)
+
+    def __len__(self):
+        return self._spilled + len(self._top)
+
+    def __iter__(self):
+        for start in range(0, self._spilled, self.chunk_size):
+            for value in self._read(
+                    start, min(start + self.chunk_size, self._spilled)):
+                yield value
+        for value in self._top:
+            yield value
+
+    def __eq__(self, other):
+        try:
+            if len(self) != len(other):
+                return False
+        except TypeError:
+            return NotImplemented
+        return all(a == b for a, b in zip(self, other))
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return '[%s]' % ', '.join(map(repr, self))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            if start >= stop:
+                return []
+            values = []
+            if start < self._spilled:
+                values = self._read(start, min(stop, self._spilled))
+            values.extend(self._top[max(start - self._spilled, 0):
+                                    max(stop - self._spilled, 0)])
+            return values
+        return self._top[self._top_index(index)]
+
+    def __setitem__(self, index, value):
+        self._top[self._top_index(index)] = value
+
+    def __delitem__(self, index):
+        if not isinstance(index, slice):
+            del self._top[self._top_index(index)]
+            return
+        start, stop, step = index.indices(len(self))
+        if stop < len(self) or step != 1:
+            rest = self[start:]
+            del rest[slice(0, max(stop - start, 0), step)]
+        else:
+            rest = ()
+        self._truncate(start)
+        self.extend(rest)
+
+    def append(self, value):
+        top = self._top
+        top.append(value)
+        if len(top) > self.memory_limit:
+            self._spill()
+
+    def extend(self, values):
+        # in chunks, so that a long iterable never is in memory at once
+        top = self._top
+        values = iter(values)
+        while True:
+            n = len(top)
+            top.extend(islice(values, self.chunk_size))
+            if len(top) > self.memory_limit:
+                self._spill()
+            elif len(top) - n < self.chunk_size:
+                return
+
+    def pop(self, index=-1):
+        top = self._top
+        if top and index == -1:
+            return top.pop()
+        if not self:
+            raise IndexError('pop from empty stack')
+        return top.pop(self._top_index(index))
+
+    def extend_from_bytes(self, data):
+        'push the value of every byte in *data*'
+        self.extend(bytearray(data))
+
+    def _top_index(self, index):
+        # the index of the value *index* of the whole stack in _top, which
+        # is filled from the file if needed
+        n = len(self)
+        if index >= 0:
+            index -= n
+        if not -n <= index < 0:
+            raise IndexError('stack index out of range')
+        if -index > len(self._top):
+            self._load(-index - len(self._top))
+        return index
+
+    def _spill(self):
+        top = self._top
+        chunk = top[:self.chunk_size]
+        data = self._pack(chunk, self._spilled)
+        start = self._spilled * _ITEM_SIZE
+        end = start + len(data) * _ITEM_SIZE
+        self._reserve(end)
+        self._map[start:end] = _array_to_bytes(data)
+        self._spilled += len(chunk)
+        del top[:len(chunk)]
+
+    def _load(self, n):
+        # move at least n values, or one chunk, from the file to _top
+        start = max(self._spilled - max(n, self.chunk_size), 0)
+        self._top[:0] = self._read(start, self._spilled)
+        self._truncate_file(start)
+
+    def _pack(self, values, position):
+        try:
+            return array(_ARRAY_TYPECODE, values)
+        except (OverflowError, TypeError):
+            data = array(_ARRAY_TYPECODE)
+            for offset, value in enumerate(values):
+                try:
+                    data.append(value)
+                except (OverflowError, TypeError):
+                    self._others[position + offset] = value
+                    data.append(0)
+            return data
+
+    def _read(self, start, stop):
+        # the spilled values from the index start up to stop
+        values = array(_ARRAY_TYPECODE, self._map[
+            start * _ITEM_SIZE:stop * _ITEM_SIZE]).tolist()
+        for position, value in self._others.items():
+            if start <= position < stop:
+                values[position - start] = value
+        return values
+
+    def _reserve(self, size):
+        # make the file at least *size* bytes long
+        import mmap
+        import tempfile
+        capacity = 0
+        if self._map is not None:
+            if len(self._map) >= size:
+                return
+            capacity = 2 * len(self._map)
+            self._map.close()
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+        capacity = max(size, capacity)
+        self._file.truncate(capacity)
+        self._map = mmap.mmap(self._file.fileno(), capacity)
+
+    def _truncate(self, n):
+        # drop all values from the index n on
+        if n >= self._spilled:
+            del self._top[n - self._spilled:]
+        else:
+            del self._top[:]
+            self._truncate_file(n)
+
+    def _truncate_file(self, n):
+        self._spilled = n
+        if self._others:
+            self._others = dict((position, value) for position, value
+                                in self._others.items() if position < n)
+
+
+class RandomDirections(object):
+    '''The source of the directions which the command ? chooses. It has a
+    random number generator of its own, which can be seeded, draws its bits
+    in batches and uses two bits per direction.
+
+    Every direction is an index into the sequence given to choice: 0, 1, 2
+    and 3 stand for >, <, ^ and v. If *recording* is a list, the index of
+    every choice is appended to it. If *replay* is given, its indices are
+    used instead of random ones, and ValueError is raised when they run out.
+
+    '''
+    # the number of directions drawn at once
+    batch_size = 4096
+
+    def __init__(self, seed=None, replay=None, recording=None):
+        self.seed = seed
+        self.recording = recording
+        self._random = None
+        self._replaying = replay is not None
+        # the directions which are left, the next one comes last
+        self._directions = [] if replay is None else list(replay)[::-1]
+
+    def _refill(self):
+        if self._replaying:
+            raise ValueError('the replayed directions are exhausted')
+        if self._random is None:
+            # imported here to start the shell faster
+            from random import Random
+            self._random = Random(self.seed)
+        bits = self._random.getrandbits(2 * self.batch_size)
+        data = bytearray(unhexlify('%0*x' % (self.batch_size // 2, bits)))
+        # every byte gives four directions
+        self._directions = list(chain.from_iterable(
+            map(_BYTE_DIRECTIONS.__getitem__, data)))
+
+    def choice(self, directions):
+        '''Return the next one of the four *directions*'''
+        try:
+            index = self._directions.pop()
+        except IndexError:
+            self._refill()
+            index = self._directions.pop()
+        if self.recording is not None:
+            self.recording.append(index)
+        return directions[index]
+
+
+_BYTE_DIRECTIONS = [
+    tuple((byte >> shift) & 3 for shift in (0, 2, 4, 6))
+    for byte in range(256)]
+
+
+def format_directions(indices):
+    '''Return the recorded direction *indices* as a string of >, <, ^ and v'''
+    return ''.join(['><^v'[index] for index in indices])
+
+
+class _Recordings(object):
+    'a recording of RandomDirections which appends to all of *recordings*'
+    def __init__(self, recordings):
+        self.recordings = recordings
+
+    def append(self, index):
+        for recording in self.recordings:
+            recording.append(index)
+
+
+def parse_directions(s):
+    '''Return the direction indices of a string of >, <, ^ and v; all other
+    characters are ignored'''
+    return ['><^v'.index(c) for c in s if c in '><^v']
+
+
+# the limits of one run: the number of steps, the wall-clock time in
+# seconds, the depth of the stack and the number of output bytes in UTF-8.
+# None means unlimited. They are checked every *check_every* steps.
+Limits = namedtuple('Limits', 'steps seconds stack_depth output_bytes '
+                              'check_every')
+Limits.__new__.__defaults__ = (None, None, None, None, 10000)
+
+# the outcome of BefungeInterpreter.execute: the name of the field of Limits
+# which was exceeded (None if the program ended), the number of steps, the
+# final stack and PC (x, y, direction) and the error message if a command
+# failed, like a division by zero
+ExecutionResult = namedtuple('ExecutionResult', 'limit steps stack pc error')
+
+
+class BefungeMachine(object):
+    '''The stack and the semantics of all befunge commands which only work
+    on the stack. Subclasses decide how the PC moves and how input and output
+    are done by implementing input_int, input_char, output_int and
+    output_char.
+
+    '''
+    def __init__(self, stack_class=Stack, cells=UNBOUNDED, seed=None,
+                 limits=None):
+        if cells not in CELL_OPERATORS:
+            raise ValueError('cells must be one of %s' % ', '.join(CELL_MODES))
+        self.cells = cells
+        self._wrap = CELL_WRAPS[cells]
+        self.directions = RandomDirections(seed)
+        self.limits = limits
+        # the name of the limit which stopped the last run, if any
+        self.limit_reached = None
+        self.stack = stack_class()
+        self.string_mode = False
+        self.playfield = Playfield()
+        self._dispatch = self._build_dispatch_table()
+
+    def exceeded_limit(self, steps, start):
+        '''Return the name of the first of self.limits which is exceeded
+        after *steps* steps of a run which began at the default_timer value
+        *start*, or None.'''
+        limits = self.limits
+        if limits.steps is not None and steps >= limits.steps:
+            return 'steps'
+        if (limits.seconds is not None
+                and default_timer() - start >= limits.seconds):
+            return 'seconds'
+        if (limits.stack_depth is not None
+                and len(self.stack) > limits.stack_depth):
+            return 'stack_depth'
+        if (limits.output_bytes is not None
+                and self.output.size > limits.output_bytes):
+            return 'output_bytes'
+        return None
+
+    def _build_dispatch_table(self):
+        '''Return a list indexed by character code which maps every befunge
+        command to a callable without arguments. Characters which are no
+        commands map to None.
+
+        '''
+        table = [None] * 256
+        for digit in range(10):
+            table[ord(str(digit))] = partial(self.push, digit)
+        for command, operator in CELL_OPERATORS[self.cells].items():
+            table[ord(command)] = partial(self.calculate, operator)
+        for command, func in [
+                ('!', self.not_),
+                ('"', self.toggle_string_mode),
+                (':', self.duplicate_top),
+                ('\\', self.swap_topmost_values),
+                ('$', self.discard_top),
+                ('.', self.output_int),
+                (',', self.output_char),
+                ('&', self.input_int),
+                ('~', self.input_char),
+                ('g', self.get),
+                ('p', self.put)]:
+            table[ord(command)] = func
+        return table
+
+    def calculate(self, operator):
+        if len(self.stack) >= 2:
+            first = self.stack.pop()
+            second = self.stack.pop()
+            self.stack.append(int(operator(second, first)))
+
+    def toggle_string_mode(self):
+        '''one double quote toggles string mode which causes every following
+        chracter to be pushed to the stack until the second double quote occurs
+
+        '''
+        self.string_mode = not self.string_mode
+
+    def push(self, value):
+        self.stack.append(value)
+
+    def duplicate_top(self):
+        self.stack.duplicate_top()
+
+    def swap_topmost_values(self):
+        self.stack.swap_topmost_values()
+
+    def discard_top(self):
+        self.stack.pop_exceptionless()
+
+    def not_(self):
+        self.stack.append(int(not_(self.stack.pop_exceptionless())))
+
+    def get(self):
+        y = self.stack.pop_exceptionless()
+        x = self.stack.pop_exceptionless()
+        self.stack.append(self.playfield.get(x, y))
+
+    def put(self):
+        '''Pop y, x and a value and store the value in the playfield. Return
+        True if this changed the command of a cell.'''
+        y = self.stack.pop_exceptionless()
+        x = self.stack.pop_exceptionless()
+        return self.playfield.put(x, y, self.stack.pop_exceptionless())
+
+
+# commands which never change the PC, so that every run of them can be
+# compiled into a single function
+STRAIGHT_LINE_COMMANDS = frozenset('0123456789+-*/%`!:\\$.,&~')
+# a run of straight-line commands or any other single command
+_TOKEN_PATTERN = re.compile('[%s]+|\\S' % ''.join(
+    re.escape(command) for command in sorted(STRAIGHT_LINE_COMMANDS)))
+
+# the Python source of every straight-line command, used by compile_segment;
+# "stack" and "machine" are local variables of the compiled function
+_COMMAND_SOURCE = {
+    '!': 'machine.not_()',
+    ':': 'stack.duplicate_top()',
+    '\\': 'stack.swap_topmost_values()',
+    '$': 'if stack: stack.pop()',
+    '.': 'machine.output_int()',
+    ',': 'machine.output_char()',
+    '&': 'machine.input_int()',
+    '~': 'machine.input_char()',
+}
+# the operators are inlined, like BefungeMachine.calculate does them
+_COMMAND_SOURCE.update(
+    (command, 'if len(stack) >= 2: first = stack.pop(); '
+     'stack.append(int(operator_%d(stack.pop(), first)))' % ord(command))
+    for command in OPERATORS)
+
+# pairs of commands which are replaced by a single statement if their
+# operands are not known at compile time
+_PEEPHOLES = {
+    ':+': 'stack.append(stack.pop() * 2 if stack else 0)',
+    ':*': 'stack.append(stack[-1] * stack.pop() if stack else 0)',
+    '\\$': 'del stack[-2]',
+}
+# the same for fixed-width cells, where the results have to wrap around
+_FIXED_WIDTH_PEEPHOLES = {
+    ':+': 'stack.append(operator_43(stack[-1], stack.pop()) if stack else 0)',
+    ':*': 'stack.append(operator_42(stack[-1], stack.pop()) if stack else 0)',
+    '\\$': 'del stack[-2]',
+}
+
+# the globals of the compiled code for every cell mode
+_SEGMENT_NAMESPACES = dict(
+    (cells, dict(('operator_%d' % ord(command), operator)
+                 for command, operator in operators.items()))
+    for cells, operators in CELL_OPERATORS.items())
+
+# the compiled segments of every cell mode by their commands
+_segment_caches = dict((cells, {}) for cells in CELL_MODES)
+SEGMENT_CACHE_SIZE = 4096
+
+
+def _segment_statements(commands, cells=UNBOUNDED, indices=None):
+    '''Return the Python statements which execute the straight-line befunge
+    *commands* on cells of the mode *cells*, see compile_segment. If
+    *indices* is a list, the index of the command which every statement
+    comes from is appended to it.'''
+    operators = CELL_OPERATORS[cells]
+    peepholes = _PEEPHOLES if cells == UNBOUNDED else _FIXED_WIDTH_PEEPHOLES
+    statements = []
+    # values which the segment has pushed onto the stack so far, but which
+    # were not written to the real stack yet
+    pending = []
+
+    def push_pending():
+        if len(pending) == 1:
+            statements.append('stack.append(%r)' % pending[0])
+        elif pending:
+            statements.append('stack.extend(%r)' % (tuple(pending),))
+        del pending[:]
+    i, n = 0, len(commands)
+    while i < n:
+        index = i
+        command = commands[i]
+        i += 1
+        if command.isdigit():
+            pending.append(int(command))
+        elif command in operators and len(pending) >= 2 and not (
+                command in '/%' and pending[-1] == 0):
+            # division by zero must fail at run time
+            first = pending.pop()
+            second = pending.pop()
+            pending.append(int(operators[command](second, first)))
+        elif command == '!' and pending:
+            pending.append(int(not_(pending.pop())))
+        elif command == ':' and pending:
+            pending.append(pending[-1])
+        elif command == '\\' and len(pending) >= 2:
+            pending[-2:] = pending[:-3:-1]
+        elif command == '$' and pending:
+            pending.pop()
+        else:
+            push_pending()
+            peephole = peepholes.get(commands[i - 1:i + 1])
+            if peephole is not None:
+                statements.append(peephole)
+                i += 1
+            else:
+                statements.append(_COMMAND_SOURCE[command])
+        if indices is not None:
+            indices.extend([index] * (len(statements) - len(indices)))
+    push_pending()
+    if indices is not None:
+        indices.extend([n - 1] * (len(statements) - len(indices)))
+    return statements
+
+
+def compile_segment(commands, cells=UNBOUNDED):
+    '''Compile a string of straight-line befunge *commands* (see
+    STRAIGHT_LINE_COMMANDS) into one function which takes a BefungeMachine
+    and executes all of the commands on it. *cells* is the cell mode of the
+    machine (see CELL_MODES).
+
+    Operations on values which are pushed within the segment are folded at
+    compile time, some pairs of commands are replaced by a single statement,
+    and the result is cached by the source string.
+
+    '''
+    cache = _segment_caches[cells]
+    try:
+        return cache[commands]
+    except KeyError:
+        pass
+    indices = []
+    source = 'def segment(machine):\n    stack = machine.stack\n%s\n' % (
+        ''.join('    %s\n' % statement
+                for statement in _segment_statements(commands, cells,
+                                                     indices)))
+    namespace = dict(_SEGMENT_NAMESPACES[cells])
+    exec(compile(source, '<segment %r>' % commands, 'exec'), namespace)
+    segment = namespace['segment']
+    # the index of the command of every statement, which starts on line 3
+    segment.command_indices = indices
+    if len(cache) >= SEGMENT_CACHE_SIZE:
+        cache.clear()
+    cache[commands] = segment
+    return segment
+
+
+# the number of values which every befunge command pops and pushes
+_STACK_EFFECTS = dict.fromkeys('0123456789&~', (0, 1))
+_STACK_EFFECTS.update(dict.fromkeys(OPERATORS, (2, 1)))
+_STACK_EFFECTS.update({
+    '!': (1, 1), ':': (1, 2), '\\': (2, 2), '$': (1, 0), '.': (1, 0),
+    ',': (1, 0), '_': (1, 0), '|': (1, 0), 'g': (2, 1), 'p': (3, 0)})
+
+# commands which change more than the stack
+_STATE_COMMANDS = frozenset('><^v?_|"p')
+_undo_effects = {}
+
+
+def _undo_effect(line):
+    '''Return how many of the values on the stack the befunge commands of
+    *line* can pop (and so change) when they are executed one after the
+    other, and whether they can change anything else than the stack. Every
+    character is assumed to be a command; characters in string mode are
+    pushed, which never pops more.'''
+    height = lowest = 0
+    for command in line:
+        pops, pushes = _STACK_EFFECTS.get(command, (0, 0))
+        height -= pops
+        lowest = min(lowest, height)
+        height += pushes
+    effect = -lowest, not _STATE_COMMANDS.isdisjoint(line)
+    if len(_undo_effects) >= SEGMENT_CACHE_SIZE:
+        _undo_effects.clear()
+    _undo_effects[line] = effect
+    return effect
+
+
+class Playfield(object):
+    '''The cells of a befunge program. The 80x25 cells which the PC moves on
+    are stored densely as one bytearray per row. Values which do not fit into
+    a byte and cells outside of that area (which only g and p can reach)
+    are stored in the sparse dictionary *overflow*.
+
+    '''
+    width = 80
+    height = 25
+
+    def __init__(self, source=''):
+        self.rows = [bytearray(b' ') * self.width for _ in range(self.height)]
+        for y, line in enumerate(source.splitlines()[:self.height]):
+            row = self.rows[y]
+            for x, char in enumerate(line[:self.width]):
+                code = ord(char)
+                row[x] = code if code < 256 else 32
+        self.overflow = {}
+
+    def copy(self):
+        playfield = Playfield()
+        playfield.rows = [bytearray(row) for row in self.rows]
+        playfield.overflow = dict(self.overflow)
+        return playfield
+
+    def get(self, x, y):
+        '''Return the value of the cell x, y. Cells which were never written
+        contain a space, like in Funge-98.'''
+        if self.overflow:
+            value = self.overflow.get((x, y))
+            if value is not None:
+                return value
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.rows[y][x]
+        return 32
+
+    def put(self, x, y, value):
+        '''Store *value* in the cell x, y. Return True if this changed the
+        command of a cell the PC can reach.'''
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            self.overflow[x, y] = value
+            return False
+        if 0 <= value < 256:
+            self.overflow.pop((x, y), None)
+        else:
+            self.overflow[x, y] = value
+        row = self.rows[y]
+        code = value % 256
+        if row[x] == code:
+            return False
+        row[x] = code
+        return True
+
+    def segment_at(self, x, y, dx, dy, cells=UNBOUNDED):
+        '''Return the compiled straight-line segment which starts at the
+        cell x, y when moving in the direction dx, dy, together with the
+        number of cells it covers. Return False if the segment would consist
+        of a single command. *cells* is passed on to compile_segment.
+
+        '''
+        rows = self.rows
+        width, height = self.width, self.height
+        commands = []
+        length = 0
+        while length < (width if dx else height):
+            char = chr(rows[y][x])
+            if char in STRAIGHT_LINE_COMMANDS:
+                commands.append(char)
+            elif char != ' ':
+                break
+            length += 1
+            x = (x + dx) % width
+            y = (y + dy) % height
+        if len(commands) < 2:
+            return False
+        return compile_segment(''.join(commands), cells), length
+
+
+def _new_segment_tables():
+    # for every direction a list of the segments starting at each cell,
+    # indexed by y * width + x; None means "not compiled yet"
+    size = Playfield.width * Playfield.height
+    return dict(
+        (direction, [None] * size) for direction in DIRECTIONS.values())
+
+
+class _TraceAborted(Exception):
+    pass
+
+
+class _TraceCompiler(object):
+    '''Compile the loop around the conditional branch (_ or |) at *x*, *y*
+    into one Python function, see compile_trace.'''
+    # how many other conditional branches a path may pass before it leaves
+    # the compiled code
+    max_depth = 6
+    # the maximum number of cells on a path between two branches
+    max_path = 4 * Playfield.width * Playfield.height
+    max_lines = 2000
+
+    def __init__(self, playfield, x, y, cells):
+        self.cells = cells
+        self.rows = playfield.rows
+        self.width = playfield.width
+        self.height = playfield.height
+        self.anchor = (x, y)
+        self.covered = set([self.anchor])
+        # the cell, the direction and the steps of the path before the
+        # command of the lines which can fail, by line number
+        self.command_states = {}
+        self.lines = [
+            'def trace(machine, budget=%d):' % sys.maxsize,
+            '    stack = machine.stack',
+            '    steps = 0',
+            '    while True:']
+
+    def emit(self, level, line):
+        if len(self.lines) >= self.max_lines:
+            raise _TraceAborted
+        self.lines.append('    ' * level + line)
+
+    def compile(self):
+        self.branch(self.anchor[0], self.anchor[1], 2, 0)
+        namespace = dict(_SEGMENT_NAMESPACES[self.cells], covered=self.covered)
+        exec(compile('\n'.join(self.lines) + '\n',
+                     '<trace %d,%d>' % self.anchor, 'exec'), namespace)
+        trace = namespace['trace']
+        trace.covered = self.covered
+        trace.command_states = self.command_states
+        return trace
+
+    def branch(self, x, y, level, depth):
+        if self.rows[y][x] == 95:  # _
+            directions = [(-1, 0), (1, 0)]
+        else:
+            directions = [(0, -1), (0, 1)]
+        self.emit(level, 'if stack.pop_exceptionless():')
+        self.path(x, y, directions[0], level + 1, depth)
+        self.emit(level, 'else:')
+        self.path(x, y, directions[1], level + 1, depth)
+
+    def path(self, x, y, direction, level, depth):
+        '''Emit the code for the path which leaves the cell x, y in
+        *direction* until it reaches a conditional branch or a command which
+        cannot be compiled'''
+        rows, width, height = self.rows, self.width, self.height
+        dx, dy = direction
+        # the number of cells executed on this path so far
+        steps = 0
+        commands = []
+        # x, y, dx, dy and steps of every command in *commands*
+        states = []
+        string_mode = False
+
+        def flush():
+            indices = []
+            statements = _segment_statements(''.join(commands), self.cells,
+                                             indices)
+            for statement, index in zip(statements, indices):
+                self.emit(level, statement)
+                self.command_states[len(self.lines)] = states[index]
+            del commands[:]
+            del states[:]
+
+        def leave(x, y):
+            # continue in the interpreter at the cell x, y
+            flush()
+            self.emit(level, 'return %d, %d, %d, %d, steps + %d' % (
+                x, y, dx, dy, steps))
+        while True:
+            x = (x + dx) % width
+            y = (y + dy) % height
+            if steps >= self.max_path:
+                if string_mode:
+                    raise _TraceAborted
+                return leave(x, y)
+            code = rows[y][x]
+            if not string_mode and (code == 63 or code == 64):  # ? @
+                return leave(x, y)
+            self.covered.add((x, y))
+            if string_mode:
+                steps += 1
+                if code == 34:
+                    string_mode = False
+                else:
+                    self.emit(level, 'stack.append(%d)' % code)
+                continue
+            char = chr(code)
+            if char in STRAIGHT_LINE_COMMANDS:
+                commands.append(char)
+                states.append((x, y, dx, dy, steps))
+            elif code == 95 or code == 124:  # _ |
+                steps += 1
+                flush()
+                self.emit(level, 'steps += %d' % steps)
+                if (x, y) == self.anchor:
+                    # leave at the branch when the budget of steps is spent
+                    self.emit(level, 'if steps >= budget:')
+                    self.emit(level + 1, 'return %d, %d, %d, %d, steps - 1' % (
+                        x, y, dx, dy))
+                    self.emit(level, 'continue')
+                elif depth < self.max_depth:
+                    self.branch(x, y, level, depth + 1)
+                else:
+                    steps = 0
+                    self.emit(level, 'return %d, %d, %d, %d, steps - 1' % (
+                        x, y, dx, dy))
+                return
+            elif char in DIRECTIONS:
+                dx, dy = DIRECTIONS[char]
+            elif code == 35:  # #
+                x = (x + dx) % width
+                y = (y + dy) % height
+            elif code == 34:  # "
+                flush()
+                string_mode = True
+            elif code == 103:  # g
+                flush()
+                self.emit(level, 'machine.get()')
+            elif code == 112:  # p
+                flush()
+                self.emit(level, 'if machine.put_cell() in covered:')
+                self.emit(level + 1, 'return %d, %d, %d, %d, steps + %d' % (
+                    (x + dx) % width, (y + dy) % height, dx, dy, steps + 1))
+            steps += 1
+
+
+def compile_trace(playfield, x, y, cells=UNBOUNDED):
+    '''Compile the loop around the conditional branch at the cell x, y of
+    *playfield* into one function, or return None if that is not possible.
 
-class BefungeShell(Cmd):
-    _number_helpers = []
-    for i in range(10):
-        _number_helpers.append(
-            (str(i), 'Push the number %d on the stack' % i)
-        )
-    misc_helpers = [
+    The function takes a BefungeInterpreter whose PC is on the branch and
+    runs every path from there which leads back to it in a Python loop.
+    Paths which pass other conditional branches are compiled as nested
+    if statements. When a path reaches a command which cannot be compiled
+    (like ? or @), or a p command changes one of the cells the function was
+    compiled from, the function returns the tuple (x, y, dx, dy, steps): the
+    position and direction where the interpreter has to continue and the
+    number of steps which were executed. It also returns at the branch when
+    it has executed at least *budget* steps, its optional second argument.
+
+    '''
+    try:
+        return _TraceCompiler(playfield, x, y, cells).compile()
+    except _TraceAborted:
+        return None
+
+
+# a node of a ControlFlowGraph: the cells which are executed one after the
+# other when the PC enters the cell of *start* (x, y, dx, dy), the commands
+# of those cells (without spaces), the command which ends the block (_, |, ?,
+# @ or None for a loop without branches) and the states where the PC can
+# continue afterwards
+Block = namedtuple('Block', 'start cells commands branch successors')
+
+
+class ControlFlowGraph(object):
+    '''The control flow graph of the program on *playfield*, built without
+    running it: every state of the PC (position and direction) which can be
+    reached from the upper left corner is walked, with the same semantics of
+    the direction commands as BefungeShell.change_pc. Both ways of every
+    conditional branch and all four ways of ? are assumed to be possible.
+
+    The graph assumes that the program does not modify itself; the cells of
+    reachable p commands are collected in *puts*, so that this can be
+    checked.
+
+    '''
+    def __init__(self, playfield):
+        self.playfield = playfield
+        self.blocks = OrderedDict()
+        # every cell the PC can execute
+        self.reachable = set()
+        self.puts = set()
+        pending = [(0, 0) + DIRECTIONS['>']]
+        while pending:
+            state = pending.pop(0)
+            if state not in self.blocks:
+                block = self.blocks[state] = self._walk(state)
+                self.reachable.update(block.cells)
+                pending.extend(block.successors)
+
+    def _walk(self, state):
+        rows = self.playfield.rows
+        width, height = self.playfield.width, self.playfield.height
+        x, y, dx, dy = state
+        string_mode = False
+        cells = []
+        commands = []
+        seen = set()
+        while True:
+            known = not string_mode and (x, y, dx, dy) in self.blocks
+            if (x, y, dx, dy, string_mode) in seen or (cells and known):
+                # a loop without any branch, or the start of a known block;
+                # a loop in string mode pushes characters forever
+                successors = () if string_mode else ((x, y, dx, dy),)
+                return Block(state, cells, ''.join(commands), None, successors)
+            seen.add((x, y, dx, dy, string_mode))
+            cells.append((x, y))
+            char = chr(rows[y][x])
+            if char != ' ' or string_mode:
+                commands.append(char)
+            if string_mode:
+                string_mode = char != '"'
+            elif char in '_|?@':
+                if char == '@':
+                    directions = []
+                elif char == '?':
+                    directions = [DIRECTIONS[pc] for pc in '><^v']
+                elif char == '_':
+                    # nonzero first, then zero
+                    directions = [DIRECTIONS['<'], DIRECTIONS['>']]
+                else:
+                    directions = [DIRECTIONS['^'], DIRECTIONS['v']]
+                successors = tuple(
+                    ((x + dx) % width, (y + dy) % height, dx, dy)
+                    for dx, dy in directions)
+                return Block(state, cells, ''.join(commands), char, successors)
+            elif char in DIRECTIONS:
+                dx, dy = DIRECTIONS[char]
+            elif char == '"':
+                string_mode = True
+            elif char == '#':
+                x = (x + dx) % width
+                y = (y + dy) % height
+            elif char == 'p':
+                self.puts.add((x, y))
+            x = (x + dx) % width
+            y = (y + dy) % height
+
+    @property
+    def self_modifying(self):
+        '''True if the program may change its own commands, so that code
+        compiled from it needs to be guarded against p'''
+        return bool(self.puts)
+
+    def dead_cells(self):
+        '''Return the positions of all cells which contain something other
+        than a space, but can never be executed, row by row. They can still
+        be read with g.'''
+        return [(x, y) for y, row in enumerate(self.playfield.rows)
+                for x, code in enumerate(row)
+                if code != 32 and (x, y) not in self.reachable]
+
+    def format(self):
+        '''Return a table of all blocks, one per line'''
+        names = dict((state, '%d,%d %s' % (
+            state[0], state[1], _PC_NAMES[state[2:]]))
+            for state in self.blocks)
+        lines = []
+        for state, block in self.blocks.items():
+            branch = block.branch or 'jump'
+            lines.append('%-8s %-30s %-4s -> %s' % (
+                names[state], block.commands, branch,
+                ', '.join(names[successor] for successor in block.successors)
+                or '-'))
+        lines.append('%d blocks, %d reachable cells, %d dead cells%s' % (
+            len(self.blocks), len(self.reachable), len(self.dead_cells()),
+            ', self-modifying' if self.self_modifying else ''))
+        return '\n'.join(lines)
+
+
+# the direction commands by their dx, dy
+_PC_NAMES = dict((direction, pc) for pc, direction in DIRECTIONS.items())
+
+
+class Program(object):
+    '''A parsed befunge program: the initial playfield and the straight-line
+    segments of it which were compiled so far for the cell mode *cells*.
+    Everything beyond the 80x25 cells is cut off.
+
+    '''
+    def __init__(self, source, cells=UNBOUNDED):
+        self.source = source
+        self.cells = cells
+        self.playfield = Playfield(source)
+        self.segment_tables = _new_segment_tables()
+        # compiled loops, see compile_trace
+        self.traces = {}
+        self._cfg = None
+
+    @property
+    def cfg(self):
+        '''The ControlFlowGraph of the program, built when it is first
+        needed'''
+        if self._cfg is None:
+            self._cfg = ControlFlowGraph(self.playfield)
+        return self._cfg
+
+
+def _source_key(source):
+    # hashlib, random, json and optparse are imported where they are needed
+    # to keep the start of the shell fast
+    import hashlib
+    if not isinstance(source, bytes):
+        source = source.encode('utf-8')
+    return hashlib.sha1(source).hexdigest()
+
+
+class ProgramCache(object):
+    '''Keep the *maxsize* most recently used programs, so that running the
+    same source again skips parsing and compiling it.'''
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._programs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._programs)
+
+    def get(self, source, cells=UNBOUNDED):
+        '''Return the Program of *source* for the cell mode *cells*, parse it
+        only if it is not in the cache yet'''
+        key = _source_key(source), cells
+        try:
+            program = self._programs.pop(key)
+        except KeyError:
+            self.misses += 1
+            program = Program(source, cells)
+            if len(self._programs) >= self.maxsize:
+                self._programs.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+        self._programs[key] = program
+        return program
+
+    def clear(self):
+        self._programs.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def __str__(self):
+        return 'programs: %d/%d, hits: %d, misses: %d, evictions: %d' % (
+            len(self), self.maxsize, self.hits, self.misses, self.evictions)
+
+
+# the cache which BefungeInterpreter uses by default
+program_cache = ProgramCache()
+
+
+class Profile(object):
+    '''Record for every befunge command how often it was executed, how much
+    time it took in total and the deepest stack which was seen after it.'''
+    def __init__(self):
+        # command -> [count, total time in seconds, maximum stack depth]
+        self.stats = {}
+
+    def wrap(self, command, handler, machine):
+        '''Return a function which calls *handler* and records the execution
+        as one of *command*'''
+        stats = self.stats.setdefault(command, [0, 0.0, 0])
+        timer = default_timer
+
+        def profiled():
+            start = timer()
+            try:
+                handler()
+            finally:
+                stats[1] += timer() - start
+                stats[0] += 1
+                depth = len(machine.stack)
+                if depth > stats[2]:
+                    stats[2] = depth
+        return profiled
+
+    def rows(self):
+        '''Return the tuples (command, count, total time, maximum stack
+        depth) of all executed commands, the most expensive one first.'''
+        rows = [(command, count, total, depth)
+                for command, (count, total, depth) in self.stats.items()
+                if count]
+        rows.sort(key=lambda row: (-row[2], row[0]))
+        return rows
+
+    def format_table(self):
+        lines = ['command      count   total ms  per call us  max depth']
+        for command, count, total, depth in self.rows():
+            lines.append('%-7s %10d %10.3f %12.3f %10d' % (
+                command, count, total * 1e3, total * 1e6 / count, depth))
+        return '\n'.join(lines)
+
+    def as_dict(self):
+        return dict(
+            (command, {'count': count, 'total_seconds': total,
+                       'max_stack_depth': depth})
+            for command, count, total, depth in self.rows())
+
+
+# the number of lines of commands which can be undone in the shell
+UNDO_LIMIT = 1000000
+
+# the records of a session log: a line executed by the command loop, a line
+# executed by run_commands, a run of lines with a single command each, the
+# value which & or ~ pushed (None if the input was no number) and the
+# direction which ? chose
+_LOG_MAGIC = b'befungeshell session log 1\n'
+_LINE = b'L'
+_BATCH_LINE = b'B'
+_RUN = b'R'
+_INPUT = b'I'
+_NO_INPUT = b'N'
+_DIRECTION_RECORDS = [pc.encode('ascii') for pc in '><^v']
+
+
+def _encode_varint(n):
+    'return the non-negative integer *n* in 7 bit groups, lowest first'
+    data = bytearray()
+    while n >= 0x80:
+        data.append(n & 0x7f | 0x80)
+        n >>= 7
+    data.append(n)
+    return bytes(data)
+
+
+def _decode_varint(data, position):
+    'return the integer which starts at *position* and the position after it'
+    n = shift = 0
+    while True:
+        byte = ord(data[position:position + 1])
+        position += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, position
+        shift += 7
+
+
+# the commands which a line of a run may consist of: they neither are
+# helper commands nor change the string mode
+_RUN_COMMANDS = STRAIGHT_LINE_COMMANDS | frozenset('><^v?_|')
+
+
+class SessionLog(object):
+    '''Append the lines, the input values and the random directions of a
+    shell session to the binary file *filename*, through a buffer of
+    *buffer_size* bytes. BefungeShell.replay runs the session again.
+
+    The log is a list of records, each a type byte (see _LINE and the
+    following constants) with a payload: the length and the UTF-8 bytes of
+    a line, or an integer in zigzag encoding. Lines with a single command
+    (see _RUN_COMMANDS) are collected and written as one run record, up to
+    *run_size* of them, which replay executes as one string.
+
+    '''
+    def __init__(self, filename, buffer_size=65536, run_size=4096):
+        self.file = open(filename, 'ab', buffer_size)
+        if self.file.tell() == 0:
+            self.file.write(_LOG_MAGIC)
+        self.run_size = run_size
+        self._run = []
+
+    def _write_run(self):
+        data = ''.join(self._run).encode('ascii')
+        self.file.write(_RUN + _encode_varint(len(data)) + data)
+        del self._run[:]
+
+    def write_line(self, line, batch=False):
+        line = line.rstrip('\r\n')
+        if not batch and len(line) == 1 and line in _RUN_COMMANDS:
+            self._run.append(line)
+            if len(self._run) >= self.run_size:
+                self._write_run()
+            return
+        if self._run:
+            self._write_run()
+        data = line.encode('utf-8')
+        self.file.write((_BATCH_LINE if batch else _LINE)
+                        + _encode_varint(len(data)) + data)
+
+    def write_lines(self, lines):
+        'write every line of the iterable *lines* while it is consumed'
+        for line in lines:
+            self.write_line(line, True)
+            yield line
+
+    def write_input(self, value):
+        if value is None:
+            self.file.write(_NO_INPUT)
+        else:
+            self.file.write(_INPUT + _encode_varint(
+                2 * value if value >= 0 else -2 * value - 1))
+
+    def append(self, direction):
+        'write the index of the direction which ? chose, see RandomDirections'
+        self.file.write(_DIRECTION_RECORDS[direction])
+
+    def close(self):
+        if self._run:
+            self._write_run()
+        self.file.close()
+
+
+# the helper commands which end a session
+_QUIT_COMMANDS = frozenset(['EOF', 'exit', 'quit'])
+
+
+def _first_word(line):
+    words = line.split(None, 1)
+    return words[0] if words else ''
+
+
+def _read_records(data):
+    '''Return the records of the session log *data* as three lists: the
+    (commands, kind) pairs, where the kind is _LINE, _BATCH_LINE or None for
+    a run of lines with one command each, the input values and the
+    direction indices'''
+    lines, inputs, directions = [], [], []
+    if data[:len(_LOG_MAGIC)] != _LOG_MAGIC:
+        raise ValueError('no session log')
+    position, end = len(_LOG_MAGIC), len(data)
+    while position < end:
+        kind = data[position:position + 1]
+        position += 1
+        if kind == _LINE or kind == _BATCH_LINE or kind == _RUN:
+            length, position = _decode_varint(data, position)
+            lines.append((data[position:position + length].decode('utf-8'),
+                          None if kind == _RUN else kind))
+            position += length
+        elif kind == _INPUT:
+            n = ord(data[position:position + 1])
+            if n < 0x80:
+                # most inputs fit into a single byte
+                position += 1
+            else:
+                n, position = _decode_varint(data, position)
+            inputs.append(n >> 1 if not n & 1 else -(n >> 1) - 1)
+        elif kind == _NO_INPUT:
+            inputs.append(None)
+        else:
+            directions.append(_DIRECTION_RECORDS.index(kind))
+    return lines, inputs, directions
+
+
+def _map_session_log(filename):
+    import mmap
+    with open(filename, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return _read_records(data)
+    except ValueError:
+        raise ValueError('%s is no session log' % filename)
+    finally:
+        data.close()
+
+
+def read_session_log(filename):
+    '''Return the records of the SessionLog *filename* as three lists: the
+    (line, batch) pairs, the input values and the direction indices.'''
+    records, inputs, directions = _map_session_log(filename)
+    lines = []
+    for commands, kind in records:
+        if kind is None:
+            lines.extend((command, False) for command in commands)
+        else:
+            lines.append((commands, kind == _BATCH_LINE))
+    return lines, inputs, directions
+
+
+try:
+    _INTEGER_TYPES = (int, long)
+except NameError:  # python3
+    _INTEGER_TYPES = (int,)
+
+
+def _stack_values(stack, start, stop, page_size=4096):
+    'yield the values of *stack* from *start* up to *stop*, a page at a time'
+    for page in range(start, stop, page_size):
+        for value in stack[page:min(page + page_size, stop)]:
+            yield value
+
+
+def _stack_range(word, depth):
+    '''Return the start and the stop index of the values of a stack of
+    *depth* values which *word* selects: the top N values for a number N,
+    or the values A to B-1 for "A:B", like a slice of a list'''
+    if ':' not in word:
+        count = int(word)
+        if count < 0:
+            raise ValueError('negative number of values')
+        return max(depth - count, 0), depth
+    bounds = [int(bound) if bound else None for bound in word.split(':')]
+    if len(bounds) != 2:
+        raise ValueError('not a range')
+    start, stop, _ = slice(*bounds).indices(depth)
+    return start, max(start, stop)
+
+
+def _is_printable(value):
+    return isinstance(value, _INTEGER_TYPES) and 32 <= value < 127
+
+
+def _ascii_items(values, run_length=4096):
+    '''Yield the repr of every value of the iterable *values*, but show a
+    run of printable values as one string'''
+    for printable, run in groupby(values, _is_printable):
+        if not printable:
+            for value in run:
+                yield repr(value)
+            continue
+        while True:
+            text = ''.join(map(chr, islice(run, run_length)))
+            if not text:
+                break
+            yield '"%s"' % text.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _format_items(items, page_size=4096):
+    '''Yield a list of the strings of the iterable *items* in pieces of at
+    most *page_size* items, so that a deep stack is never formatted at
+    once. A short list is a single piece.'''
+    items = iter(items)
+    page = list(islice(items, page_size))
+    separator = '['
+    while True:
+        following = list(islice(items, page_size))
+        text = separator + ', '.join(page)
+        if not following:
+            yield text + ']'
+            return
+        yield text
+        page = following
+        separator = ', '
+
+
+def _summarize(values):
+    '''Return the number of values of the iterable *values*, the smallest
+    and the largest integer among them, the number of values which are no
+    integers and how often every value from 0 to 255 occurs'''
+    count = others = 0
+    smallest = largest = None
+    histogram = [0] * 256
+    for value in values:
+        count += 1
+        if not isinstance(value, _INTEGER_TYPES):
+            others += 1
+            continue
+        if 0 <= value < 256:
+            histogram[value] += 1
+        if smallest is None or value < smallest:
+            smallest = value
+        if largest is None or value > largest:
+            largest = value
+    return count, smallest, largest, others, histogram
+
+
+class BefungeShell(BefungeMachine, Cmd):
+    # the help of every befunge command, written out so that defining the
+    # class costs nothing
+    _befunge_help = OrderedDict([
+        ('0', 'Push the number 0 on the stack'),
+        ('1', 'Push the number 1 on the stack'),
+        ('2', 'Push the number 2 on the stack'),
+        ('3', 'Push the number 3 on the stack'),
+        ('4', 'Push the number 4 on the stack'),
+        ('5', 'Push the number 5 on the stack'),
+        ('6', 'Push the number 6 on the stack'),
+        ('7', 'Push the number 7 on the stack'),
+        ('8', 'Push the number 8 on the stack'),
+        ('9', 'Push the number 9 on the stack'),
         ('+', 'Addition: Pop a and b, then push a+b'),
         ('-', 'Subtraction: Pop a and b, then push b-a'),
         ('*', 'Multiplication: Pop a and b, then push a*b'),
@@ -91,30 +1695,88 @@ class BefungeShell(Cmd):
         ('.', 'Pop value and output as an integer'),
         (',', 'Pop value and output as ASCII character'),
         ('#', 'Skip the following command'),
+        ('g', 'Get: Pop y and x, then push the value of the playfield cell at '
+             '(x, y)'),
+        ('p', 'Put: Pop y, x and v, then store v in the playfield cell at '
+             '(x, y)'),
         ('&', 'Ask user for a number and push it'),
         ('~', 'Ask user for a character and push its ASCII value'),
-        ('@', 'End program')
-    ]
-    _befunge_help = OrderedDict(_number_helpers + misc_helpers)
-    _befunge_cmds = _befunge_help.keys()
+        ('@', 'End program')])
+    _befunge_cmds = list(_befunge_help)
     doc_header = 'List of all available commands (type "help <command>")'
+    number_prompt = 'Enter a number please: '
+    char_prompt = 'Enter one character please: '
 
-    def __init__(self, subruler='-', completekey='tab', stdin=None, stdout=None):
+    def __init__(self, subruler='-', completekey='tab', stdin=None,
+                 stdout=None, stack_class=Stack, buffering=UNBUFFERED,
+                 profile=False, undo_limit=UNDO_LIMIT, cells=UNBOUNDED,
+                 seed=None, bulk_input=False, limits=None):
         Cmd.__init__(self, completekey, stdin, stdout)
+        BefungeMachine.__init__(self, stack_class, cells, seed, limits)
+        self.output = OutputSink(self.stdout, buffering)
+        # without prompts, & and ~ read words and characters like the
+        # interpreter does
+        self.input_source = None
+        if bulk_input:
+            self.input_source = InputSource(
+                self.stdin, before_read=self.output.flush)
         self.subruler = subruler
         self.prompt = '>>> '
-        self.stack = Stack()
-        self.string_mode = False
         self.pc = '>'
+        # one entry per executed command, see _record_undo
+        self._undo_log = deque(maxlen=undo_limit)
+        # the number of commands in the undo log if it had no limit
+        self._undo_position = 0
+        self.snapshots = {}
+        # true while run_commands executes lines without recording them
+        self._undo_disabled = False
+        # see start_log and replay
+        self.session_log = None
+        self._replayed_inputs = None
+        self.profile = None
+        if profile:
+            self.enable_profiling()
+
+    def enable_profiling(self):
+        '''Start recording the execution of every befunge command, see
+        do_show_profile'''
+        self.profile = Profile()
+        self._dispatch = [
+            None if handler is None
+            else self.profile.wrap(chr(code), handler, self)
+            for code, handler in enumerate(self._build_dispatch_table())]
+
+    def _build_dispatch_table(self):
+        table = BefungeMachine._build_dispatch_table(self)
+        for command in '><^v?_|':
+            table[ord(command)] = partial(self.change_pc, command)
+        table[ord('@')] = self.simulate_exit
+        table[ord('#')] = self.unsupported_command
+        return table
 
     def input(self, prompt):
         self.print_(prompt, False)
+        self.output.flush()
         input = self.stdin.readline()
         return input.rstrip()
 
     def print_(self, s='', add_newline=True):
-        self.stdout.write('%s%s' % (s, '\n' if add_newline else ''))
-        self.stdout.flush()
+        self.output.write(str(s), '\n' if add_newline else '')
+
+    def precmd(self, line):
+        if self.session_log is not None:
+            self.session_log.write_line(line)
+        words = line.split(None, 1)
+        if words and not hasattr(self, 'do_' + words[0]):
+            # a line of befunge commands, which can be undone; parseline
+            # cannot tell, as it takes a line starting with ! for a shell
+            # command
+            self._record_undo(line)
+        return line
+
+    def postcmd(self, stop, line):
+        self.output.flush()
+        return stop
 
     def emptyline(self):
         '''do not repeat the last command when simply entering an empty string.
@@ -153,6 +1815,14 @@ class BefungeShell(Cmd):
             else:
                 self.toggle_string_mode()
         else:
+            try:
+                handler = self._dispatch[ord(line)]
+            except (TypeError, IndexError):
+                # more than one character or not a befunge command at all
+                handler = None
+            if handler is not None:
+                handler()
+                return
             try:
                 num = int(line)
             except ValueError:
@@ -166,42 +1836,149 @@ class BefungeShell(Cmd):
                 else:
                     self.print_('Error: only numbers from 0 to 9 are allowed')
 
-    def parse_command(self, command):
-        operator = {
-            '+': add,
-            '-': sub,
-            '*': mul,
-            '/': floordiv,
-            '%': mod,
-            '`': greater
-        }.get(command)
-        if operator is not None:
-            self.calculate(operator)
-        else:
-            if command in ('><^v?_|'):
-                # change the direction of the PC (Programm counter)
-                self.change_pc(command)
+    def tokenize(self, lines, record_undo=False):
+        '''Split *lines* into befunge commands. Whitespace outside of string
+        mode is skipped. Runs of straight-line commands (which can be compiled
+        with compile_segment) are yielded as one string, and so are a line
+        which starts with the name of a helper command (like "show_stack")
+        and the characters of a line which are in string mode.
+
+        If *record_undo* is true, the state of the shell is recorded before
+        the first command of every line is yielded, see undo.
+
+        '''
+        helpers = set(name[3:] for name in self.get_names()
+                      if name.startswith('do_'))
+        compiled = _segment_caches[self.cells]
+        string_mode = self.string_mode
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if not string_mode:
+                if line in compiled:
+                    # a line which was compiled as a whole before
+                    if record_undo:
+                        self._record_undo(line)
+                    yield line
+                    continue
+                words = line.split(None, 1)
+                if words and words[0] in helpers:
+                    yield line.strip()
+                    continue
+                if record_undo and words:
+                    self._record_undo(line)
+            elif record_undo:
+                self._record_undo(line)
+            search = _TOKEN_PATTERN.search
+            start = 0
+            while start < len(line):
+                if string_mode:
+                    # everything up to the next double quote is one token
+                    end = line.find('"', start)
+                    if end == -1:
+                        end = len(line)
+                    if end > start:
+                        yield line[start:end]
+                    start = end
+                    if end < len(line):
+                        string_mode = False
+                        yield '"'
+                        start += 1
+                    continue
+                match = search(line, start)
+                if match is None:
+                    break
+                token = match.group()
+                start = match.end()
+                if token == '"':
+                    string_mode = True
+                yield token
+
+    def run_commands(self, lines, record_undo=False):
+        '''Execute all commands of the iterable *lines* without going through
+        the command loop; a line may contain any number of commands. Return
+        True if the execution was stopped by a quit command.
+
+        The lines can only be undone if *record_undo* is true, which makes
+        the execution of short lines two to three times slower. Otherwise
+        the helper commands undo, snapshot and restore print an error.
+
+        '''
+        if self.session_log is not None:
+            lines = self.session_log.write_lines(lines)
+        undo_disabled = self._undo_disabled
+        self._undo_disabled = not record_undo
+        try:
+            return self.run_tokens(self.tokenize(lines, record_undo))
+        finally:
+            self._undo_disabled = undo_disabled
+
+    def run_tokens(self, tokens):
+        '''Execute the commands which tokenize has split the input into.
+        Return True if the execution was stopped by a quit command.'''
+        dispatch = self._dispatch
+        stack = self.stack
+        segments = _segment_caches[self.cells]
+        limits = self.limits
+        if limits is not None:
+            self.limit_reached = None
+            start = default_timer()
+            steps = 0
+        for token in tokens:
+            if limits is not None:
+                # the limits are checked before every token
+                self.limit_reached = self.exceeded_limit(steps, start)
+                if self.limit_reached is not None:
+                    self.output.flush()
+                    self.print_('Error: the limit of %s was reached' % (
+                        self.limit_reached.replace('_', ' ')))
+                    break
+                steps += len(token)
+            if self.string_mode:
+                if token == '"':
+                    self.toggle_string_mode()
+                else:
+                    stack.push_many(map(ord, token))
+            elif len(token) != 1:
+                if token[0] in STRAIGHT_LINE_COMMANDS:
+                    if self.profile:
+                        # every single command has to be recorded
+                        for command in token:
+                            dispatch[ord(command)]()
+                        continue
+                    try:
+                        segment = segments[token]
+                    except KeyError:
+                        segment = compile_segment(token, self.cells)
+                    segment(self)
+                    continue
+                self.output.flush()
+                stop = self.onecmd(token)
+                self.output.flush()
+                if stop:
+                    return True
+                # helper commands may replace the stack
+                stack = self.stack
             else:
-                func = {
-                    '!': self.not_,
-                    '"': self.toggle_string_mode,
-                    ':': self.stack.duplicate_top,
-                    '\\': self.stack.swap_topmost_values,
-                    '$': self.stack.pop_exceptionless,
-                    '.': lambda: self.print_(self.stack.pop_exceptionless()),
-                    ',': lambda: self.print_(
-                        chr(self.stack.pop_exceptionless())),
-                    '&': lambda: self.stack.append(self.prompt_num()),
-                    '~': lambda: self.stack.append(ord(self.prompt_char())),
-                    '@': self.simulate_exit
-                }.get(command)
-                if func is not None:
-                    func()
-                elif command in '#gp':
-                    self.print_(
-                        'Note: The commands #, g, p are not supported.')
+                try:
+                    handler = dispatch[ord(token)]
+                except IndexError:
+                    handler = None
+                if handler is not None:
+                    handler()
                 else:
-                    self.print_('Error: unknown command %r' % command)
+                    self.parse_command(token)
+        self.output.flush()
+        return False
+
+    def parse_command(self, command):
+        try:
+            handler = self._dispatch[ord(command)]
+        except (TypeError, IndexError):
+            handler = None
+        if handler is not None:
+            handler()
+        else:
+            self.print_('Error: unknown command %r' % command)
 
     def do_help(self, arg):
         if arg:
@@ -210,19 +1987,25 @@ class BefungeShell(Cmd):
             else:
                 docstring = getattr(self, 'do_' + arg).__doc__
                 if docstring:
-                    self.print_(docstring)
+                    # without the indentation of the source
+                    self.print_('\n'.join(
+                        line.strip() for line in docstring.splitlines()))
         else:
             header_len = len(self.doc_header)
             self.print_(self.doc_header)
             if self.ruler:
                 self.print_(self.ruler * header_len + '\n')
             subheaders = ['Befunge Commands', '\nAdditional helper functions']
-            helper_functions = ['show_stack', 'show_pc', 'quit', 'help']
+            helper_functions = [
+                'show_stack', 'show_pc', 'show_cache', 'show_profile',
+                'show_cfg', 'snapshot', 'restore', 'undo', 'quit', 'help']
             commands = (self._befunge_cmds, helper_functions)
             for subh, command in zip(subheaders, commands):
                 self.print_(subh)
                 if self.subruler:
                     self.print_(self.subruler * len(subh))
+                # columnize writes to self.stdout directly
+                self.output.flush()
                 self.columnize(command, header_len)
             self.print_()
 
@@ -231,19 +2014,12 @@ class BefungeShell(Cmd):
             'Use the command "help" to get a list of all available commands. '
             'Or type "help <command>" to get specific help about this command.')
 
-    def calculate(self, operator):
-        if len(self.stack) >= 2:
-            first = self.stack.pop()
-            second = self.stack.pop()
-            self.stack.append(int(operator(second, first)))
-
     def change_pc(self, pc):
         fixed_directions = '><^v'
         if pc in fixed_directions:
             self.pc = pc
         elif pc == '?':
-            # choose random direction
-            self.pc = random.choice(fixed_directions)
+            self.pc = self.directions.choice(fixed_directions)
         elif pc in '_|':
             top_val = self.stack.pop_exceptionless()
             self.pc = '><'[bool(top_val)] if pc == '_' else 'v^'[bool(top_val)]
@@ -251,15 +2027,110 @@ class BefungeShell(Cmd):
             raise ValueError(
                 'PC (Program Counter) must be either <, >, ^, v, ?, _ or |')
 
-    def toggle_string_mode(self):
-        '''one double quote toggles string mode which causes every following
-        chracter to be pushed to the stack until the second double quote occurs
+    def output_int(self):
+        self.output.write_int(self.stack.pop_exceptionless(), '\n')
+
+    def output_char(self):
+        self.output.write_char(self.stack.pop_exceptionless(), '\n')
+
+    def input_int(self):
+        if self._replayed_inputs is not None:
+            number = self._replayed_inputs.popleft()
+        elif self.input_source is None:
+            number = self.prompt_num()
+        else:
+            word = self.input_source.read_token()
+            number = self.convert_to_integer(word) if word else -1
+        if number is not None and self._wrap is not None:
+            number = self._wrap(number)
+        if self.session_log is not None:
+            self.session_log.write_input(number)
+        self.stack.append(number)
+
+    def input_char(self):
+        if self._replayed_inputs is not None:
+            value = self._replayed_inputs.popleft()
+        elif self.input_source is None:
+            value = ord(self.prompt_char())
+        else:
+            char = self.input_source.read_char()
+            value = ord(char) if char else -1
+        if self.session_log is not None:
+            self.session_log.write_input(value)
+        self.stack.append(value)
+
+    def start_log(self, filename):
+        '''Append every line, input value and random direction of the
+        session to the SessionLog *filename* from now on'''
+        self.session_log = SessionLog(filename)
+        # the directions may be recorded elsewhere, too
+        self._other_recording = recording = self.directions.recording
+        if recording is None:
+            self.directions.recording = self.session_log
+        else:
+            self.directions.recording = _Recordings(
+                [recording, self.session_log])
+
+    def stop_log(self):
+        if self.session_log is not None:
+            self.directions.recording = self._other_recording
+            self.session_log.close()
+            self.session_log = None
+
+    def replay(self, filename):
+        '''Execute the session which was logged to *filename* again, with the
+        same input values and random directions but without the command
+        loop. Return True if the session ended with a quit command.
+
+        A quit command does not stop the replay, because more sessions may
+        have been appended to the log.
+
+        Runs of lines with a single command are executed like the lines of
+        run_commands, and every run is undone as a whole, unless the session
+        used undo or restore itself and so is replayed line by line.
 
         '''
-        self.string_mode = not self.string_mode
+        records, inputs, directions = _map_session_log(filename)
+        random_directions = self.directions
+        self.directions = RandomDirections(replay=directions)
+        self._replayed_inputs = deque(inputs)
+        # nobody waits for the output of a single line
+        buffering = self.output.buffering
+        self.output.buffering = FULLY_BUFFERED
+        by_line = any(
+            kind is not None and _first_word(commands) in ('undo', 'restore')
+            for commands, kind in records)
+        try:
+            quit = False
+            batch = []
+            for commands, kind in records:
+                if kind == _BATCH_LINE:
+                    batch.append(commands)
+                    if _first_word(commands) not in _QUIT_COMMANDS:
+                        continue
+                if batch:
+                    quit = self.run_commands(batch)
+                    del batch[:]
+                if kind == _BATCH_LINE:
+                    continue
+                if kind is None and not (by_line or self.string_mode):
+                    self._record_undo_run(commands)
+                    self.run_tokens(_TOKEN_PATTERN.findall(commands))
+                    quit = False
+                    continue
+                for line in commands if kind is None else [commands]:
+                    quit = self.postcmd(self.onecmd(self.precmd(line)), line)
+            if batch:
+                quit = self.run_commands(batch)
+            return quit
+        finally:
+            self.output.flush()
+            self.output.buffering = buffering
+            self.directions = random_directions
+            self._replayed_inputs = None
 
-    def not_(self):
-        self.stack.append(int(not_(self.stack.pop_exceptionless())))
+    def unsupported_command(self):
+        self.print_('Note: The command # is not supported.')
 
     def simulate_exit(self):
         self.print_('Imagine your script would end now ;-)')
@@ -273,32 +2144,626 @@ class BefungeShell(Cmd):
             return number
 
     def prompt_num(self):
-        return self.convert_to_integer(self.input('Enter a number please: '))
+        return self.convert_to_integer(self.input(self.number_prompt))
 
     def prompt_char(self):
         try:
-            char = self.input('Enter one character please: ')[:1] or '\n'
+            char = self.input(self.char_prompt)[:1] or '\n'
         except IndexError:
             self.print_('Error: You should have entered one character!')
         else:
             return char
 
-    def do_show_stack(self, _):
-        'print the content of the stack'
-        self.print_(repr(self.stack))
+    def _record_undo(self, line):
+        '''Remember everything the befunge commands of *line* can change
+        before they are executed: the values they can pop from the stack, the
+        PC, the string mode and, if there is a p command, the playfield.
+        Lines which only push values are recorded as the height of the
+        stack.'''
+        stack = self.stack
+        depth, changes_state = _undo_effects.get(line) or _undo_effect(line)
+        if depth or changes_state:
+            base = max(len(stack) - depth, 0)
+            playfield = self.playfield.copy() if 'p' in line else None
+            self._undo_log.append((base, tuple(stack[base:]), self.pc,
+                                   self.string_mode, playfield))
+        else:
+            self._undo_log.append(len(stack))
+        self._undo_position += 1
+
+    def _record_undo_run(self, commands):
+        '''Record a run of replay like a single line for undo. The values
+        which *commands* can pop are bounded by counting the popping
+        commands, which is much faster than _undo_effect for long runs.'''
+        stack = self.stack
+        pops = sum(commands.count(command) * effect[0]
+                   for command, effect in _STACK_EFFECTS.items() if effect[0])
+        base = max(len(stack) - pops, 0)
+        self._undo_log.append((base, tuple(stack[base:]), self.pc,
+                               self.string_mode, None))
+        self._undo_position += 1
+
+    def undo(self, n=1):
+        '''Revert the last *n* lines of befunge commands. Return the number of
+        lines which were actually reverted, which is less if the undo log is
+        shorter.'''
+        stack = self.stack
+        log = self._undo_log
+        n = max(0, min(n, len(log)))
+        for _ in range(n):
+            entry = log.pop()
+            if entry.__class__ is int:
+                del stack[entry:]
+                continue
+            base, values, self.pc, self.string_mode, playfield = entry
+            del stack[base:]
+            stack.extend(values)
+            if playfield is not None:
+                self.playfield = playfield
+        self._undo_position -= n
+        # snapshots of reverted states cannot be restored anymore
+        for name, position in list(self.snapshots.items()):
+            if position > self._undo_position:
+                del self.snapshots[name]
+        return n
+
+    def snapshot(self, name=''):
+        '''Remember the current state under *name*. This only stores the
+        position in the undo log, so it takes constant time.'''
+        self.snapshots[name] = self._undo_position
+
+    def restore(self, name=''):
+        '''Go back to the state of the snapshot *name* by undoing all
+        commands which were executed since. Raise KeyError if there is no
+        such snapshot and ValueError if the undo log does not reach back to
+        it.'''
+        n = self._undo_position - self.snapshots[name]
+        if n > len(self._undo_log):
+            raise ValueError(
+                'the snapshot %r is too old to be restored' % name)
+        self.undo(n)
+
+    def _check_undo(self, command):
+        'print an error and return False if *command* cannot work now'
+        if self._undo_disabled:
+            self.print_('Error: %s is not available, the lines of a batch '
+                        'are not recorded for undo' % command)
+            return False
+        return True
+
+    def do_snapshot(self, name):
+        'remember the current state under the given name, see "restore"'
+        if self._check_undo('snapshot'):
+            self.snapshot(name)
+
+    def do_restore(self, name):
+        'go back to the state which was remembered with "snapshot"'
+        if not self._check_undo('restore'):
+            return
+        try:
+            self.restore(name)
+        except KeyError:
+            self.print_('Error: there is no snapshot %r' % name)
+        except ValueError as e:
+            self.print_('Error: %s' % e)
+
+    def do_undo(self, arg):
+        'revert the last line of commands, or the last N lines with "undo N"'
+        try:
+            n = int(arg) if arg else 1
+        except ValueError:
+            self.print_('Error: You should have entered an integer!')
+            return
+        if self._check_undo('undo'):
+            self.undo(n)
+
+    def do_show_stack(self, arg):
+        '''print the content of the stack, or only the top N values of it
+        with "show_stack N" and the values A to B-1 from the bottom with
+        "show_stack A:B". With "ascii", runs of printable values are shown
+        as strings. "summary" prints the number of values, the smallest and
+        the largest one and how often every byte value occurs.'''
+        words = arg.split()
+        ascii_view = 'ascii' in words
+        summary = 'summary' in words
+        words = [word for word in words if word not in ('ascii', 'summary')]
+        depth = len(self.stack)
+        start, stop = 0, depth
+        try:
+            if len(words) > 1:
+                raise ValueError('more than one range')
+            if words:
+                start, stop = _stack_range(words[0], depth)
+        except ValueError:
+            self.print_('Error: give a number N or a range A:B of values')
+            return
+        values = _stack_values(self.stack, start, stop)
+        if summary:
+            self._print_summary(values)
+            return
+        items = _ascii_items(values) if ascii_view else map(repr, values)
+        # the values which are not shown
+        items = chain(['...'] if start > 0 else [], items,
+                      ['...'] if stop < depth else [])
+        pieces = _format_items(items)
+        piece = next(pieces)
+        for following in pieces:
+            self.print_(piece, False)
+            piece = following
+        self.print_(piece)
+
+    def _print_summary(self, values, width=40):
+        '''print the number, the range and a histogram of the byte values of
+        the iterable *values*'''
+        count, smallest, largest, others, histogram = _summarize(values)
+        if smallest is None:
+            self.print_('%d values' % count)
+        else:
+            self.print_('%d values from %d to %d' % (
+                count, smallest, largest))
+        if others:
+            self.print_('%d of them are no integers' % others)
+        most = max(histogram)
+        for value, n in enumerate(histogram):
+            if n:
+                self.print_('%5d %-5s %8d %s' % (
+                    value, repr(chr(value)) if 32 <= value < 127 else '',
+                    n, '#' * max(n * width // most, 1)))
 
     def do_show_pc(self, _):
         'print the direction of the PC (Program Counter)'
         self.print_(repr(self.pc))
 
+    def do_show_cache(self, _):
+        'print the statistics of the cache of parsed programs'
+        self.print_(str(program_cache))
+
+    def do_show_profile(self, _):
+        'print how often and how long every befunge command was executed'
+        if self.profile is None:
+            self.print_(
+                'Profiling is disabled, start the shell with --profile')
+        else:
+            self.print_(self.profile.format_table())
+
+    def do_show_cfg(self, filename):
+        '''print the control flow graph of the program in the given file, or of
+        the playfield of the shell'''
+        if filename:
+            try:
+                with open(filename) as f:
+                    source = f.read()
+            except IOError as e:
+                self.print_('Error: %s' % e)
+                return
+            cfg = program_cache.get(source).cfg
+        else:
+            cfg = ControlFlowGraph(self.playfield)
+        self.print_(cfg.format())
+
     def do_EOF(self, _):
         'exit the shell with the command "exit", "quit", or by typing Ctrl+D'
         return True
     do_exit = do_quit = do_EOF
 
-if __name__ == '__main__':
-    shell = BefungeShell()
+
+class BefungeInterpreter(BefungeMachine):
+    '''Run a whole befunge-93 program on a torus shaped playfield of 80x25
+    cells. The commands which only work on the stack behave exactly like they
+    do in BefungeShell.
+
+    '''
+    width = Playfield.width
+    height = Playfield.height
+
+    def __init__(self, source='', stdin=None, stdout=None, stack_class=Stack,
+                 buffering=FULLY_BUFFERED, cache=program_cache,
+                 jit_threshold=50, cells=UNBOUNDED, seed=None, limits=None):
+        BefungeMachine.__init__(self, stack_class, cells, seed, limits)
+        self.stdin = sys.stdin if stdin is None else stdin
+        self.stdout = sys.stdout if stdout is None else stdout
+        self.output = OutputSink(self.stdout, buffering)
+        self.input_source = InputSource(
+            self.stdin, before_read=self.output.flush)
+        self.cache = cache
+        # the number of times a conditional branch is executed before the
+        # loop around it is compiled (see compile_trace); None disables this
+        self.jit_threshold = jit_threshold
+        self.load(source)
+
+    @classmethod
+    def from_file(cls, filename, **kwargs):
+        with open(filename) as f:
+            return cls(f.read(), **kwargs)
+
+    def _build_dispatch_table(self):
+        table = BefungeMachine._build_dispatch_table(self)
+        # string mode and p are handled by the step loop itself
+        table[ord('"')] = None
+        table[ord('p')] = None
+        return table
+
+    def load(self, source):
+        '''Put *source* onto an empty playfield and move the PC to the upper
+        left corner, heading right. The parsed program is taken from the
+        cache if there is one.
+
+        '''
+        if self.cache is None:
+            self.program = Program(source, self.cells)
+        else:
+            self.program = self.cache.get(source, self.cells)
+        self.playfield = self.program.playfield.copy()
+        self.segment_tables = self.program.segment_tables
+        self.traces = self.program.traces
+        self._branch_counts = [0] * (self.width * self.height)
+        self.x = self.y = 0
+        self.dx, self.dy = DIRECTIONS['>']
+        self.string_mode = False
+        self.steps = 0
+
+    def run(self):
+        '''Execute the program until the command @ is reached or one of
+        self.limits is exceeded. Return the number of steps which were
+        executed.
+
+        '''
+        playfield = self.playfield
+        rows = playfield.rows
+        dispatch = self._dispatch
+        stack = self.stack
+        width = self.width
+        height = self.height
+        x, y, dx, dy = self.x, self.y, self.dx, self.dy
+        tables = self.segment_tables
+        table = tables[dx, dy]
+        traces = self.traces
+        branch_counts = self._branch_counts
+        jit_threshold = self.jit_threshold
+        string_mode = self.string_mode
+        cells = self.cells
+        choice = self.directions.choice
+        directions = tuple(DIRECTIONS[pc] for pc in '><^v')
+        steps = 0
+        limits = self.limits
+        self.limit_reached = None
+        # the number of steps after which the limits are checked next
+        check_at = sys.maxsize
+        if limits is not None:
+            start = default_timer()
+            check_at = self._next_check(steps)
+        try:
+            while True:
+                if steps >= check_at:
+                    self.limit_reached = self.exceeded_limit(
+                        self.steps + steps, start)
+                    if self.limit_reached is not None:
+                        break
+                    check_at = self._next_check(steps)
+                code = rows[y][x]
+                steps += 1
+                if string_mode:
+                    if code == 34:  # "
+                        string_mode = False
+                    else:
+                        stack.append(code)
+                else:
+                    handler = dispatch[code]
+                    if handler is not None:
+                        index = y * width + x
+                        segment = table[index]
+                        if segment is None:
+                            segment = table[index] = playfield.segment_at(
+                                x, y, dx, dy, cells)
+                        if segment:
+                            # execute the whole straight-line segment at once
+                            function, length = segment
+                            function(self)
+                            steps += length - 1
+                            x = (x + (length - 1) * dx) % width
+                            y = (y + (length - 1) * dy) % height
+                        else:
+                            handler()
+                    elif code == 32:  # space
+                        pass
+                    elif code == 62:  # >
+                        dx, dy = 1, 0
+                        table = tables[dx, dy]
+                    elif code == 60:  # <
+                        dx, dy = -1, 0
+                        table = tables[dx, dy]
+                    elif code == 94:  # ^
+                        dx, dy = 0, -1
+                        table = tables[dx, dy]
+                    elif code == 118:  # v
+                        dx, dy = 0, 1
+                        table = tables[dx, dy]
+                    elif code == 95 or code == 124:  # _ |
+                        index = y * width + x
+                        trace = traces.get(index)
+                        if trace is None and jit_threshold is not None:
+                            branch_counts[index] += 1
+                            if branch_counts[index] >= jit_threshold:
+                                trace = self._compile_trace(x, y)
+                                traces = self.traces
+                        if trace:
+                            # run the compiled loop until it leaves or the
+                            # limits have to be checked
+                            x, y, dx, dy, length = trace(
+                                self, check_at - steps)
+                            steps += length
+                            tables = self.segment_tables
+                            table = tables[dx, dy]
+                            traces = self.traces
+                            continue
+                        if code == 95:
+                            dx, dy = ((-1, 0) if stack.pop_exceptionless()
+                                      else (1, 0))
+                        else:
+                            dx, dy = ((0, -1) if stack.pop_exceptionless()
+                                      else (0, 1))
+                        table = tables[dx, dy]
+                    elif code == 63:  # ?
+                        dx, dy = choice(directions)
+                        table = tables[dx, dy]
+                    elif code == 34:  # "
+                        end = -1
+                        if dx == 1:
+                            end = rows[y].find(b'"', x + 1)
+                        if end == -1:
+                            string_mode = True
+                        else:
+                            # push the whole string at once
+                            stack.extend_from_bytes(rows[y][x + 1:end])
+                            steps += end - x
+                            x = end
+                    elif code == 35:  # #
+                        x = (x + dx) % width
+                        y = (y + dy) % height
+                    elif code == 112:  # p
+                        if self.put():
+                            tables = self.segment_tables
+                            table = tables[dx, dy]
+                            traces = self.traces
+                    elif code == 64:  # @
+                        break
+                x = (x + dx) % width
+                y = (y + dy) % height
+        except Exception:
+            # stop on the command which failed, also in compiled code
+            x, y, dx, dy, steps = self._failed_command(
+                sys.exc_info()[2], x, y, dx, dy, steps)
+            raise
+        finally:
+            # also when a command raised an exception
+            self.x, self.y, self.dx, self.dy = x, y, dx, dy
+            self.string_mode = string_mode
+            self.steps += steps
+            self.output.flush()
+        return steps
+
+    def _failed_command(self, traceback, x, y, dx, dy, steps):
+        '''Return x, y, dx, dy and the steps of the command which raised the
+        exception of *traceback* in run. x, y, dx, dy and *steps* are those
+        of run: the cell of a compiled segment or trace which was called, or
+        of the command which failed.'''
+        traceback = traceback.tb_next
+        if traceback is None:
+            return x, y, dx, dy, steps
+        frame = traceback.tb_frame
+        name = frame.f_code.co_filename
+        if name.startswith('<segment '):
+            index = frame.f_globals['segment'].command_indices[
+                traceback.tb_lineno - 3]
+            # walk the cells of the segment up to the command
+            rows = self.playfield.rows
+            while True:
+                if chr(rows[y][x]) in STRAIGHT_LINE_COMMANDS:
+                    if index == 0:
+                        break
+                    index -= 1
+                x = (x + dx) % self.width
+                y = (y + dy) % self.height
+                steps += 1
+        elif name.startswith('<trace '):
+            state = frame.f_globals['trace'].command_states.get(
+                traceback.tb_lineno)
+            if state is not None:
+                x, y, dx, dy, path_steps = state
+                steps += frame.f_locals['steps'] + path_steps + 1
+        return x, y, dx, dy, steps
+
+    def _next_check(self, steps):
+        limits = self.limits
+        check_at = steps + limits.check_every
+        if limits.steps is not None:
+            # stop exactly at the step limit
+            check_at = min(check_at, limits.steps - self.steps)
+        return check_at
+
+    def execute(self):
+        '''Run the program and return an ExecutionResult. An exception
+        raised by a command stops the program and is reported in the
+        result instead of being raised.'''
+        error = None
+        try:
+            self.run()
+        except Exception:
+            error = '%s: %s' % (sys.exc_info()[0].__name__, sys.exc_info()[1])
+        return ExecutionResult(self.limit_reached, self.steps, self.stack,
+                               (self.x, self.y, _PC_NAMES[self.dx, self.dy]),
+                               error)
+
+    def put(self):
+        '''Like BefungeMachine.put, and forget the compiled code which may
+        run through the changed cell.'''
+        return self.put_cell() is not None
+
+    def put_cell(self):
+        '''Like put, but return the position of the cell if its command was
+        changed and None otherwise.'''
+        y = self.stack.pop_exceptionless()
+        x = self.stack.pop_exceptionless()
+        if self.playfield.put(x, y, self.stack.pop_exceptionless()):
+            self._invalidate_compiled(x, y)
+            return x, y
+
+    def _compile_trace(self, x, y):
+        trace = compile_trace(self.playfield, x, y, self.cells) or False
+        # traces compiled from a changed playfield are not shared
+        self.traces[y * self.width + x] = trace
+        return trace
+
+    def _invalidate_compiled(self, x, y):
+        self.traces = dict(
+            (index, trace) for index, trace in self.traces.items()
+            if not trace or (x, y) not in trace.covered)
+        if self.segment_tables is self.program.segment_tables:
+            # the segments of the cached program are shared with other runs
+            self.segment_tables = dict(
+                (direction, list(table))
+                for direction, table in self.segment_tables.items())
+        width, height = self.width, self.height
+        for dx, dy in DIRECTIONS.values():
+            table = self.segment_tables[dx, dy]
+            if dy == 0:
+                table[y * width:(y + 1) * width] = [None] * width
+            else:
+                table[x::width] = [None] * height
+
+    def output_int(self):
+        self.output.write_int(self.stack.pop_exceptionless(), ' ')
+
+    def output_char(self):
+        self.output.write_char(self.stack.pop_exceptionless())
+
+    def input_int(self):
+        '''Push the integer of the next word of the input. Push -1 if the end
+        of the input is reached or the word is no integer.'''
+        number = self.input_source.read_int()
+        self.stack.append(number if self._wrap is None else self._wrap(number))
+
+    def input_char(self):
+        '''Push the ASCII value of the next input character or -1 at the end
+        of the input.'''
+        char = self.input_source.read_char()
+        self.stack.append(ord(char) if char else -1)
+
+
+def main(argv=None):
+    from optparse import OptionParser
+    parser = OptionParser(usage='%prog [--batch FILE | PROGRAM]')
+    parser.add_option(
+        '--batch', metavar='FILE',
+        help='execute the commands of FILE without prompting; '
+             'use "-" to read them from the standard input')
+    parser.add_option(
+        '--buffering', choices=[UNBUFFERED, LINE_BUFFERED, FULLY_BUFFERED],
+        help='when to write the output: "unbuffered", after every "line" or '
+             'only when the buffer is "full" or input is requested '
+             '(default: unbuffered for the interactive shell, full otherwise)')
+    parser.add_option(
+        '--profile', action='store_true', default=False,
+        help='record the number of executions and the time of every command '
+             '(see the command "show_profile")')
+    parser.add_option(
+        '--profile-json', metavar='FILE',
+        help='like --profile, and write the results as JSON to FILE on exit')
+    parser.add_option(
+        '--cells', choices=list(CELL_MODES), default=UNBOUNDED,
+        help='the values a cell can hold: "unbounded" integers, or signed '
+             'integers which wrap around at 32 ("int32") or 64 bits ("int64") '
+             '(default: %default)')
+    parser.add_option(
+        '--seed', type='int',
+        help='seed the random directions of the command ? with SEED, so that '
+             'every run chooses the same ones')
+    parser.add_option(
+        '--record-directions', metavar='FILE',
+        help='write the directions which the command ? chose to FILE on exit')
+    parser.add_option(
+        '--replay-directions', metavar='FILE',
+        help='let the command ? choose the directions written by '
+             '--record-directions to FILE, in the same order')
+    parser.add_option(
+        '--stack-memory', type='int', metavar='N',
+        help='keep at most N values of the stack in memory and spill the '
+             'older ones to a temporary file')
+    parser.add_option(
+        '--log', metavar='FILE',
+        help='append the commands, inputs and random directions of the '
+             'session to FILE')
+    parser.add_option(
+        '--replay', metavar='FILE',
+        help='execute the session logged to FILE with --log again before '
+             'going on')
+    options, args = parser.parse_args(argv)
+    stack_class = Stack
+    if options.stack_memory is not None:
+        if options.stack_memory < 2:
+            parser.error('--stack-memory must be at least 2')
+        stack_class = partial(
+            SpillStack, memory_limit=options.stack_memory,
+            chunk_size=min(options.stack_memory // 2, SPILL_CHUNK_SIZE))
+    batch = args or options.batch is not None
+    buffering = options.buffering or (FULLY_BUFFERED if batch else UNBUFFERED)
+    replay = recording = None
+    if options.replay_directions is not None:
+        with open(options.replay_directions) as f:
+            replay = parse_directions(f.read())
+    if options.record_directions is not None:
+        recording = []
+    directions = RandomDirections(options.seed, replay, recording)
+    if args:
+        interpreter = BefungeInterpreter.from_file(
+            args[0], buffering=buffering, cells=options.cells,
+            stack_class=stack_class)
+        interpreter.directions = directions
+        try:
+            interpreter.run()
+        finally:
+            _write_directions(options.record_directions, recording)
+        return
+    # the commands of a batch file run without prompts, and their input is
+    # read in bulk; with "-" the commands themselves come from stdin
+    shell = BefungeShell(
+        buffering=buffering, cells=options.cells, stack_class=stack_class,
+        profile=options.profile or options.profile_json is not None,
+        bulk_input=options.batch not in (None, '-'))
+    if options.batch == '-':
+        # & and ~ read the lines after the commands, a prompt would end up
+        # in the output of the program
+        shell.number_prompt = shell.char_prompt = ''
+    shell.directions = directions
     try:
-        shell.cmdloop()
+        if options.replay is not None:
+            # go on where the logged session was quit
+            shell.replay(options.replay)
+        if options.log is not None:
+            shell.start_log(options.log)
+        if options.batch == '-':
+            shell.run_commands(sys.stdin)
+        elif options.batch is not None:
+            with open(options.batch) as f:
+                shell.run_commands(f)
+        else:
+            shell.cmdloop()
     except KeyboardInterrupt:
         pass
+    finally:
+        if options.profile_json is not None:
+            import json
+            with open(options.profile_json, 'w') as f:
+                json.dump(shell.profile.as_dict(), f, indent=2, sort_keys=True)
+        _write_directions(options.record_directions, recording)
+        shell.stop_log()
+
+
+def _write_directions(filename, recording):
+    if filename is not None:
+        with open(filename, 'w') as f:
+            f.write(format_directions(recording) + '\n')
+
+
+if __name__ == '__main__':
+    main()
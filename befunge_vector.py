@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# befungeshell - an interactive shell to help writing befunge programs
+# Copyright (C) 2011 Simon Liedtke
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+'''Run one befunge program over many inputs at once. Every input is a lane,
+and lanes which take the same path through the program are executed
+together as a group: every value on their stack is a NumPy array with one
+element per lane. When the lanes of a group branch differently at _ or |,
+the group is split in two. Needs NumPy.
+
+The cells are signed 64 bit integers, so every lane gives the same result
+as BefungeInterpreter with cells=INT64 and the numbers of the lane as its
+input.
+
+'''
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from befunge_shell import CELL_OPERATORS, DIRECTIONS, INT64, Playfield
+
+# the output, the final stack (the bottom value first) and the number of
+# steps of one lane
+LaneResult = namedtuple('LaneResult', 'output stack steps')
+
+_SCALAR_OPERATORS = CELL_OPERATORS[INT64]
+
+
+def _divide(a, b):
+    # numpy divides towards minus infinity, befunge towards zero
+    quotient = numpy.floor_divide(a, b)
+    inexact = (a - quotient * b != 0) & ((a < 0) != (b < 0))
+    return quotient + inexact
+
+
+def _greater(a, b):
+    return numpy.greater(a, b).astype(numpy.int64)
+
+
+_ARRAY_OPERATORS = {
+    '+': lambda a, b: numpy.add(a, b),
+    '-': lambda a, b: numpy.subtract(a, b),
+    '*': lambda a, b: numpy.multiply(a, b),
+    '/': _divide,
+    '%': lambda a, b: numpy.fmod(a, b),
+    '`': _greater,
+}
+
+
+class _Group(object):
+    '''Lanes which share the PC and therefore the depth of their stack.
+    Every value of *stack* is an int if it is the same in all lanes, and an
+    array with one element per lane otherwise.'''
+    def __init__(self, lanes, stack, x, y, dx, dy, steps, position):
+        self.lanes = lanes
+        self.stack = stack
+        self.x, self.y, self.dx, self.dy = x, y, dx, dy
+        self.steps = steps
+        # the number of & commands which were executed
+        self.position = position
+        # (is_char, value) for every . and , command
+        self.outputs = []
+
+    def split(self, mask):
+        '''Return the lanes where *mask* is true and the other ones as two
+        new groups with the same state'''
+        groups = []
+        for selection in (mask, ~mask):
+            stack = [value if isinstance(value, int) else value[selection]
+                     for value in self.stack]
+            groups.append(_Group(
+                self.lanes[selection], stack, self.x, self.y, self.dx,
+                self.dy, self.steps, self.position))
+        return groups
+
+
+class VectorInterpreter(object):
+    '''Run the program *source* once for every sequence of numbers in
+    *inputs*, which the command & reads. & pushes -1 when a lane has no
+    numbers left. The commands p, ? and ~ are not supported.
+
+    '''
+    width = Playfield.width
+    height = Playfield.height
+
+    def __init__(self, source, inputs):
+        if numpy is None:
+            raise ImportError('VectorInterpreter needs numpy')
+        self.playfield = Playfield(source)
+        self.cells = numpy.array(
+            [list(row) for row in self.playfield.rows], dtype=numpy.int64)
+        inputs = [list(numbers) for numbers in inputs]
+        self.inputs = numpy.full(
+            (len(inputs), max([len(numbers) for numbers in inputs] or [0])),
+            -1, dtype=numpy.int64)
+        for lane, numbers in enumerate(inputs):
+            self.inputs[lane, :len(numbers)] = numbers
+        self.lanes = len(inputs)
+        # the number of groups which were split off, see run
+        self.splits = 0
+
+    def run(self):
+        '''Run all lanes until they reach the command @ and return a
+        LaneResult for every lane, in the order of the inputs'''
+        outputs = [[] for _ in range(self.lanes)]
+        results = [None] * self.lanes
+        pending = [_Group(numpy.arange(self.lanes), [], 0, 0, 1, 0, 0, 0)]
+        # the results wrap around like the ones of the INT64 cell mode
+        with numpy.errstate(over='ignore', divide='ignore'):
+            while pending:
+                group = pending.pop()
+                split = self.run_group(group)
+                self._collect_output(group, outputs)
+                if split is not None:
+                    self.splits += 1
+                    pending.extend(split)
+                    continue
+                stacks = [
+                    [value] * len(group.lanes) if isinstance(value, int)
+                    else value.tolist()
+                    for value in group.stack]
+                for index, lane in enumerate(group.lanes.tolist()):
+                    results[lane] = LaneResult(
+                        ''.join(outputs[lane]),
+                        [values[index] for values in stacks], group.steps)
+        return results
+
+    def _collect_output(self, group, outputs):
+        if not group.outputs:
+            return
+        columns = []
+        for is_char, value in group.outputs:
+            if isinstance(value, int):
+                text = chr(value) if is_char else '%d ' % value
+                columns.append([text] * len(group.lanes))
+            elif is_char:
+                columns.append([chr(v) for v in value.tolist()])
+            else:
+                columns.append(['%d ' % v for v in value.tolist()])
+        for lane, texts in zip(group.lanes.tolist(), zip(*columns)):
+            outputs[lane].append(''.join(texts))
+        del group.outputs[:]
+
+    def run_group(self, group):
+        '''Execute the commands of *group* until it reaches @ or its lanes
+        branch differently. Return None in the first case and the two new
+        groups in the second one.'''
+        rows = self.playfield.rows
+        width, height = self.width, self.height
+        stack = group.stack
+        x, y, dx, dy = group.x, group.y, group.dx, group.dy
+        steps = group.steps
+        string_mode = False
+        split = None
+        while True:
+            code = rows[y][x]
+            steps += 1
+            char = chr(code)
+            if string_mode:
+                if code == 34:  # "
+                    string_mode = False
+                else:
+                    stack.append(code)
+            elif 48 <= code <= 57:  # digit
+                stack.append(code - 48)
+            elif char in _ARRAY_OPERATORS:
+                if len(stack) >= 2:
+                    b = stack.pop()
+                    a = stack.pop()
+                    stack.append(self.calculate(char, a, b))
+            elif code == 32:  # space
+                pass
+            elif char in DIRECTIONS:
+                dx, dy = DIRECTIONS[char]
+            elif code == 95 or code == 124:  # _ |
+                value = stack.pop() if stack else 0
+                if not isinstance(value, int):
+                    mask = value != 0
+                    if mask.all():
+                        value = 1
+                    elif not mask.any():
+                        value = 0
+                    else:
+                        # the PC stays on the branch, which every new
+                        # group executes with its part of the mask
+                        group.stack = stack
+                        group.x, group.y, group.dx, group.dy = x, y, dx, dy
+                        group.steps = steps - 1
+                        stack.append(value)
+                        split = group.split(mask)
+                        for part in split:
+                            part.stack[-1] = int(part is split[0])
+                        break
+                if code == 95:
+                    dx, dy = (-1, 0) if value else (1, 0)
+                else:
+                    dx, dy = (0, -1) if value else (0, 1)
+            elif code == 33:  # !
+                value = stack.pop() if stack else 0
+                if isinstance(value, int):
+                    stack.append(int(not value))
+                else:
+                    stack.append((value == 0).astype(numpy.int64))
+            elif code == 58:  # :
+                stack.append(stack[-1] if stack else 0)
+            elif code == 92:  # \
+                stack.append(stack.pop(-2))
+            elif code == 36:  # $
+                if stack:
+                    stack.pop()
+            elif code == 46 or code == 44:  # . ,
+                group.outputs.append(
+                    (code == 44, stack.pop() if stack else 0))
+            elif code == 38:  # &
+                if group.position < self.inputs.shape[1]:
+                    stack.append(self.inputs[group.lanes, group.position])
+                else:
+                    stack.append(-1)
+                group.position += 1
+            elif code == 103:  # g
+                self.get(stack)
+            elif code == 34:  # "
+                string_mode = True
+            elif code == 35:  # #
+                x = (x + dx) % width
+                y = (y + dy) % height
+            elif code == 64:  # @
+                break
+            else:
+                raise ValueError(
+                    'the command %s cannot be run on many lanes' % char)
+            x = (x + dx) % width
+            y = (y + dy) % height
+        if split is None:
+            group.stack = stack
+            group.x, group.y, group.dx, group.dy = x, y, dx, dy
+            group.steps = steps
+        return split
+
+    def calculate(self, command, a, b):
+        if isinstance(a, int) and isinstance(b, int):
+            return int(_SCALAR_OPERATORS[command](a, b))
+        if command in '/%' and numpy.any(numpy.equal(b, 0)):
+            raise ZeroDivisionError('division by zero in one of the lanes')
+        return _ARRAY_OPERATORS[command](a, b)
+
+    def get(self, stack):
+        y = stack.pop() if stack else 0
+        x = stack.pop() if stack else 0
+        if isinstance(x, int) and isinstance(y, int):
+            stack.append(self.playfield.get(x, y))
+            return
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        values = self.cells[numpy.where(inside, y, 0),
+                            numpy.where(inside, x, 0)]
+        stack.append(numpy.where(inside, values, 32))
+
+
+def run_lanes(source, inputs):
+    '''Run *source* once for every sequence of numbers in *inputs* and
+    return the LaneResult of every lane, see VectorInterpreter'''
+    return VectorInterpreter(source, inputs).run()
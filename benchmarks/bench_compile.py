@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+'''Compare executing lines of straight-line commands one by one through the
+dispatch table with executing them as compiled segments.
+
+Run it from the root of the repository::
+
+    python benchmarks/bench_compile.py
+
+'''
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from befunge_shell import BefungeShell
+
+LINES = ['55*3*52*+', ':+', '2*1-', '\\$', '98*7+:*'] * 200
+COMMAND_COUNT = sum(len(line) for line in LINES)
+
+
+def dispatched(shell):
+    default = shell.default
+    for line in LINES:
+        for command in line:
+            default(command)
+
+
+def compiled(shell):
+    shell.run_commands(LINES)
+
+
+def commands_per_second(run, repeat=5):
+    shell = BefungeShell()
+    shell.stack.push_many([1, 2])
+
+    def once():
+        run(shell)
+        del shell.stack[2:]
+    best = min(timeit.repeat(once, number=20, repeat=repeat))
+    return COMMAND_COUNT * 20 / best
+
+
+def main():
+    before = commands_per_second(dispatched)
+    after = commands_per_second(compiled)
+    sys.stdout.write('dispatched: %12.0f commands/s\n' % before)
+    sys.stdout.write('compiled:   %12.0f commands/s\n' % after)
+    sys.stdout.write('speedup: %.2fx\n' % (after / before))
+
+
+if __name__ == '__main__':
+    main()
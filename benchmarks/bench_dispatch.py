@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+'''Micro-benchmark comparing the per-call dicts which parse_command used to
+build with the dispatch table which is built once per shell instance.
+
+Run it from the root of the repository::
+
+    python benchmarks/bench_dispatch.py
+
+'''
+import os
+import sys
+import timeit
+from operator import add, sub, mul, floordiv, mod, gt as greater
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from befunge_shell import BefungeShell
+
+# a command stream without output and input commands, so that only the
+# dispatching and the stack operations are measured
+COMMANDS = list('55*3*52*+:2\\$!>v<^9`') * 50
+
+
+class LegacyShell(BefungeShell):
+    '''The shell as it was before the dispatch table was introduced'''
+    def default(self, line):
+        if self.string_mode:
+            if not line == '"':
+                self.stack.append(ord(line))
+            else:
+                self.toggle_string_mode()
+        else:
+            try:
+                num = int(line)
+            except ValueError:
+                self.parse_command(line)
+            else:
+                if num in range(10):
+                    self.stack.append(num)
+                else:
+                    self.print_('Error: only numbers from 0 to 9 are allowed')
+
+    def parse_command(self, command):
+        operator = {
+            '+': add,
+            '-': sub,
+            '*': mul,
+            '/': floordiv,
+            '%': mod,
+            '`': greater
+        }.get(command)
+        if operator is not None:
+            self.calculate(operator)
+        else:
+            if command in ('><^v?_|'):
+                self.change_pc(command)
+            else:
+                func = {
+                    '!': self.not_,
+                    '"': self.toggle_string_mode,
+                    ':': self.stack.duplicate_top,
+                    '\\': self.stack.swap_topmost_values,
+                    '$': self.stack.pop_exceptionless,
+                    '.': lambda: self.print_(self.stack.pop_exceptionless()),
+                    ',': lambda: self.print_(
+                        chr(self.stack.pop_exceptionless())),
+                    '&': lambda: self.stack.append(self.prompt_num()),
+                    '~': lambda: self.stack.append(ord(self.prompt_char())),
+                    '@': self.simulate_exit
+                }.get(command)
+                if func is not None:
+                    func()
+                elif command in '#gp':
+                    self.print_(
+                        'Note: The commands #, g, p are not supported.')
+                else:
+                    self.print_('Error: unknown command %r' % command)
+
+
+def commands_per_second(shell_class, repeat=5):
+    shell = shell_class()
+    default = shell.default
+
+    def run():
+        for command in COMMANDS:
+            default(command)
+        del shell.stack[:]
+    best = min(timeit.repeat(run, number=20, repeat=repeat))
+    return len(COMMANDS) * 20 / best
+
+
+def main():
+    before = commands_per_second(LegacyShell)
+    after = commands_per_second(BefungeShell)
+    sys.stdout.write('before: %12.0f commands/s\n' % before)
+    sys.stdout.write('after:  %12.0f commands/s\n' % after)
+    sys.stdout.write('speedup: %.2fx\n' % (after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+'''Compare an interactive session with the replay of its session log.
+
+Run it from the root of the repository::
+
+    python benchmarks/bench_replay.py [LINES]
+
+The session types one command per line into the command loop, with & and ?
+among them, and is logged with --log. The log is then replayed with
+BefungeShell.replay, which reads it through mmap and skips the command
+loop. Both are timed a few times, and the best times are compared.
+
+'''
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+try:
+    from StringIO import StringIO
+except ImportError:  # python3
+    from io import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from befunge_shell import BefungeShell, read_session_log
+
+# the lines of one round, with the input of & after it
+ROUND = ['1', '2', '+', ':', '&', '42', '*', '?', '$', '3', '%', '.', '$']
+
+
+class NullOutput(object):
+    def write(self, s):
+        pass
+
+    def flush(self):
+        pass
+
+
+def run_session(log, rounds):
+    'run the interactive session, logged to *log*, and return the shell'
+    shell = BefungeShell(stdin=StringIO('\n'.join(ROUND * rounds)),
+                         stdout=NullOutput(), seed=1)
+    shell.use_rawinput = False
+    shell.start_log(log)
+    try:
+        shell.cmdloop()
+    finally:
+        shell.stop_log()
+    return shell
+
+
+def main(argv=None, repeat=3):
+    argv = sys.argv[1:] if argv is None else argv
+    lines = int(argv[0]) if argv else 100000
+    rounds = lines // len(ROUND) + 1
+    directory = tempfile.mkdtemp()
+    interactive = replay = None
+    try:
+        for i in range(repeat):
+            log = os.path.join(directory, 'session%d.log' % i)
+            start = time.time()
+            shell = run_session(log, rounds)
+            elapsed = time.time() - start
+            interactive = elapsed if interactive is None else min(
+                interactive, elapsed)
+            start = time.time()
+            replayed = BefungeShell(stdout=NullOutput())
+            replayed.replay(log)
+            elapsed = time.time() - start
+            replay = elapsed if replay is None else min(replay, elapsed)
+            assert replayed.stack == shell.stack
+        size = os.path.getsize(log)
+        records = len(read_session_log(log)[0])
+    finally:
+        shutil.rmtree(directory)
+    sys.stdout.write('%d lines, log of %.1f KB\n' % (records, size / 1024.0))
+    sys.stdout.write('interactive loop %8.3f s\n' % interactive)
+    sys.stdout.write('replay           %8.3f s\n' % replay)
+    sys.stdout.write('speedup: %.1fx\n' % (interactive / replay))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+'''Open thousands of idle sessions on the shell server and report the memory
+which every session costs.
+
+Run it from the root of the repository::
+
+    python benchmarks/bench_server.py [SESSIONS]
+
+The server and the clients share one process and talk over a Unix socket.
+Every client waits for the prompt and then stays idle.
+
+'''
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from befunge_server import start_server
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+def raise_file_limit(sessions):
+    # every session needs a socket on both the client and the server side
+    if resource is None:
+        return sessions
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = 2 * sessions + 64
+    if hard != resource.RLIM_INFINITY:
+        wanted = min(wanted, hard)
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+    return min(sessions, (wanted - 64) // 2)
+
+
+def peak_rss_kb():
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on Mac OS X, in KB everywhere else
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+async def open_sessions(path, sessions):
+    clients = []
+    for _ in range(sessions):
+        reader, writer = await asyncio.open_unix_connection(path)
+        await reader.readuntil(b'>>> ')
+        clients.append((reader, writer))
+    return clients
+
+
+async def bench(sessions):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'befunge.sock')
+    server = await start_server(path=path)
+    try:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        rss_before = peak_rss_kb()
+        start = time.time()
+        clients = await open_sessions(path, sessions)
+        seconds = time.time() - start
+        # one busy session among the idle ones still answers quickly
+        reader, writer = clients[0]
+        start = time.time()
+        writer.write(b'55*.\n')
+        await reader.readuntil(b'>>> ')
+        latency = time.time() - start
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        rss = peak_rss_kb() - rss_before
+        for reader, writer in clients:
+            writer.close()
+        # let the sessions see the end of their connections
+        while len(asyncio.all_tasks()) > 1:
+            await asyncio.sleep(0.01)
+    finally:
+        server.close()
+        await server.wait_closed()
+        shutil.rmtree(directory)
+    return seconds, latency, used, rss
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    sessions = raise_file_limit(int(argv[0]) if argv else 2000)
+    seconds, latency, used, rss = asyncio.run(bench(sessions))
+    sys.stdout.write('%d idle sessions opened in %.2f s\n' % (
+        sessions, seconds))
+    sys.stdout.write('traced memory: %.1f KB per session (client included)\n'
+                     % (used / 1024.0 / sessions))
+    sys.stdout.write('peak RSS growth: %.1f KB per session\n' % (
+        rss / float(sessions)))
+    sys.stdout.write('latency of one command: %.2f ms\n' % (latency * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+'''Compare the memory usage and the throughput of the list based Stack with
+the array based ArrayStack and the SpillStack, which keeps 2^17 values in
+memory, when holding 10^6 values.
+
+Run it from the root of the repository::
+
+    python benchmarks/bench_stack.py
+
+'''
+import os
+import sys
+import time
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from befunge_shell import Stack, ArrayStack, SpillStack
+
+try:
+    import tracemalloc
+except ImportError:  # python < 3.4
+    tracemalloc = None
+
+N = 10 ** 6
+DATA = bytearray(range(256)) * (N // 256 + 1)
+DATA = DATA[:N]
+
+
+def measure(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def bench(stack_class):
+    results = {}
+    stack = stack_class()
+    results['append'] = measure(lambda: [stack.append(v) for v in DATA])
+    stack = stack_class()
+    results['extend_from_bytes'] = measure(
+        lambda: stack.extend_from_bytes(DATA))
+    results['pop_many'] = measure(lambda: stack.pop_many(N))
+    stack = stack_class()
+    results['push_many'] = measure(lambda: stack.push_many(range(N)))
+    if tracemalloc is not None:
+        del stack
+        tracemalloc.start()
+        stack = stack_class()
+        stack.push_many(range(1000, N + 1000))
+        results['memory'] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    return results
+
+
+STACKS = [
+    ('Stack', Stack),
+    ('ArrayStack', ArrayStack),
+    ('SpillStack', partial(SpillStack, memory_limit=1 << 17)),
+]
+
+
+def main():
+    for label, stack_class in STACKS:
+        results = bench(stack_class)
+        sys.stdout.write('%s (10^6 values)\n' % label)
+        for name in ('append', 'extend_from_bytes', 'pop_many', 'push_many'):
+            sys.stdout.write(
+                '  %-18s %8.0f values/ms\n' % (name, N / results[name] / 1000))
+        if 'memory' in results:
+            sys.stdout.write(
+                '  %-18s %8.1f MB\n'
+                % ('memory', results['memory'] / 2.0 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+'''Measure how long it takes to start the shell in batch mode, and which
+imports the start costs.
+
+The shell is started twice: as the script befunge_shell.py, which python
+compiles on every start, and through the entry point which setup.py installs
+as befunge-shell, which imports the compiled module.
+
+Run it from the root of the repository::
+
+    python benchmarks/bench_startup.py [RUNS]
+
+The imports are listed with ``python -X importtime`` (python 3.7 and newer).
+
+'''
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+SHELL = os.path.join(ROOT, 'befunge_shell.py')
+
+
+def time_runs(command, runs):
+    best = None
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call(command, stdout=subprocess.PIPE)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def slowest_imports(count=10):
+    '''Return the (microseconds, module) pairs of the *count* imports with
+    the highest cumulative time when importing befunge_shell'''
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', 'import befunge_shell'],
+        cwd=ROOT, stderr=subprocess.PIPE, universal_newlines=True)
+    stderr = process.communicate()[1]
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    runs = int(argv[0]) if argv else 20
+    handle, commands = tempfile.mkstemp()
+    os.write(handle, b'55*3*\n52*2*+\n')
+    os.close(handle)
+    # the entry point imports the module, which is compiled only once
+    subprocess.check_call([sys.executable, '-m', 'py_compile', SHELL])
+    entry_point = [sys.executable, '-c',
+                   'import sys; sys.path.insert(0, %r); '
+                   'import befunge_shell; befunge_shell.main()' % ROOT]
+    try:
+        python = time_runs([sys.executable, '-c', 'pass'], runs)
+        script = time_runs([sys.executable, SHELL, '--batch', commands], runs)
+        entry = time_runs(entry_point + ['--batch', commands], runs)
+    finally:
+        os.remove(commands)
+    for name, seconds in [('python without the shell', python),
+                          ('befunge_shell.py --batch', script),
+                          ('befunge-shell --batch', entry)]:
+        sys.stdout.write('%-24s %8.1f ms\n' % (name, seconds * 1000))
+    if sys.version_info >= (3, 7):
+        sys.stdout.write('slowest imports (cumulative):\n')
+        for microseconds, name in slowest_imports():
+            sys.stdout.write(
+                '  %-24s %8.1f ms\n' % (name, microseconds / 1000.0))
+
+
+if __name__ == '__main__':
+    main()
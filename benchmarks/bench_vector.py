@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+'''Compare running one arithmetic program over many inputs with one
+BefungeInterpreter per input and with one VectorInterpreter for all of them.
+
+Run it from the root of the repository (needs NumPy)::
+
+    python benchmarks/bench_vector.py [LANES]
+
+The program squares its input modulo 15876 a hundred times and prints the
+result, so every lane runs the same 2000 steps.
+
+'''
+import os
+import sys
+import time
+
+try:
+    from StringIO import StringIO
+except ImportError:  # python3
+    from io import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from befunge_shell import BefungeInterpreter, INT64
+from befunge_vector import run_lanes
+
+LOOP = '&"d">\\:*7+"~~"*%\\1-:#v_$.@'
+SOURCE = '\n'.join([LOOP, '    ^' + ' ' * (LOOP.index('v') - 5) + '<'])
+
+
+def run_scalar(inputs):
+    outputs = []
+    for numbers in inputs:
+        output = StringIO()
+        BefungeInterpreter(
+            SOURCE, stdin=StringIO(' '.join(map(str, numbers))),
+            stdout=output, cells=INT64).run()
+        outputs.append(output.getvalue())
+    return outputs
+
+
+def run_vector(inputs):
+    return [result.output for result in run_lanes(SOURCE, inputs)]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    lanes = int(argv[0]) if argv else 10000
+    inputs = [[number] for number in range(lanes)]
+    timings = []
+    for name, run in [('interpreter per input', run_scalar),
+                      ('vector interpreter', run_vector)]:
+        start = time.time()
+        outputs = run(inputs)
+        timings.append(time.time() - start)
+        sys.stdout.write('%-22s %8.3f s %12.0f inputs/s\n' % (
+            name, timings[-1], lanes / timings[-1]))
+        if len(timings) == 1:
+            expected = outputs
+        elif outputs != expected:
+            sys.stdout.write('the outputs differ!\n')
+            return 1
+    sys.stdout.write('speedup: %.1fx\n' % (timings[0] / timings[1]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
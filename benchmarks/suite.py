@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+'''Reproducible benchmark suite of canonical befunge workloads.
+
+Every workload runs in a fresh Python process, so that its peak RSS is not
+influenced by the other workloads. Run the whole suite from the root of the
+repository and save the results::
+
+    python benchmarks/suite.py --output results.json
+
+and compare a later run against them::
+
+    python benchmarks/suite.py --compare results.json
+
+For every workload the suite reports the executed befunge operations per
+second, the peak RSS of its process, the memory blocks retained per operation
+and the peak of the memory traced by tracemalloc (where available).
+
+The retained blocks are the difference of sys.getallocatedblocks() before and
+after the run, divided by the operations. Blocks which are allocated and freed
+again during the run cancel out, so this is not the number of allocations per
+operation: it stays near zero for a workload which allocates a lot but keeps
+nothing, and grows for one which leaks or keeps growing a structure like the
+stack.
+
+'''
+from __future__ import with_statement
+
+import os
+import sys
+import json
+import time
+import subprocess
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from befunge_shell import BefungeShell, BefungeInterpreter
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:  # python < 3.4
+    tracemalloc = None
+
+# a loop which counts down from 6561 to zero; the body is filled in by the
+# workloads
+LOOP = '99*99**>%s1-:#v_@\n%s^%s<'
+
+# a loop which passes a "?" on every iteration. All directions except left
+# lead back to the "?"
+RANDOM_LOOP = '\n'.join([
+    '99*99**>1-:#v_@',
+    '',
+    '          v',
+    '       ^  ?<<',
+    '          ^'])
+
+
+def loop(body):
+    return LOOP % (body, ' ' * 7, ' ' * (len(body) + 4))
+
+
+def null_output():
+    return open(os.devnull, 'w')
+
+
+def arithmetic_shell(scale):
+    shell = BefungeShell(stdout=null_output())
+    commands = list('55*3*52*+$') * (10000 * scale)
+    default = shell.default
+
+    def run():
+        for command in commands:
+            default(command)
+        return len(commands)
+    return run
+
+
+def arithmetic_batch(scale):
+    shell = BefungeShell(stdout=null_output())
+    lines = ['55*3*52*+$', '98*7+:*$', '12\\$:+$'] * (10000 * scale)
+
+    def run():
+        shell.run_commands(lines)
+        return sum(len(line) for line in lines)
+    return run
+
+
+def arithmetic_interpreter(scale):
+    source = loop('88*4+2*3-$')
+
+    def run():
+        steps = 0
+        for _ in range(scale):
+            interpreter = BefungeInterpreter(source, stdout=null_output())
+            steps += interpreter.run()
+        return steps
+    return run
+
+
+def string_push_batch(scale):
+    shell = BefungeShell(stdout=null_output())
+    line = '"%s"' % ('Hello, World! ' * 1000)
+
+    def run():
+        shell.run_commands([line] * (50 * scale))
+        del shell.stack[:]
+        return len(line) * 50 * scale
+    return run
+
+
+def deep_stack_batch(scale):
+    shell = BefungeShell(stdout=null_output())
+    lines = ['9' * 1000] * (1000 * scale)
+
+    def run():
+        shell.run_commands(lines)
+        return 1000 * 1000 * scale
+    return run
+
+
+def output_interpreter(scale):
+    source = loop(':.:52*%68*+,')
+
+    def run():
+        steps = 0
+        for _ in range(scale):
+            interpreter = BefungeInterpreter(source, stdout=null_output())
+            steps += interpreter.run()
+        return steps
+    return run
+
+
+def random_interpreter(scale):
+    def run():
+        steps = 0
+        for _ in range(scale):
+            interpreter = BefungeInterpreter(
+                RANDOM_LOOP, stdout=null_output(), seed=42)
+            steps += interpreter.run()
+        return steps
+    return run
+
+
+WORKLOADS = [
+    arithmetic_shell,
+    arithmetic_batch,
+    arithmetic_interpreter,
+    string_push_batch,
+    deep_stack_batch,
+    output_interpreter,
+    random_interpreter,
+]
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on mac os, kilobytes everywhere else
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_workload(name, scale):
+    '''Run one workload in the current process and return its measurements'''
+    workload = dict((w.__name__, w) for w in WORKLOADS)[name]
+    result = {}
+    get_blocks = getattr(sys, 'getallocatedblocks', None)
+    run = workload(scale)
+    blocks = get_blocks() if get_blocks else None
+    start = time.time()
+    ops = run()
+    result['seconds'] = time.time() - start
+    result['ops'] = ops
+    result['ops_per_second'] = ops / result['seconds']
+    result['peak_rss_kb'] = peak_rss_kb()
+    if get_blocks is not None:
+        result['retained_blocks_per_op'] = (
+            float(get_blocks() - blocks) / ops)
+    if tracemalloc is not None:
+        run = workload(scale)
+        tracemalloc.start()
+        run()
+        result['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def run_isolated(name, scale):
+    '''Run one workload in a new Python process'''
+    output = subprocess.check_output([
+        sys.executable, os.path.abspath(__file__),
+        '--run-one', name, '--scale', str(scale)])
+    return json.loads(output.decode('ascii'))
+
+
+def git_commit():
+    try:
+        output = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, 'w'))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def format_result(name, result, baseline=None):
+    line = '%-24s %12.0f ops/s %10s KB RSS %8s retained blocks/op' % (
+        name, result['ops_per_second'],
+        result['peak_rss_kb'] if result['peak_rss_kb'] is not None else '-',
+        '%.3f' % result['retained_blocks_per_op']
+        if 'retained_blocks_per_op' in result else '-')
+    if baseline is not None and name in baseline:
+        line += '  %.2fx' % (
+            result['ops_per_second'] / baseline[name]['ops_per_second'])
+    return line
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options] [WORKLOAD...]')
+    parser.add_option(
+        '--scale', type='int', default=1,
+        help='multiply the size of every workload by SCALE (default: 1)')
+    parser.add_option(
+        '--output', metavar='FILE', help='save the results as JSON to FILE')
+    parser.add_option(
+        '--compare', metavar='FILE',
+        help='show the speedup compared to the results saved in FILE')
+    parser.add_option('--run-one', metavar='WORKLOAD', help='internal')
+    options, names = parser.parse_args(argv)
+    if options.run_one:
+        json.dump(run_workload(options.run_one, options.scale), sys.stdout)
+        return
+    names = names or [workload.__name__ for workload in WORKLOADS]
+    baseline = None
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)['results']
+    results = {}
+    for name in names:
+        results[name] = run_isolated(name, options.scale)
+        sys.stdout.write(format_result(name, results[name], baseline) + '\n')
+        sys.stdout.flush()
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'python': sys.version.split()[0],
+                'scale': options.scale,
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+import sys
+
+# befunge_server needs asyncio with async and await (python 3.7 or newer)
+collect_ignore = []
+if sys.version_info < (3, 7):
+    collect_ignore.append('test_befunge_server.py')
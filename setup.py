@@ -15,10 +15,30 @@ with open('README.rst') as f:
 # version 2.5, 2.6 and 3.0 need the 3rd party package ordereddict
 py_version = sys.version_info[:2]
 needs_ordereddict = py_version in set([(2, 5), (2, 6), (3, 0)])
+# concurrent.futures is part of the standard library since python 3.2
+needs_futures = py_version < (3, 2)
+# the shell server is written with async/await and asyncio.run
+with_server = py_version >= (3, 7)
+
+modules = ['befunge_shell', 'befunge_run', 'befunge_vector', 'befunge_compile']
+if with_server:
+    modules.append('befunge_server')
 
 extra = {}
 if with_setuptools:
     extra['install_requires'] = ['ordereddict'] if needs_ordereddict else []
+    if needs_futures:
+        extra['install_requires'].append('futures')
+    # befunge_vector runs programs over many inputs at once with NumPy
+    extra['extras_require'] = {'vector': ['numpy']}
+    extra['entry_points'] = {
+        'console_scripts': [
+            'befunge-shell = befunge_shell:main',
+            'befunge-run = befunge_run:main',
+            'befunge-compile = befunge_compile:main']}
+    if with_server:
+        extra['entry_points']['console_scripts'].append(
+            'befunge-server = befunge_server:main')
 
 setup(
     name='befungeshell',
@@ -46,7 +66,7 @@ setup(
         'Programming Language :: Python :: 3.1',
         'Programming Language :: Python :: 3.2',
         'Topic :: Software Development'],
-    py_modules=['befunge_shell'],
-    scripts=['befunge_shell.py'],
+    py_modules=modules,
+    scripts=[module + '.py' for module in modules],
     **extra
 )
@@ -0,0 +1,108 @@
+import sys
+import subprocess
+
+try:
+    from StringIO import StringIO
+except ImportError:  # python3
+    from io import StringIO
+
+import pytest
+
+from befunge_shell import BefungeInterpreter, INT32, INT64, UNBOUNDED
+from befunge_compile import compile_program, main
+
+HELLO = 'v\n>"!dlrow ,olleH">:#,_@'
+# print the numbers from 9 to 1
+COUNTDOWN = '9>:.1-:#v_@\n ^      <'
+# print z for 0, count down from the input otherwise
+BRANCH_AND_LOOP = '\n'.join([
+    '&:#v_"z",@',
+    '   >:.1-:#v_@',
+    '   ^      <',
+])
+
+
+def run_compiled(source, stdin='', cells=UNBOUNDED):
+    namespace = {'__name__': 'compiled'}
+    exec(compile(compile_program(source, cells), 'compiled', 'exec'),
+         namespace)
+    output = StringIO()
+    machine = namespace['Machine'](stdin=StringIO(stdin), stdout=output)
+    namespace['run'](machine)
+    return output.getvalue(), list(machine.stack)
+
+
+def run_interpreted(source, stdin='', cells=UNBOUNDED):
+    output = StringIO()
+    interpreter = BefungeInterpreter(
+        source, stdin=StringIO(stdin), stdout=output, cells=cells)
+    interpreter.run()
+    return output.getvalue(), list(interpreter.stack)
+
+
+@pytest.mark.parametrize(('source', 'stdin'), [
+    (HELLO, ''),
+    (COUNTDOWN, ''),
+    ('&&*.&~~..@', '6 7\n-3\nab'),
+    ('&&/.&&%.45`.54`.3!.0!.@', '-7 2 -7 2'),
+    # g, and # which skips a cell
+    ('01g.#@10g.@', ''),
+    # a branch into a loop or out of the program
+    (BRANCH_AND_LOOP, '4'),
+    (BRANCH_AND_LOOP, '0'),
+    # p into a cell which is no command
+    ('"x"99p5.@', ''),
+])
+def test_same_as_interpreter(source, stdin):
+    assert run_compiled(source, stdin) == run_interpreted(source, stdin)
+
+
+@pytest.mark.parametrize('cells', [INT32, INT64])
+def test_cells(cells):
+    source = '2:*:*:*:*:*:*:*.07-2/.@'
+    assert run_compiled(source, cells=cells) == run_interpreted(
+        source, cells=cells)
+    # the input wraps around, too
+    stdin = '%d\n' % (2 ** 64 + 2 ** 33 + 7)
+    wrapped = 7 if cells == INT32 else 2 ** 33 + 7
+    assert run_compiled('&.@', stdin, cells) == run_interpreted(
+        '&.@', stdin, cells) == ('%d ' % wrapped, [])
+
+
+def test_self_modifying():
+    # p replaces the command . by @, so 5 is never printed
+    source = '"@"70p5.@'
+    assert run_compiled(source) == run_interpreted(source) == ('', [5])
+
+
+def test_random_directions():
+    # every direction but > leads back to ?
+    assert run_compiled('?@') == ('', [])
+
+
+def test_idle_loops():
+    # programs which loop forever without a command, and the empty program
+    for source in ['>', '>v\n^<', '']:
+        namespace = {'__name__': 'compiled'}
+        exec(compile(compile_program(source), 'compiled', 'exec'), namespace)
+        assert namespace['BLOCKS']
+
+
+def test_module_runs_alone(tmpdir):
+    program = tmpdir.join('hello.bf')
+    program.write(HELLO)
+    assert main([str(program)]) == 0
+    module = tmpdir.join('hello.py')
+    assert 'befunge_shell' not in module.read()
+    output = subprocess.check_output(
+        [sys.executable, str(module)], cwd=str(tmpdir))
+    assert output == b'Hello, world!'
+
+
+def test_output_option(tmpdir):
+    program = tmpdir.join('countdown.bf')
+    program.write(COUNTDOWN)
+    target = tmpdir.join('count.py')
+    main([str(program), '-o', str(target), '--cells', 'int32'])
+    output = subprocess.check_output([sys.executable, str(target)])
+    assert output == b'9 8 7 6 5 4 3 2 1 '
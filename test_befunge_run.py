@@ -0,0 +1,56 @@
+from befunge_run import RunResult, run_job, run_many, main
+from befunge_shell import Limits
+
+
+def test_run_job():
+    result = run_job(('&2*.@', '21\n'))
+    assert result.output == '42 '
+    assert result.steps == 5
+    assert result.error is None
+    assert result.wall_time >= 0
+
+
+def test_run_job_error():
+    # the division by zero fails in the fifth step
+    result = run_job(('1.10/@', ''))
+    assert result.output == '1 '
+    assert result.error.startswith('ZeroDivisionError')
+    assert result.steps == 5
+
+
+def test_run_many_in_order():
+    jobs = [('&.@', '%d\n' % i) for i in range(20)]
+    outputs = [result.output for result in run_many(jobs, max_workers=2)]
+    assert outputs == ['%d ' % i for i in range(20)]
+
+
+def test_run_many_single_worker():
+    results = list(run_many([('1.@', ''), ('2.@', '')], max_workers=1))
+    assert [result.output for result in results] == ['1 ', '2 ']
+    assert all(isinstance(result, RunResult) for result in results)
+
+
+def test_main(tmpdir, capsys):
+    program = tmpdir.join('double.bf')
+    program.write('&2*.@')
+    first = tmpdir.join('first')
+    first.write('1\n')
+    second = tmpdir.join('second')
+    second.write('5\n')
+    assert main(['-j', '1', '-i', str(first), '-i', str(second),
+                 str(program)]) == 0
+    out = capsys.readouterr()[0]
+    assert '2 ' in out and '10 ' in out
+    assert out.count('==> %s < ' % program) == 2
+
+
+def test_limits(tmpdir, capsys):
+    result = run_job(('>v\n^<', ''), Limits(steps=1000))
+    assert result.limit == 'steps'
+    assert result.steps == 1000
+    assert run_job(('1.@', ''), Limits(steps=1000)).limit is None
+    program = tmpdir.join('loop.bf')
+    program.write('>1.v\n^  <')
+    assert main(['-j', '1', '--max-output', '100', str(program)]) == 1
+    out = capsys.readouterr()[0]
+    assert out.endswith('Stopped: the limit of output bytes was reached\n')
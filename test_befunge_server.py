@@ -0,0 +1,118 @@
+import os
+import asyncio
+
+from befunge_server import start_server
+
+
+def with_server(tmpdir, client):
+    '''Start a server on a Unix socket in *tmpdir* and return the result of
+    the coroutine function *client*, which is called with a function to
+    open connections to it'''
+    path = os.path.join(str(tmpdir), 'befunge.sock')
+
+    async def main():
+        server = await start_server(path=path)
+        writers = []
+
+        async def connect():
+            reader, writer = await asyncio.open_unix_connection(path)
+            writers.append(writer)
+            await reader.readuntil(b'>>> ')
+            return reader, writer
+        try:
+            return await client(connect)
+        finally:
+            for writer in writers:
+                writer.close()
+            # let the sessions see the end of their connections
+            while len(asyncio.all_tasks()) > 1:
+                await asyncio.sleep(0.01)
+            server.close()
+            await server.wait_closed()
+    return asyncio.run(main())
+
+
+def exchange(tmpdir, *lines):
+    '''Send every (line, end) pair of *lines* to a new session and return
+    the answers of the server up to *end*'''
+    async def client(connect):
+        reader, writer = await connect()
+        answers = []
+        for line, end in lines:
+            writer.write(line.encode() + b'\n')
+            answers.append((await reader.readuntil(end)).decode())
+        return answers
+    return with_server(tmpdir, client)
+
+
+def test_commands(tmpdir):
+    answers = exchange(
+        tmpdir, ('12+', b'>>> '), ('show_stack', b'>>> '), ('.', b'>>> '))
+    assert answers == ['>>> ', '[3]\n>>> ', '3\n>>> ']
+
+
+def test_input_is_awaited(tmpdir):
+    answers = exchange(
+        tmpdir, ('2&*.~.', b': '), ('21', b': '), ('a', b'>>> '))
+    assert answers == ['Enter a number please: ',
+                       '42\nEnter one character please: ', '97\n>>> ']
+
+
+def test_error_keeps_session(tmpdir):
+    answers = exchange(tmpdir, ('10/', b'>>> '), ('5.', b'>>> '))
+    assert answers[0].startswith('Error: ZeroDivisionError')
+    assert answers[1] == '5\n>>> '
+
+
+def test_sessions_are_separate(tmpdir):
+    async def client(connect):
+        first_reader, first_writer = await connect()
+        second_reader, second_writer = await connect()
+        # the first session waits for input, the second one still works
+        first_writer.write(b'&\n')
+        await first_reader.readuntil(b': ')
+        second_writer.write(b'7\nshow_stack\n')
+        second = await second_reader.readuntil(b']\n')
+        first_writer.write(b'3\nshow_stack\n')
+        first = await first_reader.readuntil(b']\n')
+        return first, second
+    first, second = with_server(tmpdir, client)
+    assert first == b'>>> [3]\n'
+    assert second == b'>>> [7]\n'
+
+
+def test_quit(tmpdir):
+    async def client(connect):
+        reader, writer = await connect()
+        writer.write(b'quit\n')
+        return await reader.read()
+    assert with_server(tmpdir, client) == b''
+
+
+def test_helpers_which_read_files_are_refused(tmpdir):
+    secret = tmpdir.join('secret')
+    secret.write('>"terces"')
+    answers = exchange(tmpdir, ('show_cfg %s' % secret, b'>>> '),
+                       ('show_cfg', b'>>> '), ('show_stack', b'>>> '))
+    assert answers[:2] == ['Error: the command show_cfg is not available\n'
+                           '>>> '] * 2
+    assert answers[2] == '[]\n>>> '
+
+
+def test_cells_are_bounded(tmpdir):
+    # squaring 32 times would build a number of billions of digits
+    answer, = exchange(tmpdir, ('9' + ':*' * 32 + '.', b'>>> '))
+    assert -2 ** 63 <= int(answer.split()[0]) < 2 ** 63
+
+
+def test_stack_depth_is_limited(tmpdir):
+    answers = exchange(tmpdir, ('1' * 60000, b'>>> '), ('1' * 60000, b'>>> '),
+                       ('$', b'>>> '), ('show_stack 1', b'>>> '))
+    assert answers[1] == ('Error: the limit of stack depth was reached, the '
+                          'line was undone\n>>> ')
+    assert answers[3] == '[..., 1]\n>>> '
+
+
+def test_long_line(tmpdir):
+    answers = exchange(tmpdir, ('1' * 100000, b'>>> '), ('5.', b'>>> '))
+    assert answers == ['Error: the line is too long\n>>> ', '5\n>>> ']
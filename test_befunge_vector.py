@@ -0,0 +1,91 @@
+try:
+    from StringIO import StringIO
+except ImportError:  # python3
+    from io import StringIO
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from befunge_shell import BefungeInterpreter, INT64
+from befunge_vector import VectorInterpreter, run_lanes
+
+
+def scalar_run(source, numbers):
+    output = StringIO()
+    interpreter = BefungeInterpreter(
+        source, stdin=StringIO(' '.join(map(str, numbers))), stdout=output,
+        cells=INT64)
+    steps = interpreter.run()
+    return output.getvalue(), list(interpreter.stack), steps
+
+
+def assert_lanes_match(source, inputs):
+    results = run_lanes(source, inputs)
+    assert len(results) == len(inputs)
+    for numbers, result in zip(inputs, results):
+        assert tuple(result) == scalar_run(source, numbers)
+    return results
+
+
+@pytest.mark.parametrize('source', [
+    # arithmetic on the input
+    '&:*7+.&3%.&2/.@',
+    # division and remainder of negative numbers
+    '&&/.&&%.@',
+    # comparison, not, dup, swap and discard
+    '&&`.&!.&&:.\\$.@',
+    # overflow wraps around at 64 bits
+    '&:*:*:*:*:*:*:*.@',
+    # constants and strings, the same in every lane
+    '"ba",,25*:*.@',
+    # the input runs out
+    '&&&...@',
+])
+def test_straight_line(source):
+    inputs = [[i, 2 * i + 1, -i, 3] for i in range(-20, 20)] + [
+        [], [-2 ** 63, -1, -2 ** 63, -1]]
+    assert_lanes_match(source, inputs)
+
+
+def test_branches_split_lanes():
+    # print the sign of the input: 1, 0 or -1
+    source = '\n'.join([
+        '&:v  >1.@',
+        '  >0`|',
+        '     >:!#v_01-.@',
+        '         >0.@',
+    ])
+    inputs = [[i] for i in range(-5, 6)]
+    assert_lanes_match(source, inputs)
+    interpreter = VectorInterpreter(source, inputs)
+    interpreter.run()
+    assert interpreter.splits == 2
+
+
+def test_loops_of_different_length():
+    # count down from the input to zero and print every number
+    source = '&>:.1-:0`#v_@\n ^        <'
+    assert_lanes_match(source, [[n] for n in range(0, 30, 3)])
+
+
+def test_get():
+    source = '&&g.@'
+    inputs = [[0, 0], [1, 0], [4, 0], [200, 0], [-1, 3], [2, 24]]
+    results = assert_lanes_match(source, inputs)
+    assert results[0].output == '%d ' % ord('&')
+
+
+def test_uniform_values_stay_scalar():
+    results = run_lanes('12+:*.@', [[]] * 3)
+    assert [result.output for result in results] == ['9 '] * 3
+
+
+def test_division_by_zero():
+    with pytest.raises(ZeroDivisionError):
+        run_lanes('5&/.@', [[1], [0]])
+
+
+def test_unsupported_command():
+    with pytest.raises(ValueError):
+        run_lanes('?@', [[1]])
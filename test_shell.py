@@ -1,7 +1,18 @@
 from __future__ import with_statement
+import sys
+import json
+import random
+import subprocess
 from operator import add, sub, mul, floordiv, mod, gt as greater
 
-from befunge_shell import Stack, BefungeShell
+from befunge_shell import (Stack, ArrayStack, SpillStack, BefungeShell,
+                           BefungeInterpreter, OutputSink, LINE_BUFFERED,
+                           FULLY_BUFFERED, compile_segment, Program,
+                           ProgramCache, Profile,
+                           main, Playfield, compile_trace,
+                           ControlFlowGraph, INT32, INT64, RandomDirections,
+                           format_directions, parse_directions, InputSource,
+                           Limits, SessionLog, read_session_log)
 
 from mock import Mock
 import pytest
@@ -9,7 +20,12 @@ import pytest
 
 def pytest_generate_tests(metafunc):
     help_messages = dict([
-        ('show_stack', 'print the content of the stack'),
+        ('show_stack', 'print the content of the stack, or only the top N '
+            'values of it\nwith "show_stack N" and the values A to B-1 from '
+            'the bottom with\n"show_stack A:B". With "ascii", runs of '
+            'printable values are shown\nas strings. "summary" prints the '
+            'number of values, the smallest and\nthe largest one and how '
+            'often every byte value occurs.'),
         ('show_pc', 'print the direction of the PC (Program Counter)'),
         ('EOF', 'exit the shell with the command "exit", "quit", or by typing '
             'Ctrl+D'),
@@ -53,6 +69,10 @@ def pytest_generate_tests(metafunc):
         ('.', 'Pop value and output as an integer'),
         (',', 'Pop value and output as ASCII character'),
         ('#', 'Skip the following command'),
+        ('g', 'Get: Pop y and x, then push the value of the playfield cell at '
+             '(x, y)'),
+        ('p', 'Put: Pop y, x and v, then store v in the playfield cell at '
+             '(x, y)'),
         ('&', 'Ask user for a number and push it'),
         ('~', 'Ask user for a character and push its ASCII value'),
         ('@', 'End program')])
@@ -65,7 +85,7 @@ def pytest_generate_tests(metafunc):
         '`': greater
     }
     change_pc_commands = '><^v?_|'
-    unsupported_commands = '#gp'
+    unsupported_commands = '#'
     func_name = metafunc.function.__name__
     if func_name == 'test_shell_calc_op':
         for command, op_func in operators.items():
@@ -203,7 +223,7 @@ def test_parse_change_pc_command(monkeypatch, cmd):
 def test_unsupported_commands(shell, unsupported_cmd):
     shell.parse_command(unsupported_cmd)
     shell.print_.assert_called_with(
-        'Note: The commands #, g, p are not supported.')
+        'Note: The command # is not supported.')
 
 
 def test_unknown_command(shell):
@@ -217,6 +237,16 @@ def test_befunge_cmd_help(shell, cmd, expected_help):
     shell.print_.assert_called_with(expected_help)
 
 
+def test_help_overview(shell):
+    shell.do_help('')
+    printed = [call[0][0] for call in shell.print_.call_args_list if call[0]]
+    assert printed[:3] == [
+        shell.doc_header, shell.ruler * len(shell.doc_header) + '\n',
+        'Befunge Commands']
+    written = ''.join(call[0][0] for call in shell.stdout.write.call_args_list)
+    assert '0' in written.split() and 'show_cfg' in written.split()
+
+
 def test_help_message(shell):
     shell.help_help()
     shell.print_.assert_called_with(
@@ -273,3 +303,1200 @@ def test_convert_invalid_integer(shell):
     shell.print_.assert_called_with(
         'Error: You should have entered an integer!')
     assert ret is None
+
+
+def test_unknown_single_character(shell):
+    shell.default('x')
+    shell.print_.assert_called_with("Error: unknown command 'x'")
+
+
+def test_dispatch_uses_current_stack(shell):
+    shell.stack = Stack([1, 2])
+    shell.default('\\')
+    assert shell.stack == Stack([2, 1])
+
+
+class TestRunCommands(object):
+    def test_many_commands_per_line(self, shell):
+        shell.run_commands(['55*3*', '52* 2*'])
+        assert shell.stack == Stack([75, 20])
+
+    def test_string_mode_keeps_spaces(self, shell):
+        shell.run_commands(['"a b"'])
+        assert shell.stack == Stack([97, 32, 98])
+        assert shell.string_mode == False
+
+    def test_helper_command(self, shell):
+        shell.run_commands(['12', 'show_stack'])
+        shell.print_.assert_called_with('[1, 2]')
+
+    def test_quit_stops_execution(self, shell):
+        assert shell.run_commands(['1', 'quit', '2'])
+        assert shell.stack == Stack([1])
+
+    def test_unknown_command(self, shell):
+        assert not shell.run_commands(['x'])
+        shell.print_.assert_called_with("Error: unknown command 'x'")
+
+
+class Output(list):
+    write = list.append
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return ''.join(self)
+
+
+def run_program(source, stdin=None):
+    output = Output()
+    interpreter = BefungeInterpreter(source, stdin=stdin, stdout=output)
+    interpreter.run()
+    return interpreter, output.getvalue()
+
+
+class TestInterpreter(object):
+    def test_init(self):
+        interpreter = BefungeInterpreter('')
+        assert interpreter.stack == Stack()
+        assert (interpreter.x, interpreter.y) == (0, 0)
+        assert (interpreter.dx, interpreter.dy) == (1, 0)
+        assert len(interpreter.playfield.rows) == 25
+        assert len(interpreter.playfield.rows[0]) == 80
+
+    def test_string_output(self):
+        interpreter, output = run_program('"olleH",,,,,@')
+        assert output == 'Hello'
+        assert interpreter.stack == Stack()
+
+    def test_wraparound(self):
+        assert run_program('<@.+98')[1] == '17 '
+
+    def test_trampoline(self):
+        assert run_program('#@1.@')[1] == '1 '
+
+    def test_vertical_branch(self):
+        assert run_program('v\n0\n|\n1\n.\n@')[1] == '1 '
+
+    def test_shell_semantics(self):
+        interpreter = run_program('56-@')[0]
+        shell = BefungeShell()
+        shell.run_commands(['56-'])
+        assert interpreter.stack == shell.stack == Stack([-1])
+
+    def test_input(self):
+        stdin = Mock(spec=['read'])
+        stdin.read.side_effect = ['42\na', '']
+        interpreter = run_program('&~~@', stdin)[0]
+        assert interpreter.stack == Stack([42, 97, -1])
+
+    def test_steps(self):
+        interpreter = run_program('#@1@')[0]
+        assert interpreter.steps == 3
+
+    def test_from_file(self, tmpdir):
+        program = tmpdir.join('prog.bf')
+        program.write('25*.@')
+        interpreter = BefungeInterpreter.from_file(
+            str(program), stdout=Output())
+        interpreter.run()
+        assert ''.join(interpreter.stdout) == '10 '
+
+
+class TestStackBulkOperations(object):
+    def test_push_many(self, nonempty_stack):
+        nonempty_stack.push_many([4, 5])
+        assert nonempty_stack == Stack([1, 2, 3, 4, 5])
+
+    def test_pop_many(self, nonempty_stack):
+        assert nonempty_stack.pop_many(2) == [3, 2]
+        assert nonempty_stack == Stack([1])
+
+    def test_pop_many_exceptionless(self, nonempty_stack):
+        assert nonempty_stack.pop_many(5) == [3, 2, 1, 0, 0]
+        assert nonempty_stack == Stack()
+
+    def test_extend_from_bytes(self, empty_stack):
+        empty_stack.extend_from_bytes(b'ab')
+        assert empty_stack == Stack([97, 98])
+
+
+class TestArrayStack(object):
+    def test_contract(self):
+        stack = ArrayStack([1, 2])
+        stack.duplicate_top()
+        stack.swap_topmost_values()
+        assert stack.tolist() == [1, 2, 2]
+        assert stack.pop_exceptionless() == 2
+        assert ArrayStack().pop_exceptionless() == 0
+
+    def test_bulk_operations(self):
+        stack = ArrayStack()
+        stack.push_many([1, 2, 3])
+        stack.extend_from_bytes(b'a')
+        assert stack.pop_many(3) == [97, 3, 2]
+        assert stack.tolist() == [1]
+
+    def test_repr(self):
+        assert repr(ArrayStack([1, 2])) == '[1, 2]'
+
+    def test_shell(self):
+        shell = BefungeShell(stack_class=ArrayStack)
+        shell.run_commands(['"ab"55*:+'])
+        assert shell.stack.tolist() == [97, 98, 50]
+
+    def test_interpreter(self):
+        interpreter = BefungeInterpreter(
+            '"ab"55*:+@', stdout=Output(), stack_class=ArrayStack)
+        interpreter.run()
+        assert interpreter.stack.tolist() == [97, 98, 50]
+
+
+class TestSpillStack(object):
+    def stack(self, values=()):
+        # small enough that a few values are spilled to the file
+        return SpillStack(values, memory_limit=4, chunk_size=2)
+
+    def test_contract(self):
+        stack = self.stack([1, 2])
+        stack.duplicate_top()
+        stack.swap_topmost_values()
+        assert list(stack) == [1, 2, 2]
+        assert stack.pop_exceptionless() == 2
+        assert self.stack().pop_exceptionless() == 0
+
+    def test_spill(self):
+        stack = self.stack(range(10))
+        assert len(stack) == 10
+        assert stack == list(range(10))
+        assert stack[0] == 0 and stack[-10] == 0
+        assert stack[3:7] == [3, 4, 5, 6]
+        del stack[-9]
+        assert [stack.pop() for _ in range(9)] == [9, 8, 7, 6, 5, 4, 3, 2, 0]
+        assert not stack
+        with pytest.raises(IndexError):
+            stack.pop()
+
+    def test_bulk_operations(self):
+        stack = self.stack()
+        stack.push_many(range(7))
+        stack.extend_from_bytes(b'ab')
+        assert stack.pop_many(4) == [98, 97, 6, 5]
+        del stack[2:]
+        assert stack == [0, 1]
+
+    def test_values_which_are_no_64_bit_integers(self):
+        values = [2 ** 70, None, -2 ** 63, 1, 2, 3, 4, 5]
+        stack = self.stack(values)
+        assert repr(stack) == repr(values)
+        assert stack.pop_many(8) == values[::-1]
+
+    def test_shell(self):
+        shell = BefungeShell(stdout=Output(), stack_class=self.stack)
+        shell.run_commands(['"abcdef"55*:+', 'show_stack'])
+        assert shell.stack == [97, 98, 99, 100, 101, 102, 50]
+        assert shell.stdout.getvalue() == \
+            '[97, 98, 99, 100, 101, 102, 50]\n'
+
+    def test_interpreter(self):
+        interpreter = BefungeInterpreter(
+            '"abcdef"55*:+@', stdout=Output(), stack_class=self.stack)
+        interpreter.run()
+        assert interpreter.stack == [97, 98, 99, 100, 101, 102, 50]
+
+    def test_main(self, tmpdir, capsys):
+        commands = tmpdir.join('commands')
+        commands.write('"abcdefgh"\n$\nshow_stack\n')
+        main(['--stack-memory', '4', '--batch', str(commands)])
+        assert capsys.readouterr()[0] == \
+            '[97, 98, 99, 100, 101, 102, 103]\n'
+
+
+class TestShowStack(object):
+    def show_stack(self, arg, values):
+        shell = BefungeShell(stdout=Output())
+        shell.stack.push_many(values)
+        shell.onecmd('show_stack ' + arg)
+        return shell.stdout.getvalue()
+
+    def test_pages(self):
+        assert self.show_stack('', range(5000)) == \
+            repr(list(range(5000))) + '\n'
+
+    def test_top(self):
+        assert self.show_stack('2', [1, 2, 3]) == '[..., 2, 3]\n'
+        assert self.show_stack('5', [1, 2, 3]) == '[1, 2, 3]\n'
+
+    def test_range(self):
+        assert self.show_stack('1:3', [1, 2, 3, 4]) == '[..., 2, 3, ...]\n'
+        assert self.show_stack(':-3', [1, 2, 3, 4]) == '[1, ...]\n'
+        assert self.show_stack('2:', range(5000)) == \
+            '[..., %s]\n' % ', '.join(map(str, range(2, 5000)))
+
+    def test_ascii(self):
+        values = [0, 104, 105, None, 33, 10, 34]
+        assert self.show_stack('ascii', values) == \
+            '[0, "hi", None, "!", 10, "\\""]\n'
+        assert self.show_stack('ascii 3', values) == '[..., "!", 10, "\\""]\n'
+
+    def test_summary(self):
+        assert self.show_stack('summary', [300, 97, None, 97, -1, 1]) == (
+            '6 values from -1 to 300\n'
+            '1 of them are no integers\n'
+            '    1              1 %s\n'
+            "   97 'a'          2 %s\n" % ('#' * 20, '#' * 40))
+        assert self.show_stack('summary', []) == '0 values\n'
+
+    def test_invalid_arguments(self):
+        for arg in ['x', '-1', '1 2', '1:2:3']:
+            assert self.show_stack(arg, [1]).startswith('Error:')
+
+
+def test_string_mode_across_lines(shell):
+    shell.run_commands(['"a', 'b"1'])
+    assert shell.stack == Stack([97, 98, 1])
+
+
+def test_interpreter_string_steps():
+    interpreter = run_program('"ab"@')[0]
+    assert interpreter.steps == 5
+    assert interpreter.stack == Stack([97, 98])
+
+
+def test_interpreter_string_mode_leftwards():
+    interpreter = run_program('<@"ab"')[0]
+    assert interpreter.stack == Stack([98, 97])
+
+
+class TestOutputSink(object):
+    def test_unbuffered(self):
+        stream = Mock(spec=['write', 'flush'])
+        sink = OutputSink(stream)
+        sink.write('a', '\n')
+        stream.write.assert_called_with('a\n')
+        assert stream.flush.called
+
+    def test_line_buffered(self):
+        stream = Output()
+        sink = OutputSink(stream, LINE_BUFFERED)
+        sink.write_int(42, ' ')
+        assert stream.getvalue() == ''
+        sink.write_char(97, '\n')
+        assert stream.getvalue() == '42 a\n'
+
+    def test_fully_buffered(self):
+        stream = Output()
+        sink = OutputSink(stream, FULLY_BUFFERED, buffer_size=4)
+        sink.write('abc', '\n')
+        assert stream.getvalue() == 'abc\n'
+        sink.write('d')
+        assert stream.getvalue() == 'abc\n'
+        sink.flush()
+        assert stream.getvalue() == 'abc\nd'
+
+    def test_size(self):
+        sink = OutputSink(Output(), FULLY_BUFFERED)
+        sink.write_char(97)
+        sink.write_char(233, '\n')
+        # the size counts bytes in UTF-8, both buffered and written ones
+        assert sink.size == 4
+        sink.flush()
+        assert sink.size == sink.written == 4
+
+    def test_invalid_mode(self):
+        with pytest.raises(ValueError):
+            OutputSink(Output(), 'sometimes')
+
+    def test_flush_before_input(self):
+        stdin = Mock(spec=['read'])
+        output = Output()
+        stdin.read.side_effect = lambda n: output.getvalue()[:1]
+        interpreter = BefungeInterpreter('"?",~@', stdin=stdin, stdout=output)
+        interpreter.run()
+        assert interpreter.stack == Stack([ord('?')])
+
+
+def test_shell_output_int():
+    output = Output()
+    shell = BefungeShell(stdout=output, buffering=FULLY_BUFFERED)
+    shell.run_commands(['55*.'])
+    assert output.getvalue() == '25\n'
+
+
+class TestCompileSegment(object):
+    def run_both(self, commands, values):
+        compiled = BefungeShell()
+        compiled.stack = Stack(values)
+        dispatched = BefungeShell()
+        dispatched.stack = Stack(values)
+        errors = []
+        for run in (lambda: compile_segment(commands)(compiled),
+                    lambda: [dispatched.default(c) for c in commands]):
+            try:
+                run()
+            except (IndexError, ZeroDivisionError) as e:
+                errors.append(type(e))
+            else:
+                errors.append(None)
+        return compiled.stack, dispatched.stack, errors
+
+    def test_constant_folding(self):
+        machine = BefungeShell()
+        compile_segment('55*3*52*+')(machine)
+        assert machine.stack == Stack([85])
+
+    def test_cached(self):
+        assert compile_segment('12+') is compile_segment('12+')
+
+    def test_operator_on_real_stack(self, shell):
+        shell.stack = Stack([7])
+        compile_segment('2*')(shell)
+        assert shell.stack == Stack([14])
+
+    def test_division_by_zero(self, shell):
+        with pytest.raises(ZeroDivisionError):
+            compile_segment('10/')(shell)
+
+    def test_same_as_dispatch(self):
+        rng = random.Random(4)
+        alphabet = '0123456789+-*/%`!:\\$'
+        for _ in range(500):
+            commands = ''.join(
+                rng.choice(alphabet) for _ in range(rng.randint(1, 8)))
+            values = [rng.randint(-5, 5) for _ in range(rng.randint(0, 3))]
+            compiled, dispatched, errors = self.run_both(commands, values)
+            assert errors[0] == errors[1], commands
+            if errors[0] is None:
+                assert compiled == dispatched, (commands, values)
+
+    def test_peepholes(self):
+        for commands, values, expected in [
+                (':+', [4], [8]), (':+', [], [0]), (':*', [3], [9]),
+                (':*', [], [0]), ('\\$', [1, 2], [2])]:
+            assert self.run_both(commands, values)[0] == Stack(expected)
+
+
+class TestProgramCache(object):
+    def test_hits_and_misses(self):
+        cache = ProgramCache()
+        program = cache.get('1.@')
+        assert cache.get('1.@') is program
+        assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 0)
+
+    def test_lru_eviction(self):
+        cache = ProgramCache(maxsize=2)
+        first = cache.get('1@')
+        cache.get('2@')
+        cache.get('1@')
+        cache.get('3@')
+        assert len(cache) == 2
+        assert cache.evictions == 1
+        assert cache.get('1@') is first
+        assert cache.misses == 3
+
+    def test_str(self):
+        cache = ProgramCache(maxsize=4)
+        cache.get('@')
+        assert str(cache) == (
+            'programs: 1/4, hits: 0, misses: 1, evictions: 0')
+
+    def test_interpreter_reuses_program(self):
+        cache = ProgramCache()
+        first = BefungeInterpreter('12+.@', stdout=Output(), cache=cache)
+        first.run()
+        second = BefungeInterpreter('12+.@', stdout=Output(), cache=cache)
+        second.run()
+        assert first.program is second.program
+        assert first.playfield is not second.playfield
+        assert ''.join(second.stdout) == '3 '
+        assert cache.hits == 1
+
+    def test_without_cache(self):
+        interpreter = BefungeInterpreter('@', cache=None)
+        assert interpreter.program.source == '@'
+
+
+class TestSegments(object):
+    def test_segment_at(self):
+        program = Program('12 +.@')
+        assert program.playfield.segment_at(0, 0, 1, 0)[1] == 5
+
+    def test_single_command(self):
+        assert Program('1@').playfield.segment_at(0, 0, 1, 0) is False
+
+    def test_segment_wraps(self):
+        program = Program('<@2 1')
+        assert program.playfield.segment_at(4, 0, -1, 0)[1] == 3
+
+    def test_steps_with_segments(self):
+        interpreter = run_program('55*3*.@')[0]
+        assert interpreter.steps == 7
+
+
+def test_show_cache(shell):
+    shell.do_show_cache('')
+    assert shell.print_.call_args[0][0].startswith('programs: ')
+
+
+class TestProfile(object):
+    def test_disabled_by_default(self, shell):
+        assert shell.profile is None
+        shell.do_show_profile('')
+        shell.print_.assert_called_with(
+            'Profiling is disabled, start the shell with --profile')
+
+    def test_counts_and_depth(self):
+        shell = BefungeShell(profile=True)
+        shell.run_commands(['12+', '3', '4'])
+        shell.default('*')
+        stats = shell.profile.stats
+        assert stats['1'][0] == stats['+'][0] == stats['*'][0] == 1
+        assert stats['1'][2] == 1
+        assert stats['2'][2] == 2
+        assert stats['4'][2] == 3
+        assert shell.stack == Stack([3, 12])
+
+    def test_rows_sorted_by_time(self):
+        profile = Profile()
+        profile.stats = {'+': [2, 0.5, 3], '1': [4, 1.0, 1], '$': [0, 0, 0]}
+        assert profile.rows() == [('1', 4, 1.0, 1), ('+', 2, 0.5, 3)]
+        assert profile.as_dict()['+'] == {
+            'count': 2, 'total_seconds': 0.5, 'max_stack_depth': 3}
+
+    def test_show_profile(self):
+        output = Output()
+        shell = BefungeShell(stdout=output, profile=True)
+        shell.default('5')
+        shell.do_show_profile('')
+        lines = output.getvalue().splitlines()
+        assert lines[0].startswith('command')
+        assert lines[1].split()[:2] == ['5', '1']
+
+
+def test_profile_json(tmpdir):
+    commands = tmpdir.join('commands')
+    commands.write('55*\n')
+    profile = tmpdir.join('profile.json')
+    main(['--batch', str(commands), '--profile-json', str(profile)])
+    assert sorted(json.loads(profile.read())) == ['*', '5']
+
+
+class TestPlayfield(object):
+    def test_get_source(self):
+        playfield = Playfield('ab\ncd')
+        assert playfield.get(1, 1) == ord('d')
+        assert playfield.get(5, 5) == 32
+
+    def test_put_dense(self):
+        playfield = Playfield()
+        assert playfield.put(3, 4, ord('x'))
+        assert playfield.get(3, 4) == ord('x')
+        assert not playfield.put(3, 4, ord('x'))
+
+    def test_put_large_value(self):
+        playfield = Playfield()
+        playfield.put(0, 0, 1000)
+        assert playfield.get(0, 0) == 1000
+        playfield.put(0, 0, 65)
+        assert playfield.get(0, 0) == 65
+        assert playfield.overflow == {}
+
+    def test_put_out_of_bounds(self):
+        playfield = Playfield()
+        assert not playfield.put(-1, 100, 7)
+        assert playfield.get(-1, 100) == 7
+
+    def test_copy(self):
+        playfield = Playfield('a')
+        copy = playfield.copy()
+        copy.put(0, 0, 98)
+        assert playfield.get(0, 0) == 97
+
+
+class TestGetPut(object):
+    def test_shell(self, shell):
+        shell.run_commands(['"A"12p', '12g'])
+        assert shell.stack == Stack([65])
+
+    def test_interpreter_get(self):
+        assert run_program('10g,@x')[1] == '0'
+
+    def test_interpreter_self_modifying(self):
+        # the second row is changed from ">1.@" to ">2.@" before it runs
+        assert run_program('"2"81p v\n       >1.@')[1] == '2 '
+
+    def test_compiled_segment_invalidated(self):
+        cache = ProgramCache()
+        first = BefungeInterpreter('92+.@', stdout=Output(), cache=cache)
+        first.run()
+        second = BefungeInterpreter('92+.@', stdout=Output(), cache=cache)
+        second.stack.push_many([ord('3'), 0, 0])
+        second.put()
+        second.run()
+        assert ''.join(second.stdout) == '5 '
+        assert second.segment_tables is not cache.get('92+.@').segment_tables
+        third = BefungeInterpreter('92+.@', stdout=Output(), cache=cache)
+        third.run()
+        assert ''.join(third.stdout) == '11 '
+
+
+class TestTrace(object):
+    loops = [
+        # countdown
+        '91+>:.1-:v\n   ^     _@',
+        # a second branch within the loop
+        '91+>:2%#v_:.v\n   ^    >   >1-:#v_@\n   ^             <',
+        # string mode
+        '3>"ih",,1-:v\n ^         _@',
+        # p changes a cell of the loop in every iteration
+        '9>:68*+93+0p .1-:v\n ^               _@',
+        # g
+        '9>:1g,1-:v\n ^ABCDEFG_@',
+    ]
+
+    def run(self, source, jit_threshold):
+        output = Output()
+        interpreter = BefungeInterpreter(
+            source, stdout=output, cache=None, jit_threshold=jit_threshold)
+        steps = interpreter.run()
+        return output.getvalue(), steps, list(interpreter.stack)
+
+    @pytest.mark.parametrize('source', loops)
+    def test_same_as_without_jit(self, source):
+        expected = self.run(source, None)
+        assert self.run(source, 1) == expected
+        assert self.run(source, 3) == expected
+
+    def test_compiled(self):
+        interpreter, output = run_program('99*>:.1-:v\n   ^     _@')
+        assert output == ''.join('%d ' % i for i in range(81, 0, -1))
+        trace = interpreter.traces[89]
+        assert (9, 1) in trace.covered
+        assert (10, 1) not in trace.covered
+
+    def test_leaves_at_exit(self):
+        trace = compile_trace(Playfield(' v_@\n >^'), 2, 0)
+        machine = BefungeInterpreter('')
+        machine.stack.push_many([0, 1])
+        # the nonzero value runs the loop once, the zero leaves it
+        assert trace(machine) == (3, 0, 1, 0, 4)
+        assert machine.stack == Stack()
+
+    def test_shared_by_cache(self):
+        cache = ProgramCache()
+        source = '99*>:.1-:v\n   ^     _@'
+        first = BefungeInterpreter(source, stdout=Output(), cache=cache)
+        first.run()
+        second = BefungeInterpreter(source, stdout=Output(), cache=cache)
+        assert second.traces[89] is first.traces[89]
+        second.stack.push_many([ord('2'), 6, 0])
+        second.put()
+        assert 89 not in second.traces
+        assert 89 in cache.get(source).traces
+
+
+class TestControlFlowGraph(object):
+    def test_loop(self):
+        cfg = Program('91+>:.1-:v\n   ^     _@  x').cfg
+        assert list(cfg.blocks) == [(0, 0, 1, 0), (8, 1, -1, 0), (10, 1, 1, 0)]
+        entry = cfg.blocks[0, 0, 1, 0]
+        assert entry.commands == '91+>:.1-:v_'
+        assert entry.branch == '_'
+        assert entry.successors == ((8, 1, -1, 0), (10, 1, 1, 0))
+        assert cfg.blocks[10, 1, 1, 0].branch == '@'
+        assert cfg.dead_cells() == [(13, 1)]
+        assert not cfg.self_modifying
+
+    def test_loop_without_branch(self):
+        cfg = ControlFlowGraph(Playfield('>1.<'))
+        assert [block.successors for block in cfg.blocks.values()] == [
+            ((1, 0, 1, 0),), ((1, 0, 1, 0),)]
+        assert cfg.blocks[1, 0, 1, 0].branch is None
+
+    def test_string_mode_and_bridge(self):
+        cfg = ControlFlowGraph(Playfield('#@">"v\n@    ,p'))
+        assert cfg.dead_cells() == [(1, 0), (0, 1), (6, 1)]
+        assert cfg.reachable.issuperset([(3, 0), (5, 1)])
+
+    def test_self_modifying(self):
+        cfg = ControlFlowGraph(Playfield('v\n>p@'))
+        assert cfg.puts == set([(1, 1)])
+        assert cfg.self_modifying
+
+    def test_show_cfg(self, shell, tmpdir):
+        program = tmpdir.join('prog.bf')
+        program.write('1#@_@')
+        shell.do_show_cfg(str(program))
+        table = shell.print_.call_args[0][0]
+        assert table.splitlines()[0].split() == [
+            '0,0', '>', '1#_', '_', '->', '2,0', '<,', '4,0', '>']
+        assert table.endswith('3 blocks, 5 reachable cells, 0 dead cells')
+
+    def test_show_cfg_missing_file(self, shell, tmpdir):
+        shell.do_show_cfg(str(tmpdir.join('missing.bf')))
+        assert shell.print_.call_args[0][0].startswith('Error: ')
+
+
+class TestUndo(object):
+    def test_undo_lines(self, shell):
+        shell.run_commands(['12', '+', '3*', 'show_stack', '$'],
+                           record_undo=True)
+        assert shell.stack == Stack()
+        assert shell.undo() == 1
+        assert shell.stack == Stack([9])
+        assert shell.undo(2) == 2
+        assert shell.stack == Stack([1, 2])
+        assert shell.undo(10) == 1
+        assert shell.stack == Stack()
+        assert shell.undo() == 0
+
+    def test_undo_command(self, shell):
+        shell.run_commands(['9', '8', '7', 'undo 2', '6'], record_undo=True)
+        assert shell.stack == Stack([9, 6])
+        shell.run_commands(['undo x'], record_undo=True)
+        assert shell.print_.call_args[0][0].startswith('Error: ')
+
+    def test_undo_pops_from_empty_stack(self, shell):
+        shell.run_commands(['$$+'], record_undo=True)
+        shell.undo()
+        assert shell.stack == Stack()
+
+    def test_undo_state(self, shell):
+        shell.run_commands(['v', '"ab', 'c"'], record_undo=True)
+        assert not shell.string_mode
+        shell.undo()
+        assert shell.string_mode
+        assert shell.stack == Stack([97, 98])
+        shell.undo()
+        assert (shell.pc, shell.string_mode) == ('v', False)
+        shell.undo()
+        assert shell.pc == '>'
+
+    def test_undo_put(self, shell):
+        shell.run_commands(['"A"00p', '"B"00p'], record_undo=True)
+        shell.undo()
+        assert shell.playfield.get(0, 0) == 65
+        shell.undo()
+        assert shell.playfield.get(0, 0) == 32
+
+    def test_command_loop(self, shell):
+        for line in ['5', 'show_stack', '6']:
+            shell.onecmd(shell.precmd(line))
+        shell.onecmd(shell.precmd('undo'))
+        assert shell.stack == Stack([5])
+
+    def test_command_loop_not(self, shell):
+        # ! is no shell command, although parseline takes it for one
+        for line in ['5', '!', '3', '!']:
+            shell.onecmd(shell.precmd(line))
+        shell.onecmd(shell.precmd('undo 2'))
+        assert shell.stack == Stack([0])
+
+    def test_batch_mode_does_not_record(self, shell):
+        shell.run_commands(['1', '2'])
+        assert shell.undo() == 0
+        assert shell.stack == Stack([1, 2])
+
+    def test_batch_mode_refuses_undo(self, shell):
+        shell.run_commands(['12', 'snapshot a', '+', 'restore a', '3',
+                            'undo'])
+        assert shell.stack == Stack([3, 3])
+        messages = [call[0][0] for call in shell.print_.call_args_list]
+        assert len(messages) == 3
+        assert all(message.startswith('Error: ') for message in messages)
+        # the command loop records again
+        shell.onecmd(shell.precmd('4'))
+        shell.onecmd(shell.precmd('undo'))
+        assert shell.stack == Stack([3, 3])
+
+    def test_main_batch_refuses_undo(self, tmpdir, capsys):
+        commands = tmpdir.join('commands')
+        commands.write('12\nsnapshot a\n+\nrestore a\nshow_stack\n')
+        main(['--batch', str(commands)])
+        out = capsys.readouterr()[0]
+        assert out.count('Error: ') == 2
+        assert out.endswith('[3]\n')
+
+    def test_many_lines(self, shell):
+        shell.run_commands(['1+'] * 200000, record_undo=True)
+        assert shell.stack == Stack([200000])
+        shell.undo(199990)
+        assert shell.stack == Stack([10])
+
+    def test_snapshot(self, shell):
+        shell.run_commands(['12', 'snapshot a', '3', 'snapshot', '4'],
+                           record_undo=True)
+        shell.restore()
+        assert shell.stack == Stack([1, 2, 3])
+        shell.run_commands(['restore a'], record_undo=True)
+        assert shell.stack == Stack([1, 2])
+        # the default snapshot was undone
+        shell.run_commands(['restore'], record_undo=True)
+        assert shell.print_.call_args[0][0] == "Error: there is no snapshot ''"
+
+    def test_snapshot_too_old(self, monkeypatch):
+        monkeypatch.setattr(BefungeShell, 'print_', Mock())
+        shell = BefungeShell(stdout=Output(), undo_limit=2)
+        shell.run_commands(['snapshot', '1', '2', '3'], record_undo=True)
+        with pytest.raises(ValueError):
+            shell.restore()
+        assert shell.stack == Stack([1, 2, 3])
+
+
+def test_fast_start(tmpdir):
+    # batch mode must not import what only some commands or the interactive
+    # command loop need
+    commands = tmpdir.join('commands')
+    commands.write('55*\nshow_stack\n')
+    code = ('import sys, befunge_shell; befunge_shell.main(["--batch", %r]); '
+            'print(sorted(set(["random", "json", "hashlib", "readline"]) & '
+            'set(sys.modules)))' % str(commands))
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.decode().splitlines() == ['[25]', '[]']
+
+
+class TestCellModes(object):
+    # doubles the value 1 for 63 times in a loop
+    doubling = '197*>\\:+\\1-:v\n    ^       _$.@'
+
+    @pytest.mark.parametrize(('cells', 'expected'), [
+        (None, 2 ** 63), (INT64, -2 ** 63), (INT32, 0)])
+    def test_interpreter(self, cells, expected):
+        for jit_threshold in (None, 1):
+            kwargs = {} if cells is None else {'cells': cells}
+            output = Output()
+            BefungeInterpreter(self.doubling, stdout=output, cache=None,
+                               jit_threshold=jit_threshold, **kwargs).run()
+            assert output.getvalue() == '%d ' % expected
+
+    @pytest.mark.parametrize(('commands', 'expected'), [
+        # 2 ** 16 * 2 ** 15 and that minus one
+        ('2:*:*:*:*:2/*', -2 ** 31),
+        ('2:*:*:*:*:2/*1-', 2 ** 31 - 1),
+        ('7:*:*:*:*:*', ((7 ** 32 + 2 ** 31) % 2 ** 32) - 2 ** 31),
+        ('07-2/', -3),
+        ('07-2%', -1),
+        ('702-%', 1),
+    ])
+    def test_shell(self, commands, expected):
+        compiled = BefungeShell(stdout=Output(), cells=INT32)
+        compiled.run_commands([commands])
+        # one command at a time, without compiled segments
+        single = BefungeShell(stdout=Output(), cells=INT32)
+        single.run_commands(list(commands))
+        assert compiled.stack == single.stack == Stack([expected])
+
+    def test_input(self):
+        # values read by & wrap around like the results of the commands
+        def stdin():
+            stream = Mock(spec=['read'])
+            stream.read.side_effect = [
+                '%d %d\n' % (2 ** 32 + 5, -2 ** 31 - 1), '']
+            return stream
+        interpreter = BefungeInterpreter('&&@', stdin=stdin(),
+                                         stdout=Output(), cells=INT32)
+        interpreter.run()
+        shell = BefungeShell(stdin=stdin(), stdout=Output(), cells=INT32,
+                             bulk_input=True)
+        shell.run_commands(['&&'])
+        assert interpreter.stack == shell.stack == Stack([5, 2 ** 31 - 1])
+
+    def test_unbounded_division(self):
+        shell = BefungeShell(stdout=Output())
+        shell.run_commands(['07-2/', '07-2%'])
+        assert shell.stack == Stack([-4, 1])
+
+    def test_division_overflow(self):
+        shell = BefungeShell(stdout=Output(), cells=INT32)
+        shell.stack.push_many([-2 ** 31, -1])
+        shell.default('/')
+        assert shell.stack == Stack([-2 ** 31])
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            BefungeShell(cells='int8')
+
+    def test_main(self, tmpdir, capsys):
+        program = tmpdir.join('doubling.bf')
+        program.write(self.doubling)
+        main(['--cells', 'int64', str(program)])
+        assert capsys.readouterr()[0] == '%d ' % -2 ** 63
+
+
+class TestRandomDirections(object):
+    # print 0, 1 or 2 for the directions <, > and v of ? twenty times, ^
+    # chooses again
+    walk = '\n'.join([
+        '45*>>>>>:#v_@',
+        '',
+        '     ^-1.0?1.1-v',
+        '          2',
+        '          .',
+        '          1',
+        '          -',
+        '     ^    <    <',
+        ])
+
+    def test_seed(self):
+        first = [RandomDirections(7).choice('><^v') for _ in range(3)]
+        directions = RandomDirections(7)
+        second = [directions.choice('><^v') for _ in range(10000)]
+        assert first == [second[0]] * 3
+        assert set(second) == set('><^v')
+        assert RandomDirections(8).choice('><^v') in '><^v'
+        other = RandomDirections(8)
+        assert [other.choice('><^v') for _ in range(10000)] != second
+
+    def test_record_and_replay(self):
+        recording = []
+        directions = RandomDirections(3, recording=recording)
+        chosen = [directions.choice('><^v') for _ in range(5000)]
+        assert format_directions(recording) == ''.join(chosen)
+        replay = RandomDirections(replay=parse_directions(''.join(chosen)))
+        assert [replay.choice('><^v') for _ in range(5000)] == chosen
+        with pytest.raises(ValueError):
+            replay.choice('><^v')
+
+    def test_shell(self):
+        first = BefungeShell(stdout=Output(), seed=5)
+        second = BefungeShell(stdout=Output(), seed=5)
+        pcs = []
+        for _ in range(20):
+            first.run_commands(['?'])
+            second.run_commands(['?'])
+            assert first.pc == second.pc
+            pcs.append(first.pc)
+        assert len(set(pcs)) > 1
+
+    def test_interpreter(self):
+        outputs = []
+        for _ in range(2):
+            output = Output()
+            BefungeInterpreter(self.walk, stdout=output, seed=11).run()
+            outputs.append(output.getvalue())
+        assert outputs[0] == outputs[1]
+        assert len(outputs[0].split()) == 20
+
+    def test_main(self, tmpdir, capsys):
+        program = tmpdir.join('walk.bf')
+        program.write(self.walk)
+        recording = tmpdir.join('directions')
+        main(['--record-directions', str(recording), str(program)])
+        recorded = capsys.readouterr()[0]
+        assert len(recording.read().strip()) >= 20
+        main(['--replay-directions', str(recording), str(program)])
+        assert capsys.readouterr()[0] == recorded
+        main(['--seed', '1', str(program)])
+        seeded = capsys.readouterr()[0]
+        main(['--seed', '1', str(program)])
+        assert capsys.readouterr()[0] == seeded
+
+
+class TestInputSource(object):
+    def source(self, text, chunk_size=3):
+        chunks = iter([
+            text[i:i + chunk_size] for i in range(0, len(text), chunk_size)])
+        stdin = Mock(spec=['read'])
+        stdin.read.side_effect = lambda n: next(chunks, '')
+        return InputSource(stdin, chunk_size)
+
+    def test_chars(self):
+        source = self.source('abcdefg')
+        assert [source.read_char() for _ in range(9)] == list('abcdefg') + [
+            '', '']
+
+    def test_words_across_chunks(self):
+        source = self.source('  1234 -56\n\n78')
+        assert [source.read_int() for _ in range(4)] == [1234, -56, 78, -1]
+
+    def test_newline_after_word(self):
+        source = self.source('12\nab 3\n')
+        assert source.read_int() == 12
+        assert source.read_char() == 'a'
+        assert source.read_token() == 'b'
+        assert source.read_int() == 3
+        assert source.read_char() == ''
+
+    def test_no_integer(self):
+        source = self.source('x 5')
+        assert source.read_int() == -1
+        assert source.read_int() == 5
+
+    def test_terminal_is_read_by_line(self):
+        stdin = Mock(spec=['readline', 'isatty'])
+        stdin.isatty.return_value = True
+        stdin.readline.side_effect = ['7\n', 'ab\n']
+        source = InputSource(stdin)
+        assert source.read_int() == 7
+        assert stdin.readline.call_count == 1
+        assert source.read_char() == 'a'
+
+    def test_flush_only_when_reading(self):
+        output = Output()
+        interpreter = BefungeInterpreter(
+            '~,~,"!",@', stdin=self.source('ab', 8).stream, stdout=output)
+        interpreter.run()
+        assert output.getvalue() == 'ab!'
+
+    def test_interpreter(self):
+        stdin = self.source('3 4\nxyz', 1024).stream
+        interpreter = run_program('&&*.~,~,~,~.@', stdin)[0]
+        assert ''.join(interpreter.stdout) == '12 xyz-1 '
+
+    def test_shell(self):
+        stdin = self.source('6\ny').stream
+        output = Output()
+        shell = BefungeShell(stdin=stdin, stdout=output, bulk_input=True)
+        shell.run_commands(['&~~'])
+        assert shell.stack == Stack([6, ord('y'), -1])
+        assert 'Enter' not in output.getvalue()
+
+    def test_main_batch(self, tmpdir, capsys, monkeypatch):
+        commands = tmpdir.join('commands')
+        commands.write('&&+.\n')
+        monkeypatch.setattr(sys, 'stdin', self.source('20 22\n').stream)
+        main(['--batch', str(commands)])
+        assert capsys.readouterr()[0] == '42\n'
+
+    def test_main_batch_stdin(self, tmpdir, capsys, monkeypatch):
+        commands = tmpdir.join('commands')
+        commands.write('&.\n5\n~,\nx\n')
+        with commands.open() as f:
+            monkeypatch.setattr(sys, 'stdin', f)
+            main(['--batch', '-'])
+        assert capsys.readouterr()[0] == '5\nx\n'
+
+
+class TestLimits(object):
+    def test_steps(self):
+        interpreter = BefungeInterpreter('>v\n^<', stdout=Output(),
+                                         limits=Limits(steps=1001))
+        result = interpreter.execute()
+        assert result.limit == 'steps'
+        assert result.steps == 1001
+        assert result.pc == (1, 0, '>')
+        # the limit counts all steps of the interpreter
+        assert interpreter.run() == 0
+
+    def test_program_ends(self):
+        interpreter = BefungeInterpreter('12+@', stdout=Output(),
+                                         limits=Limits(steps=1000))
+        assert interpreter.execute() == (
+            None, 4, Stack([3]), (3, 0, '>'), None)
+
+    def test_errors(self):
+        # a swap with a single value and a division by zero stop the program
+        for source, error, steps in [('1\\@', 'IndexError', 2),
+                                     ('5259!*%@', 'ZeroDivisionError', 7)]:
+            result = BefungeInterpreter(
+                source, stdout=Output(), limits=Limits(steps=1000)).execute()
+            assert result.limit is None
+            assert result.error.startswith(error)
+            assert result.steps == steps
+
+    @pytest.mark.parametrize('jit_threshold', [50, None])
+    @pytest.mark.parametrize(('source', 'steps', 'pc'), [
+        # in a segment, in the swap of a peephole and in a compiled loop
+        # which divides by its counter, 81 times 20 steps after the start
+        ('10/55+.@', 3, (2, 0, '>')),
+        ('1 2\\$\\$@', 6, (5, 0, '>')),
+        ('99*>:9\\/$1-1v\n   ^        _@', 4 + 81 * 20 + 4, (7, 0, '>')),
+    ])
+    def test_failing_command(self, source, steps, pc, jit_threshold):
+        # without a cache, no trace of another run is used
+        interpreter = BefungeInterpreter(source, stdout=Output(), cache=None,
+                                         jit_threshold=jit_threshold)
+        result = interpreter.execute()
+        assert result.error is not None
+        assert (result.steps, result.pc) == (steps, pc)
+        assert bool(interpreter.traces) == (
+            jit_threshold is not None and '_' in source)
+
+    def test_seconds(self):
+        limits = Limits(seconds=0.05, check_every=1000)
+        interpreter = BefungeInterpreter('>v\n^<', stdout=Output(),
+                                         limits=limits)
+        assert interpreter.execute().limit == 'seconds'
+
+    def test_stack_depth(self):
+        result = BefungeInterpreter(
+            '1', stdout=Output(), limits=Limits(stack_depth=1000)).execute()
+        assert result.limit == 'stack_depth'
+        assert 1000 < len(result.stack) < 12000
+
+    def test_output(self):
+        output = Output()
+        result = BefungeInterpreter(
+            '1.', stdout=output, limits=Limits(output_bytes=500)).execute()
+        assert result.limit == 'output_bytes'
+        assert len(output.getvalue()) > 500
+
+    def test_output_bytes(self):
+        # the character 200 takes two bytes in UTF-8, and every one takes a
+        # walk of 80 steps over the row
+        limits = Limits(output_bytes=500, check_every=60)
+        result = BefungeInterpreter(
+            '58*5*,', stdout=Output(), limits=limits).execute()
+        assert result.limit == 'output_bytes'
+        assert 250 * 80 < result.steps < 260 * 80
+
+    def test_compiled_loop(self):
+        # an endless loop around a branch, which is compiled
+        interpreter = BefungeInterpreter('1>:#v_@\n ^  <', stdout=Output(),
+                                         limits=Limits(steps=100000))
+        result = interpreter.execute()
+        assert interpreter.traces
+        assert result.limit == 'steps'
+        assert 100000 <= result.steps < 100010
+
+    def test_shell(self):
+        output = Output()
+        shell = BefungeShell(stdout=output, limits=Limits(stack_depth=5))
+        shell.run_commands(['1111111111', '2', '3'])
+        assert shell.limit_reached == 'stack_depth'
+        assert len(shell.stack) == 10
+        assert 'limit of stack depth' in output.getvalue()
+
+
+class TestSessionLog(object):
+    # one command per line, like typed into the shell
+    session = ['1', '&', '?', '~', '+', '"', 'a', '"', 'show_stack', '?',
+               'undo', ':', '*', '&', 'quit', '5']
+
+    def interactive(self, log, seed):
+        # the inputs of & and ~ come in between
+        lines = (self.session[:2] + ['-12345678901234567890'] +
+                 self.session[2:4] + ['x'] + self.session[4:14] + ['oops'] +
+                 self.session[14:])
+        stdin = Mock(spec=['readline'])
+        stdin.readline.side_effect = [line + '\n' for line in lines]
+        shell = BefungeShell(stdin=stdin, stdout=Output(), seed=seed)
+        shell.use_rawinput = False
+        shell.start_log(log)
+        shell.cmdloop()
+        shell.stop_log()
+        return shell
+
+    def test_replay_interactive_session(self, tmpdir):
+        log = str(tmpdir.join('session.log'))
+        shell = self.interactive(log, 3)
+        replayed = BefungeShell(stdout=Output(), seed=4)
+        assert replayed.replay(log)
+        assert replayed.stack == shell.stack
+        assert replayed.pc == shell.pc
+        assert shell.stack == Stack(
+            [1, -12345678901234567890 + ord('x'), 97 * 97, None])
+        lines, inputs, directions = read_session_log(log)
+        assert [line for line, _ in lines] == self.session[:-1]
+        assert inputs == [-12345678901234567890, ord('x'), None]
+        assert len(directions) == 2
+
+    def test_replay_runs(self, tmpdir):
+        # without undo the single commands are replayed as runs
+        log = str(tmpdir.join('session.log'))
+        self.session = ['1', '&', '?', '~', '+', ':', '.', '?', '3', '\\',
+                        'show_stack', '_', '4', '&', 'quit', '5']
+        shell = self.interactive(log, 5)
+        replayed = BefungeShell(stdout=Output(), seed=6)
+        replayed.run_commands(['9', '8'], record_undo=True)
+        replayed.snapshot('before')
+        assert replayed.replay(log)
+        assert replayed.stack == Stack([9, 8]) + shell.stack
+        assert replayed.pc == shell.pc
+        # the history from before the replay is kept, and every run of the
+        # replay is undone at once
+        assert replayed.undo(2) == 2
+        assert replayed.stack == Stack([9, 8])
+        assert replayed.pc == '>'
+        replayed.run_commands(['3'], record_undo=True)
+        replayed.restore('before')
+        assert replayed.stack == Stack([9, 8])
+        assert replayed.undo() == 1
+        assert replayed.stack == Stack([9])
+        lines, inputs, directions = read_session_log(log)
+        assert [line for line, _ in lines] == self.session[:-1]
+        assert len(directions) == 2
+
+    def test_run_size(self, tmpdir):
+        log = str(tmpdir.join('session.log'))
+        session_log = SessionLog(log, run_size=3)
+        for line in ['1', '2', '+', ':', 'show_stack', '3', '4']:
+            session_log.write_line(line)
+        session_log.close()
+        output = Output()
+        replayed = BefungeShell(stdout=output)
+        replayed.replay(log)
+        assert output.getvalue() == '[3, 3]\n'
+        assert replayed.stack == Stack([3, 3, 3, 4])
+        # the runs are 12+, : and 34
+        assert replayed.undo() == 1
+        assert replayed.stack == Stack([3, 3])
+        assert replayed.undo() == 1
+        assert replayed.stack == Stack([3])
+
+    def test_replay_batch(self, tmpdir):
+        log = str(tmpdir.join('session.log'))
+        shell = BefungeShell(stdout=Output(), seed=1)
+        shell.start_log(log)
+        shell.run_commands(['12+', '"hi"', '??', 'show_stack', '3v'])
+        shell.stop_log()
+        output = Output()
+        replayed = BefungeShell(stdout=output)
+        assert not replayed.replay(log)
+        assert replayed.stack == shell.stack == Stack([3, 104, 105, 3])
+        assert replayed.pc == shell.pc == 'v'
+        assert '[3, 104, 105]' in output.getvalue()
+
+    def test_append(self, tmpdir):
+        log = str(tmpdir.join('session.log'))
+        for line in ['4', '5']:
+            shell = BefungeShell(stdout=Output())
+            shell.start_log(log)
+            shell.run_commands([line])
+            shell.stop_log()
+        replayed = BefungeShell(stdout=Output())
+        replayed.replay(log)
+        assert replayed.stack == Stack([4, 5])
+
+    def test_append_after_quit(self, tmpdir):
+        log = str(tmpdir.join('session.log'))
+        for lines in [['4', 'quit'], ['5', '']]:
+            stdin = Mock(spec=['readline'])
+            stdin.readline.side_effect = [line + '\n' if line else line
+                                          for line in lines]
+            shell = BefungeShell(stdin=stdin, stdout=Output())
+            shell.use_rawinput = False
+            shell.start_log(log)
+            shell.cmdloop()
+            shell.stop_log()
+        replayed = BefungeShell(stdout=Output())
+        assert replayed.replay(log)
+        assert replayed.stack == Stack([4, 5])
+
+    def test_no_log(self, tmpdir):
+        other = tmpdir.join('other')
+        other.write('no log')
+        with pytest.raises(ValueError):
+            BefungeShell().replay(str(other))
+
+    def test_main(self, tmpdir, capsys):
+        log = str(tmpdir.join('session.log'))
+        commands = tmpdir.join('commands')
+        commands.write('7\n6*\n')
+        main(['--log', log, '--batch', str(commands)])
+        commands.write('.\n')
+        main(['--replay', log, '--batch', str(commands)])
+        assert capsys.readouterr()[0] == '42\n'
+
+    def test_main_record_directions(self, tmpdir):
+        # both the log and the file of directions get every direction
+        log = str(tmpdir.join('session.log'))
+        recording = tmpdir.join('directions')
+        commands = tmpdir.join('commands')
+        commands.write('???\n')
+        main(['--log', log, '--record-directions', str(recording),
+              '--batch', str(commands)])
+        directions = read_session_log(log)[2]
+        assert len(directions) == 3
+        assert recording.read() == format_directions(directions) + '\n'